@@ -22,5 +22,6 @@ enum Action {
   @SerializedName("agentForService")  AGENT_FOR_SERVICE,
   @SerializedName("agentsForService") AGENTS_FOR_SERVICE,
   @SerializedName("send")             SEND,
-  @SerializedName("shutdown")         SHUTDOWN;
+  @SerializedName("shutdown")         SHUTDOWN,
+  @SerializedName("wireFormat")       WIRE_FORMAT;
 }
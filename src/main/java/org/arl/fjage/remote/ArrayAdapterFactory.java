@@ -78,7 +78,10 @@ class ArrayAdapterFactory implements TypeAdapterFactory {
           else {
             out.beginObject();
             out.name("clazz").value(rawType.getName());
-            out.name("data").value(Base64.getEncoder().encodeToString(data));
+            out.name("data");
+            // the binary wire format carries the raw bytes
+            if (out instanceof MsgPack.Writer) ((MsgPack.Writer)out).binary(data);
+            else out.value(Base64.getEncoder().encodeToString(data));
             out.endObject();
           }
         }
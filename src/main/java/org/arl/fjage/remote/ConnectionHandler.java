@@ -12,18 +12,34 @@ package org.arl.fjage.remote;
 
 import java.io.*;
 import java.net.*;
+import java.nio.channels.SocketChannel;
 import java.util.*;
 import java.util.concurrent.*;
+import java.util.logging.Level;
 import java.util.logging.Logger;
 import org.arl.fjage.*;
 
 /**
- * Handles a JSON/TCP connection with remote container.
+ * Handles a JSON/TCP or JSON/Unix domain socket connection with remote container.
+ *
+ * A peer may ask to switch to a binary wire format with a "wireFormat" request.
+ * After the response, which is still sent as a JSON line, both directions use
+ * length-prefixed frames: a 4-byte big-endian payload length, a flags byte,
+ * and a MessagePack payload holding the same JSON tree, with primitive arrays
+ * as raw binary data. If the peer also offers zlib compression, large frames
+ * may be compressed, as indicated by the flags byte (0 for none, 1 for zlib).
  */
 class ConnectionHandler extends Thread {
 
-  private Socket sock;
+  static final String MSGPACK = "msgpack";
+  static final int COMPRESS_THRESHOLD = 512;
+
+  private Closeable sock;
+  private InputStream input;
+  private OutputStream output;
   private DataOutputStream out;
+  private boolean binary = false;
+  private FrameCompressor compressor = null;
   private Map<String,Object> pending = Collections.synchronizedMap(new HashMap<String,Object>());
   private Logger log = Logger.getLogger(getClass().getName());
   private RemoteContainer container;
@@ -36,18 +52,55 @@ class ConnectionHandler extends Thread {
     setName(name);
   }
 
+  public ConnectionHandler(SocketChannel ch, String name, RemoteContainer container) {
+    this.sock = ch;
+    this.container = container;
+    this.name = name;
+    input = UnixSockets.getInputStream(ch);
+    output = UnixSockets.getOutputStream(ch);
+    setName(name);
+  }
+
   @Override
   public void run() {
     ExecutorService pool = Executors.newSingleThreadExecutor();
     try {
-      BufferedReader in = new BufferedReader(new InputStreamReader(sock.getInputStream()));
-      out = new DataOutputStream(sock.getOutputStream());
+      if (input == null) {
+        Socket s = (Socket)sock;
+        input = s.getInputStream();
+        output = s.getOutputStream();
+      }
+      BufferedReader in = new BufferedReader(new InputStreamReader(input));
+      DataInputStream frames = null;
+      // buffered, so that each line goes out in one write rather than a write per byte
+      out = new DataOutputStream(new BufferedOutputStream(output));
       while (true) {
-        String s = in.readLine();
-        if (s == null) break;
-        log.fine(name+" <<< "+s);
+        String s = null;
+        byte[] payload = null;
+        if (frames == null) {
+          s = in.readLine();
+          if (s == null) break;
+          log.fine(name+" <<< "+s);
+        } else {
+          int len = frames.readInt();
+          int flags = frames.readUnsignedByte();
+          payload = new byte[len];
+          frames.readFully(payload);
+          if (flags == FrameCompressor.ZLIB_FLAGS) payload = FrameCompressor.decompress(payload);
+          else if (flags != 0) {
+            log.warning("Unsupported frame flags: "+flags);
+            continue;
+          }
+        }
         try {
-          JsonMessage rq = JsonMessage.fromJson(s);
+          JsonMessage rq = payload == null ? JsonMessage.fromJson(s) : JsonMessage.fromJson(MsgPack.decode(payload));
+          if (payload != null && log.isLoggable(Level.FINE)) log.fine(name+" <<< "+rq.toJson());
+          if (rq.action == Action.WIRE_FORMAT) {
+            // handled here rather than in the pool, as the peer sends nothing more until it
+            // has the response, so the reader has not buffered anything past this line
+            if (negotiate(rq) && frames == null) frames = new DataInputStream(new BufferedInputStream(input));
+            continue;
+          }
           if (rq.action == null) {
             if (rq.id != null) {
               // response to some request
@@ -79,7 +132,7 @@ class ConnectionHandler extends Thread {
     rsp.inResponseTo = rq.action;
     rsp.id = rq.id;
     rsp.answer = answer;
-    println(rsp.toJson());
+    println(rsp);
   }
 
   private void respond(JsonMessage rq, AgentID aid) {
@@ -87,7 +140,7 @@ class ConnectionHandler extends Thread {
     rsp.inResponseTo = rq.action;
     rsp.id = rq.id;
     rsp.agentID = aid;
-    println(rsp.toJson());
+    println(rsp);
   }
 
   private void respond(JsonMessage rq, AgentID[] aid) {
@@ -95,7 +148,7 @@ class ConnectionHandler extends Thread {
     rsp.inResponseTo = rq.action;
     rsp.id = rq.id;
     rsp.agentIDs = aid;
-    println(rsp.toJson());
+    println(rsp);
   }
 
   private void respond(JsonMessage rq, String[] svc) {
@@ -103,14 +156,46 @@ class ConnectionHandler extends Thread {
     rsp.inResponseTo = rq.action;
     rsp.id = rq.id;
     rsp.services = svc;
-    println(rsp.toJson());
+    println(rsp);
   }
 
-  synchronized void println(String s) {
+  private synchronized boolean negotiate(JsonMessage rq) {
+    JsonMessage rsp = new JsonMessage();
+    rsp.inResponseTo = rq.action;
+    rsp.id = rq.id;
+    if (rq.formats != null && Arrays.asList(rq.formats).contains(MSGPACK)) {
+      rsp.format = MSGPACK;
+      if (rq.compressions != null && Arrays.asList(rq.compressions).contains(FrameCompressor.ZLIB))
+        rsp.compression = FrameCompressor.ZLIB;
+    }
+    println(rsp);
+    binary = rsp.format != null;
+    if (rsp.compression != null) compressor = new FrameCompressor(COMPRESS_THRESHOLD);
+    return binary;
+  }
+
+  synchronized void println(JsonMessage rq) {
     if (out == null) return;
     try {
-      out.writeBytes(s+"\n");
-      log.fine(name+" >>> "+s);
+      String s = null;
+      if (binary) {
+        byte[] payload = rq.toMsgPack();
+        byte[] compressed = compressor != null ? compressor.compress(payload) : null;
+        if (compressed != null) {
+          out.writeInt(compressed.length);
+          out.writeByte(FrameCompressor.ZLIB_FLAGS);
+          out.write(compressed);
+        } else {
+          out.writeInt(payload.length);
+          out.writeByte(0);
+          out.write(payload);
+        }
+      } else {
+        s = rq.toJson();
+        out.writeBytes(s+"\n");
+      }
+      out.flush();
+      if (log.isLoggable(Level.FINE)) log.fine(name+" >>> "+(s != null ? s : rq.toJson()));
     } catch(IOException ex) {
       log.warning("Write failed: "+ex.toString());
       close();
@@ -0,0 +1,94 @@
+/******************************************************************************
+
+Copyright (c) 2015, Mandar Chitre
+
+This file is part of fjage which is released under Simplified BSD License.
+See file LICENSE.txt or go to http://www.opensource.org/licenses/BSD-3-Clause
+for full license details.
+
+******************************************************************************/
+
+package org.arl.fjage.remote;
+
+import java.io.*;
+import java.util.zip.*;
+
+/**
+ * Compresses binary wire format frames with zlib, choosing adaptively which
+ * frames are worth compressing. Frames smaller than a threshold are never
+ * compressed. Larger frames are grouped into power-of-two size classes, and the
+ * compression ratio achieved in each class is tracked as a moving average. Size
+ * classes where compression does not save at least 10% are skipped, apart from
+ * one frame in every 16 to notice when the data becomes compressible again.
+ */
+class FrameCompressor {
+
+  static final String ZLIB = "zlib";
+  static final int ZLIB_FLAGS = 1;
+
+  private static final double MAX_RATIO = 0.9;
+  private static final int PROBE = 16;
+
+  private int threshold;
+  private double[] ratio = new double[33];
+  private int[] skips = new int[33];
+  private Deflater deflater = new Deflater(Deflater.BEST_SPEED);
+
+  FrameCompressor(int threshold) {
+    this.threshold = threshold;
+    for (int i = 0; i < ratio.length; i++)
+      ratio[i] = Double.NaN;
+  }
+
+  /**
+   * Compresses a frame payload, if it is worth it.
+   *
+   * @param payload frame payload.
+   * @return compressed payload, or null to send the payload uncompressed.
+   */
+  synchronized byte[] compress(byte[] payload) {
+    int n = payload.length;
+    if (n < threshold) return null;
+    int b = 32 - Integer.numberOfLeadingZeros(n);
+    double r = ratio[b];
+    if (r > MAX_RATIO && ++skips[b] % PROBE != 0) return null;
+    deflater.reset();
+    deflater.setInput(payload);
+    deflater.finish();
+    ByteArrayOutputStream out = new ByteArrayOutputStream(n/2+64);
+    byte[] buf = new byte[Math.min(n, 65536)];
+    while (!deflater.finished()) {
+      int k = deflater.deflate(buf);
+      out.write(buf, 0, k);
+      if (out.size() >= n) break;
+    }
+    int m = deflater.finished() ? out.size() : n;
+    double ratio1 = (double)m/n;
+    ratio[b] = Double.isNaN(r) ? ratio1 : r + (ratio1-r)/4;
+    if (m >= n) return null;
+    return out.toByteArray();
+  }
+
+  /**
+   * Decompresses a frame payload.
+   */
+  static byte[] decompress(byte[] payload) throws IOException {
+    Inflater inflater = new Inflater();
+    try {
+      inflater.setInput(payload);
+      ByteArrayOutputStream out = new ByteArrayOutputStream(payload.length*4);
+      byte[] buf = new byte[65536];
+      while (!inflater.finished()) {
+        int k = inflater.inflate(buf);
+        if (k == 0 && (inflater.needsInput() || inflater.needsDictionary())) throw new IOException("Truncated compressed frame");
+        out.write(buf, 0, k);
+      }
+      return out.toByteArray();
+    } catch (DataFormatException ex) {
+      throw new IOException(ex);
+    } finally {
+      inflater.end();
+    }
+  }
+
+}
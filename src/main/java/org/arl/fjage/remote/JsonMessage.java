@@ -10,6 +10,7 @@ for full license details.
 
 package org.arl.fjage.remote;
 
+import java.io.IOException;
 import org.arl.fjage.*;
 import com.google.gson.*;
 
@@ -28,6 +29,14 @@ public class JsonMessage {
   Boolean answer;
   Message message;
   Boolean relay;
+  String[] formats;
+  String format;
+  String[] compressions;
+  String compression;
+
+  // encoded forms, kept so that a request broadcast to many peers is only encoded once per format
+  private transient String json;
+  private transient byte[] msgpack;
 
   private static GsonBuilder gsonBuilder = new GsonBuilder()
                                                .setFieldNamingPolicy(FieldNamingPolicy.IDENTITY)
@@ -48,8 +57,30 @@ public class JsonMessage {
     return gson.fromJson(s, JsonMessage.class);
   }
 
+  static JsonMessage fromJson(JsonElement e) {
+    return gson.fromJson(e, JsonMessage.class);
+  }
+
+  /**
+   * Encodes the request as JSON. The request must not be changed once encoded.
+   */
   String toJson() {
-    return gson.toJson(this);
+    if (json == null) json = gson.toJson(this);
+    return json;
+  }
+
+  /**
+   * Encodes the request as MessagePack, for the binary wire format. Gson serializes
+   * the request straight to MessagePack, with primitive arrays as raw binary data.
+   * The request must not be changed once encoded.
+   */
+  byte[] toMsgPack() throws IOException {
+    if (msgpack == null) {
+      MsgPack.Writer out = new MsgPack.Writer();
+      gson.toJson(this, JsonMessage.class, out);
+      msgpack = out.toByteArray();
+    }
+    return msgpack;
   }
 
 }
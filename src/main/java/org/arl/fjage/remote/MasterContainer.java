@@ -12,6 +12,8 @@ package org.arl.fjage.remote;
 
 import java.io.*;
 import java.net.*;
+import java.nio.channels.*;
+import java.nio.file.*;
 import java.util.*;
 import org.arl.fjage.*;
 
@@ -30,6 +32,8 @@ public class MasterContainer extends RemoteContainer {
   private static final long TIMEOUT = 1000;
 
   private ServerSocket listener;
+  private ServerSocketChannel unixListener;
+  private String unixPath;
   private List<ConnectionHandler> slaves = new ArrayList<ConnectionHandler>();
   private boolean needsCleanup = false;
 
@@ -79,6 +83,22 @@ public class MasterContainer extends RemoteContainer {
     openSocket(port);
   }
 
+  /**
+   * Creates a named master container, runs its TCP server on a specified port, and
+   * also listens for connections from the same host on a Unix domain socket. Unix
+   * domain sockets require Java 16 or later.
+   *
+   * @param platform platform on which the container runs.
+   * @param name of the container.
+   * @param port port on which the container's TCP server runs.
+   * @param unixPath path of the Unix domain socket to listen on, e.g. "/run/fjage.sock".
+   */
+  public MasterContainer(Platform platform, String name, int port, String unixPath) throws IOException {
+    super(platform, name);
+    openSocket(port);
+    openUnixSocket(unixPath);
+  }
+
   /**
    * Gets the TCP port on which the master container listens for connections.
    *
@@ -88,6 +108,16 @@ public class MasterContainer extends RemoteContainer {
     return listener.getLocalPort();
   }
 
+  /**
+   * Gets the path of the Unix domain socket on which the master container listens
+   * for connections.
+   *
+   * @return path of the socket, or null if the container does not listen on one.
+   */
+  public String getUnixPath() {
+    return unixPath;
+  }
+
   /////////////// Container interface methods to override
   
   @Override
@@ -97,11 +127,10 @@ public class MasterContainer extends RemoteContainer {
     rq.action = Action.CONTAINS_AGENT;
     rq.agentID = aid;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         JsonMessage rsp = slave.getResponse(rq.id, TIMEOUT);
         if (rsp != null && rsp.answer) return true;
       }
@@ -125,11 +154,10 @@ public class MasterContainer extends RemoteContainer {
     rq.action = Action.SEND;
     rq.message = m;
     rq.relay = false;
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves)
-        slave.println(json);
+        slave.println(rq);
     }
     return true;
   }
@@ -143,11 +171,10 @@ public class MasterContainer extends RemoteContainer {
     JsonMessage rq = new JsonMessage();
     rq.action = Action.AGENTS;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         JsonMessage rsp = slave.getResponse(rq.id, TIMEOUT);
         if (rsp != null && rsp.agentIDs != null) {
           for (int i = 0; i < rsp.agentIDs.length; i++)
@@ -167,11 +194,10 @@ public class MasterContainer extends RemoteContainer {
     JsonMessage rq = new JsonMessage();
     rq.action = Action.SERVICES;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         JsonMessage rsp = slave.getResponse(rq.id, TIMEOUT);
         if (rsp != null && rsp.services != null) {
           for (int i = 0; i < rsp.services.length; i++)
@@ -190,11 +216,10 @@ public class MasterContainer extends RemoteContainer {
     rq.action = Action.AGENT_FOR_SERVICE;
     rq.service = service;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         JsonMessage rsp = slave.getResponse(rq.id, TIMEOUT);
         if (rsp != null && rsp.agentID != null) return rsp.agentID;
       }
@@ -213,11 +238,10 @@ public class MasterContainer extends RemoteContainer {
     rq.action = Action.AGENTS_FOR_SERVICE;
     rq.service = service;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
     if (needsCleanup) cleanupSlaves();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         JsonMessage rsp = slave.getResponse(rq.id, TIMEOUT);
         if (rsp != null && rsp.agentIDs != null) {
           for (int i = 0; i < rsp.agentIDs.length; i++)
@@ -253,10 +277,9 @@ public class MasterContainer extends RemoteContainer {
     if (!running) return;
     JsonMessage rq = new JsonMessage();
     rq.action = Action.SHUTDOWN;
-    String json = rq.toJson();
     synchronized(slaves) {
       for (ConnectionHandler slave: slaves) {
-        slave.println(json);
+        slave.println(rq);
         slave.close();
       }
       slaves.clear();
@@ -268,6 +291,15 @@ public class MasterContainer extends RemoteContainer {
     } catch (IOException ex) {
       log.warning(ex.toString());
     }
+    try {
+      if (unixListener != null) {
+        unixListener.close();
+        Files.deleteIfExists(Paths.get(unixPath));
+      }
+      unixListener = null;
+    } catch (IOException ex) {
+      log.warning(ex.toString());
+    }
     super.shutdown();
   }
 
@@ -309,6 +341,31 @@ public class MasterContainer extends RemoteContainer {
     }.start();
   }
 
+  private void openUnixSocket(String path) throws IOException {
+    final ServerSocketChannel server = UnixSockets.listen(path);
+    unixListener = server;
+    unixPath = path;
+    log.info("Listening on unix://"+path);
+    new Thread("fjage-master-unix") {
+      @Override
+      public void run() {
+        try {
+          while (true) {
+            SocketChannel conn = server.accept();
+            log.info("Incoming connection on unix://"+path);
+            ConnectionHandler t = new ConnectionHandler(conn, "unix://"+path, MasterContainer.this);
+            synchronized(slaves) {
+              slaves.add(t);
+            }
+            t.start();
+          }
+        } catch (IOException ex) {
+          log.info("Stopped listening on unix://"+path);
+        }
+      }
+    }.start();
+  }
+
   private void cleanupSlaves() {
     synchronized(slaves) {
       Iterator<ConnectionHandler> it = slaves.iterator();
@@ -0,0 +1,401 @@
+/******************************************************************************
+
+Copyright (c) 2015, Mandar Chitre
+
+This file is part of fjage which is released under Simplified BSD License.
+See file LICENSE.txt or go to http://www.opensource.org/licenses/BSD-3-Clause
+for full license details.
+
+******************************************************************************/
+
+package org.arl.fjage.remote;
+
+import java.io.*;
+import java.nio.charset.StandardCharsets;
+import java.util.*;
+import com.google.gson.*;
+import com.google.gson.stream.JsonWriter;
+
+/**
+ * MessagePack encoding for the binary wire format of the remote protocol. Requests
+ * are serialized by Gson straight to MessagePack through a {@link Writer}, which
+ * takes primitive arrays as raw binary data rather than base 64 strings. Received
+ * MessagePack is decoded as a JSON tree, with binary data converted back to base 64
+ * for the array adapter, so that the rest of the JSON machinery is unchanged.
+ */
+class MsgPack {
+
+  private MsgPack() {
+    // static methods only
+  }
+
+  /**
+   * Decodes MessagePack data as a JSON tree.
+   */
+  static JsonElement decode(byte[] data) throws IOException {
+    return read(new DataInputStream(new ByteArrayInputStream(data)));
+  }
+
+  ////// encoding
+
+  /**
+   * JSON writer for Gson to serialize to, which collects the values written and
+   * encodes them as MessagePack. Primitive arrays are written with {@link #binary}.
+   */
+  static class Writer extends JsonWriter {
+
+    private static final java.io.Writer UNWRITABLE = new java.io.Writer() {
+      @Override public void write(char[] buf, int off, int len) {
+        throw new AssertionError();
+      }
+      @Override public void flush() {
+        throw new AssertionError();
+      }
+      @Override public void close() {
+        throw new AssertionError();
+      }
+    };
+
+    private Deque<Object> stack = new ArrayDeque<Object>();
+    private String name = null;
+    private Object root = null;
+
+    Writer() {
+      super(UNWRITABLE);
+    }
+
+    /**
+     * Encodes the value written as MessagePack.
+     */
+    byte[] toByteArray() throws IOException {
+      if (!stack.isEmpty() || name != null) throw new IllegalStateException("Incomplete document");
+      ByteArrayOutputStream buf = new ByteArrayOutputStream(256);
+      DataOutputStream out = new DataOutputStream(buf);
+      MsgPack.write(out, root);
+      out.flush();
+      return buf.toByteArray();
+    }
+
+    @SuppressWarnings("unchecked")
+    private void put(Object value) {
+      Object top = stack.peek();
+      if (top == null) root = value;
+      else if (top instanceof List) ((List<Object>)top).add(value);
+      else {
+        if (name == null) throw new IllegalStateException("Expected a name");
+        if (value != null || getSerializeNulls()) ((Map<String,Object>)top).put(name, value);
+        name = null;
+      }
+    }
+
+    private void end(Class<?> type) {
+      if (!type.isInstance(stack.peek()) || name != null) throw new IllegalStateException("Unexpected end");
+      stack.pop();
+    }
+
+    @Override
+    public JsonWriter beginArray() {
+      List<Object> list = new ArrayList<Object>();
+      put(list);
+      stack.push(list);
+      return this;
+    }
+
+    @Override
+    public JsonWriter endArray() {
+      end(List.class);
+      return this;
+    }
+
+    @Override
+    public JsonWriter beginObject() {
+      Map<String,Object> map = new LinkedHashMap<String,Object>();
+      put(map);
+      stack.push(map);
+      return this;
+    }
+
+    @Override
+    public JsonWriter endObject() {
+      end(Map.class);
+      return this;
+    }
+
+    @Override
+    public JsonWriter name(String name) {
+      if (name == null) throw new NullPointerException("name == null");
+      if (!(stack.peek() instanceof Map) || this.name != null) throw new IllegalStateException("Unexpected name");
+      this.name = name;
+      return this;
+    }
+
+    @Override
+    public JsonWriter value(String value) {
+      if (value == null) return nullValue();
+      put(value);
+      return this;
+    }
+
+    @Override
+    public JsonWriter nullValue() {
+      put(null);
+      return this;
+    }
+
+    @Override
+    public JsonWriter value(boolean value) {
+      put(value);
+      return this;
+    }
+
+    @Override
+    public JsonWriter value(Boolean value) {
+      if (value == null) return nullValue();
+      put(value);
+      return this;
+    }
+
+    @Override
+    public JsonWriter value(double value) {
+      if (!isLenient() && (Double.isNaN(value) || Double.isInfinite(value)))
+        throw new IllegalArgumentException("Numeric values must be finite, but was "+value);
+      put(value);
+      return this;
+    }
+
+    // not in all versions of JsonWriter, so not marked as an override
+    public JsonWriter value(float value) {
+      return value((double)value);
+    }
+
+    @Override
+    public JsonWriter value(long value) {
+      put(value);
+      return this;
+    }
+
+    @Override
+    public JsonWriter value(Number value) {
+      if (value == null) return nullValue();
+      put(value);
+      return this;
+    }
+
+    /**
+     * Writes raw binary data, sent as MessagePack binary.
+     */
+    JsonWriter binary(byte[] value) {
+      if (value == null) return nullValue();
+      put(value);
+      return this;
+    }
+
+    @Override
+    public void flush() {
+      // nothing to flush, the value is encoded by toByteArray()
+    }
+
+    @Override
+    public void close() throws IOException {
+      if (!stack.isEmpty()) throw new IOException("Incomplete document");
+    }
+
+  }
+
+  @SuppressWarnings("unchecked")
+  private static void write(DataOutputStream out, Object v) throws IOException {
+    if (v == null) out.writeByte(0xc0);
+    else if (v instanceof Map) {
+      Map<String,Object> map = (Map<String,Object>)v;
+      writeMapHeader(out, map.size());
+      for (Map.Entry<String,Object> kv: map.entrySet()) {
+        writeString(out, kv.getKey());
+        write(out, kv.getValue());
+      }
+    } else if (v instanceof List) {
+      List<Object> list = (List<Object>)v;
+      int n = list.size();
+      if (n < 16) out.writeByte(0x90 | n);
+      else if (n < 65536) {
+        out.writeByte(0xdc);
+        out.writeShort(n);
+      } else {
+        out.writeByte(0xdd);
+        out.writeInt(n);
+      }
+      for (Object x: list)
+        write(out, x);
+    } else if (v instanceof String) writeString(out, (String)v);
+    else if (v instanceof Boolean) out.writeByte((Boolean)v ? 0xc3 : 0xc2);
+    else if (v instanceof byte[]) writeBinary(out, (byte[])v);
+    else if (v instanceof Number) writeNumber(out, (Number)v);
+    else throw new IOException("Unsupported type "+v.getClass().getName());
+  }
+
+  private static void writeMapHeader(DataOutputStream out, int n) throws IOException {
+    if (n < 16) out.writeByte(0x80 | n);
+    else if (n < 65536) {
+      out.writeByte(0xde);
+      out.writeShort(n);
+    } else {
+      out.writeByte(0xdf);
+      out.writeInt(n);
+    }
+  }
+
+  private static void writeString(DataOutputStream out, String s) throws IOException {
+    byte[] b = s.getBytes(StandardCharsets.UTF_8);
+    int n = b.length;
+    if (n < 32) out.writeByte(0xa0 | n);
+    else if (n < 256) {
+      out.writeByte(0xd9);
+      out.writeByte(n);
+    } else if (n < 65536) {
+      out.writeByte(0xda);
+      out.writeShort(n);
+    } else {
+      out.writeByte(0xdb);
+      out.writeInt(n);
+    }
+    out.write(b);
+  }
+
+  private static void writeBinary(DataOutputStream out, byte[] b) throws IOException {
+    int n = b.length;
+    if (n < 256) {
+      out.writeByte(0xc4);
+      out.writeByte(n);
+    } else if (n < 65536) {
+      out.writeByte(0xc5);
+      out.writeShort(n);
+    } else {
+      out.writeByte(0xc6);
+      out.writeInt(n);
+    }
+    out.write(b);
+  }
+
+  private static void writeNumber(DataOutputStream out, Number num) throws IOException {
+    if (num instanceof Double || num instanceof Float) {
+      out.writeByte(0xcb);
+      out.writeDouble(num.doubleValue());
+      return;
+    }
+    if (num instanceof Long || num instanceof Integer || num instanceof Short || num instanceof Byte) {
+      writeLong(out, num.longValue());
+      return;
+    }
+    // parsed from JSON text, e.g. LazilyParsedNumber
+    String s = num.toString();
+    if (s.indexOf('.') < 0 && s.indexOf('e') < 0 && s.indexOf('E') < 0) {
+      try {
+        writeLong(out, Long.parseLong(s));
+        return;
+      } catch (NumberFormatException ex) {
+        // too large for a long, send as a double
+      }
+    }
+    out.writeByte(0xcb);
+    out.writeDouble(num.doubleValue());
+  }
+
+  private static void writeLong(DataOutputStream out, long v) throws IOException {
+    if (v >= 0) {
+      if (v < 128) out.writeByte((int)v);
+      else if (v < 256) {
+        out.writeByte(0xcc);
+        out.writeByte((int)v);
+      } else if (v < 65536) {
+        out.writeByte(0xcd);
+        out.writeShort((int)v);
+      } else if (v <= 0xffffffffL) {
+        out.writeByte(0xce);
+        out.writeInt((int)v);
+      } else {
+        out.writeByte(0xcf);
+        out.writeLong(v);
+      }
+    } else {
+      if (v >= -32) out.writeByte((int)v);
+      else if (v >= Byte.MIN_VALUE) {
+        out.writeByte(0xd0);
+        out.writeByte((int)v);
+      } else if (v >= Short.MIN_VALUE) {
+        out.writeByte(0xd1);
+        out.writeShort((int)v);
+      } else if (v >= Integer.MIN_VALUE) {
+        out.writeByte(0xd2);
+        out.writeInt((int)v);
+      } else {
+        out.writeByte(0xd3);
+        out.writeLong(v);
+      }
+    }
+  }
+
+  ////// decoding
+
+  private static JsonElement read(DataInputStream in) throws IOException {
+    int b = in.readUnsignedByte();
+    if (b < 0x80) return new JsonPrimitive(b);
+    if (b >= 0xe0) return new JsonPrimitive(b - 256);
+    if (b < 0x90) return readMap(in, b & 0x0f);
+    if (b < 0xa0) return readArray(in, b & 0x0f);
+    if (b < 0xc0) return new JsonPrimitive(readString(in, b & 0x1f));
+    switch (b) {
+      case 0xc0: return JsonNull.INSTANCE;
+      case 0xc2: return new JsonPrimitive(false);
+      case 0xc3: return new JsonPrimitive(true);
+      case 0xc4: return binary(in, in.readUnsignedByte());
+      case 0xc5: return binary(in, in.readUnsignedShort());
+      case 0xc6: return binary(in, in.readInt());
+      case 0xca: return new JsonPrimitive(in.readFloat());
+      case 0xcb: return new JsonPrimitive(in.readDouble());
+      case 0xcc: return new JsonPrimitive(in.readUnsignedByte());
+      case 0xcd: return new JsonPrimitive(in.readUnsignedShort());
+      case 0xce: return new JsonPrimitive(in.readInt() & 0xffffffffL);
+      case 0xcf: return new JsonPrimitive(in.readLong());
+      case 0xd0: return new JsonPrimitive(in.readByte());
+      case 0xd1: return new JsonPrimitive(in.readShort());
+      case 0xd2: return new JsonPrimitive(in.readInt());
+      case 0xd3: return new JsonPrimitive(in.readLong());
+      case 0xd9: return new JsonPrimitive(readString(in, in.readUnsignedByte()));
+      case 0xda: return new JsonPrimitive(readString(in, in.readUnsignedShort()));
+      case 0xdb: return new JsonPrimitive(readString(in, in.readInt()));
+      case 0xdc: return readArray(in, in.readUnsignedShort());
+      case 0xdd: return readArray(in, in.readInt());
+      case 0xde: return readMap(in, in.readUnsignedShort());
+      case 0xdf: return readMap(in, in.readInt());
+    }
+    throw new IOException("Unsupported MessagePack type 0x"+Integer.toHexString(b));
+  }
+
+  private static JsonElement readMap(DataInputStream in, int n) throws IOException {
+    JsonObject obj = new JsonObject();
+    for (int i = 0; i < n; i++) {
+      JsonElement key = read(in);
+      obj.add(key.getAsString(), read(in));
+    }
+    return obj;
+  }
+
+  private static JsonElement readArray(DataInputStream in, int n) throws IOException {
+    JsonArray arr = new JsonArray();
+    for (int i = 0; i < n; i++)
+      arr.add(read(in));
+    return arr;
+  }
+
+  private static String readString(DataInputStream in, int n) throws IOException {
+    byte[] b = new byte[n];
+    in.readFully(b);
+    return new String(b, StandardCharsets.UTF_8);
+  }
+
+  private static JsonElement binary(DataInputStream in, int n) throws IOException {
+    byte[] b = new byte[n];
+    in.readFully(b);
+    return new JsonPrimitive(Base64.getEncoder().encodeToString(b));
+  }
+
+}
@@ -76,8 +76,7 @@ public class SlaveContainer extends RemoteContainer {
     rq.action = Action.CONTAINS_AGENT;
     rq.agentID = aid;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
-    master.println(json);
+    master.println(rq);
     JsonMessage rsp = master.getResponse(rq.id, TIMEOUT);
     if (rsp != null && rsp.answer) return true;
     return false;
@@ -100,8 +99,7 @@ public class SlaveContainer extends RemoteContainer {
       rq.action = Action.SEND;
       rq.message = m;
       rq.relay = true;
-      String json = rq.toJson();
-      master.println(json);
+      master.println(rq);
       return true;
     } else {
       if (super.send(m, false)) return true;
@@ -110,8 +108,7 @@ public class SlaveContainer extends RemoteContainer {
       rq.action = Action.SEND;
       rq.message = m;
       rq.relay = true;
-      String json = rq.toJson();
-      master.println(json);
+      master.println(rq);
       return true;
     }
   }
@@ -122,8 +119,7 @@ public class SlaveContainer extends RemoteContainer {
     JsonMessage rq = new JsonMessage();
     rq.action = Action.AGENTS;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
-    master.println(json);
+    master.println(rq);
     JsonMessage rsp = master.getResponse(rq.id, TIMEOUT);
     if (rsp == null) return null;
     return rsp.agentIDs;
@@ -135,8 +131,7 @@ public class SlaveContainer extends RemoteContainer {
     JsonMessage rq = new JsonMessage();
     rq.action = Action.SERVICES;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
-    master.println(json);
+    master.println(rq);
     JsonMessage rsp = master.getResponse(rq.id, TIMEOUT);
     if (rsp == null) return null;
     return rsp.services;
@@ -149,8 +144,7 @@ public class SlaveContainer extends RemoteContainer {
     rq.action = Action.AGENT_FOR_SERVICE;
     rq.service = service;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
-    master.println(json);
+    master.println(rq);
     JsonMessage rsp = master.getResponse(rq.id, TIMEOUT);
     if (rsp == null) return null;
     return rsp.agentID;
@@ -163,8 +157,7 @@ public class SlaveContainer extends RemoteContainer {
     rq.action = Action.AGENTS_FOR_SERVICE;
     rq.service = service;
     rq.id = UUID.randomUUID().toString();
-    String json = rq.toJson();
-    master.println(json);
+    master.println(rq);
     JsonMessage rsp = master.getResponse(rq.id, TIMEOUT);
     if (rsp == null) return null;
     return rsp.agentIDs;
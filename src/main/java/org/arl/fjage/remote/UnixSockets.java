@@ -0,0 +1,110 @@
+/******************************************************************************
+
+Copyright (c) 2015, Mandar Chitre
+
+This file is part of fjage which is released under Simplified BSD License.
+See file LICENSE.txt or go to http://www.opensource.org/licenses/BSD-3-Clause
+for full license details.
+
+******************************************************************************/
+
+package org.arl.fjage.remote;
+
+import java.io.*;
+import java.lang.reflect.*;
+import java.net.*;
+import java.nio.ByteBuffer;
+import java.nio.channels.*;
+import java.nio.file.*;
+
+/**
+ * Unix domain socket support. Unix domain socket channels are available from
+ * Java 16 onwards, and are accessed by reflection so that fjage still builds
+ * and runs on Java 8.
+ */
+class UnixSockets {
+
+  private UnixSockets() {
+    // static methods only
+  }
+
+  /**
+   * Opens a server channel listening on a Unix domain socket. A stale socket
+   * file left behind by an earlier run is deleted first.
+   *
+   * @param path path of the socket file.
+   * @return server channel.
+   * @throws UnsupportedOperationException if the JVM does not support Unix domain sockets.
+   */
+  static ServerSocketChannel listen(String path) throws IOException {
+    SocketAddress addr;
+    ServerSocketChannel ch;
+    try {
+      Class<?> cls = Class.forName("java.net.UnixDomainSocketAddress");
+      addr = (SocketAddress)cls.getMethod("of", String.class).invoke(null, path);
+      ProtocolFamily unix = StandardProtocolFamily.valueOf("UNIX");
+      ch = (ServerSocketChannel)ServerSocketChannel.class.getMethod("open", ProtocolFamily.class).invoke(null, unix);
+    } catch (ClassNotFoundException | NoSuchMethodException | IllegalAccessException | IllegalArgumentException ex) {
+      throw new UnsupportedOperationException("Unix domain sockets require Java 16 or later");
+    } catch (InvocationTargetException ex) {
+      Throwable cause = ex.getCause();
+      if (cause instanceof IOException) throw (IOException)cause;
+      throw new IOException(cause);
+    }
+    try {
+      Files.deleteIfExists(Paths.get(path));
+      ch.bind(addr);
+    } catch (IOException ex) {
+      ch.close();
+      throw ex;
+    }
+    return ch;
+  }
+
+  /**
+   * Gets an input stream reading from a channel. Unlike the streams from
+   * {@link Channels}, reads do not hold the channel's blocking lock, so a
+   * thread blocked reading does not hold up writes from other threads.
+   */
+  static InputStream getInputStream(final SocketChannel ch) {
+    return new InputStream() {
+      @Override
+      public int read() throws IOException {
+        byte[] b = new byte[1];
+        return read(b, 0, 1) < 0 ? -1 : b[0] & 0xff;
+      }
+      @Override
+      public int read(byte[] b, int off, int len) throws IOException {
+        if (len == 0) return 0;
+        return ch.read(ByteBuffer.wrap(b, off, len));
+      }
+      @Override
+      public void close() throws IOException {
+        ch.close();
+      }
+    };
+  }
+
+  /**
+   * Gets an output stream writing to a channel.
+   */
+  static OutputStream getOutputStream(final SocketChannel ch) {
+    return new OutputStream() {
+      @Override
+      public void write(int b) throws IOException {
+        write(new byte[] { (byte)b }, 0, 1);
+      }
+      @Override
+      public void write(byte[] b, int off, int len) throws IOException {
+        ByteBuffer buf = ByteBuffer.wrap(b, off, len);
+        while (buf.hasRemaining())
+          ch.write(buf);
+      }
+      @Override
+      public void close() throws IOException {
+        ch.close();
+      }
+    };
+  }
+
+}
@@ -0,0 +1 @@
+"""Performance benchmarks for the Python gateway. Run from ``src/main/python`` as ``python -m benchmarks.<name>``."""
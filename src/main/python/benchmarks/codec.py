@@ -0,0 +1,65 @@
+"""
+Compares the JSON codecs available to the gateway on representative message shapes::
+
+    python -m benchmarks.codec [--json] [--number N]
+"""
+
+import sys
+import json
+import timeit
+import argparse
+import array
+import random
+from fjagepy.org_arl_fjage import GenericMessage
+from fjagepy.org_arl_fjage_remote import _CODECS, _GatewayBase, Action
+
+
+def _messages():
+    gw = _GatewayBase()
+    gw.name = "PythonGW-bench"
+    msg = GenericMessage(recipient="shell", perf="REQUEST")
+    msg.map = {"cmd": "ps", "n": 42, "gain": 0.5}
+    small = gw._send_request(msg)
+    directory = {"inResponseTo": Action.AGENTS_FOR_SERVICE, "id": "2a6f55c2-6e4f-4b5e-9a3c-4d4f0c7e2a11",
+                 "agentIDs": ["agent" + str(i) for i in range(32)]}
+    signal = array.array('f', (random.random() for i in range(256 * 1024)))
+    big = gw._send_request(GenericMessage(recipient="phy", perf="REQUEST", signal=signal, fc=24000))
+    return [("small GenericMessage", small), ("directory response", directory), ("1 MB signal", big)]
+
+
+def run(number=None):
+    """Run the benchmark, and return a list of results with encode/decode rates in operations per second."""
+
+    results = list()
+    for shape, obj in _messages():
+        line = _CODECS['json']().dumps(obj)
+        n = number or max(10, 2000000 // len(line))
+        for name, cls in _CODECS.items():
+            try:
+                codec = cls()
+            except ImportError:
+                continue
+            dumps = timeit.timeit(lambda: codec.dumps(obj), number=n)
+            loads = timeit.timeit(lambda: codec.loads(line), number=n)
+            results.append({"shape": shape, "codec": name, "bytes": len(line), "n": n,
+                            "dumps_per_s": n / dumps, "loads_per_s": n / loads})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--number', type=int, default=None, help='iterations per measurement')
+    args = parser.parse_args(argv)
+    results = run(args.number)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("%-22s %-8s %10s %14s %14s" % ("shape", "codec", "bytes", "dumps/s", "loads/s"))
+    for r in results:
+        print("%-22s %-8s %10d %14.0f %14.0f" % (r["shape"], r["codec"], r["bytes"], r["dumps_per_s"], r["loads_per_s"]))
+
+
+if __name__ == "__main__":
+    main()
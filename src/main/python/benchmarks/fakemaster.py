@@ -0,0 +1,399 @@
+"""
+A stand-in for a fjåge master container, speaking the JSON protocol of ``org.arl.fjage.remote`` over TCP or
+a Unix domain socket, so that the gateway can be benchmarked and tested without a Java master::
+
+    python -m benchmarks.fakemaster [--port 5081] [--unix PATH]
+
+The master hosts a few agents:
+
+* ``shell`` provides the shell service and agrees to every request,
+* ``echo`` replies to every message with an ``AGREE`` message with the same fields,
+* ``sink`` counts the messages it receives and discards them.
+
+A shutdown request shuts the master down, as it does the platform of a real master container: every gateway is
+sent a shutdown request and disconnected, and no more connections are accepted.
+
+Messages sent to a topic are forwarded to every connected gateway, and messages sent to a gateway (known by
+the sender name of the messages it has sent) are forwarded to it. Gateways may switch to the binary MessagePack
+wire format, if the ``msgpack`` package is installed, and compress frames of 512 bytes or more with zlib.
+"""
+
+import os
+import sys
+import json
+import zlib
+import base64
+import socket
+import struct
+import argparse
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SHELL = "org.arl.fjage.shell.Services.SHELL"
+ARRAYS = ("[B", "[S", "[I", "[J", "[F", "[D")
+FRAME = struct.Struct('>IB')
+ZLIB = 1
+COMPRESS_THRESHOLD = 512
+
+
+def _base64(data):
+    return base64.standard_b64encode(data).decode()
+
+
+def _dumps(obj):
+    return (json.dumps(obj, separators=(',', ':'), default=_base64) + '\n').encode()
+
+
+def _raw_arrays(obj):
+    """Copy of a JSON object with base64 primitive array data replaced by raw bytes."""
+
+    if isinstance(obj, dict):
+        if obj.get("clazz") in ARRAYS and isinstance(obj.get("data"), str):
+            return {"clazz": obj["clazz"], "data": base64.standard_b64decode(obj["data"])}
+        return {k: _raw_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_raw_arrays(v) for v in obj]
+    return obj
+
+
+def _pack(obj, compress):
+    payload = msgpack.packb(_raw_arrays(obj), use_bin_type=True)
+    if compress and len(payload) >= COMPRESS_THRESHOLD:
+        data = zlib.compress(payload, 1)
+        if len(data) < len(payload):
+            return FRAME.pack(len(data), ZLIB) + data
+    return FRAME.pack(len(payload), 0) + payload
+
+
+def encode(obj, binary=False, compress=False):
+    """Encode a request as a JSON line, or as a binary wire format frame, compressed if large enough."""
+
+    return _pack(obj, compress) if binary else _dumps(obj)
+
+
+# fields of every message, written by Gson after the fields of the message class
+_ATTRIBUTES = ("msgID", "perf", "recipient", "sender", "inReplyTo")
+
+
+def message(clazz, recipient, sender, perf="INFORM", inReplyTo=None, msgID=None, **fields):
+    """A message as the master sends it. Like Gson, message fields are written before the ``Message``
+    fields, and null fields are left out."""
+
+    data = dict(fields)
+    data["msgID"] = msgID or "fm-" + str(next(_ids))
+    data["perf"] = perf
+    data["recipient"] = recipient
+    data["sender"] = sender
+    if inReplyTo is not None:
+        data["inReplyTo"] = inReplyTo
+    return {"clazz": clazz, "data": data}
+
+
+class _Counter:
+
+    def __init__(self):
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def __next__(self):
+        with self.lock:
+            self.n += 1
+            return self.n
+
+
+_ids = _Counter()
+
+
+class _Connection:
+
+    def __init__(self, master, sock):
+        self.master = master
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.names = set()
+        self.binary = False
+        self.compress = False
+
+    def write(self, data):
+        with self.lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+    def send(self, obj):
+        self.write(encode(obj, self.binary, self.compress))
+
+    def switch(self, rsp):
+        """Send the response to a wire format request, and switch to the format."""
+
+        with self.lock:
+            try:
+                self.sock.sendall(_dumps(rsp))
+            except OSError:
+                pass
+            self.binary = "format" in rsp
+            self.compress = "compression" in rsp
+
+    def serve(self):
+        try:
+            with self.sock.makefile('rb', 65536) as f:
+                while True:
+                    if self.binary:
+                        head = f.read(FRAME.size)
+                        if len(head) < FRAME.size:
+                            break
+                        n, flags = FRAME.unpack(head)
+                        payload = f.read(n)
+                        if flags == ZLIB:
+                            payload = zlib.decompress(payload)
+                        rq = msgpack.unpackb(payload, raw=False)
+                    else:
+                        line = f.readline()
+                        if not line:
+                            break
+                        rq = json.loads(line)
+                    if self.master._handle(self, rq) is False:
+                        break
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.master._disconnected(self)
+            self.sock.close()
+
+
+class FakeMaster:
+    """Fake master container listening on a TCP port, or on a Unix domain socket.
+
+    :param port: port to listen on, 0 to pick a free port.
+    :param host: address to listen on.
+    :param path: path of a Unix domain socket to listen on instead of a TCP port.
+    :param wire_formats: answer requests to switch to the binary wire format, False to ignore them like a
+                         master that only knows JSON.
+
+    Gateways connect to ``(master.host, master.port)``, which is ``("unix://" + path, None)`` for a Unix
+    domain socket.
+    """
+
+    AGENTS = {"shell": [SHELL], "echo": [], "sink": []}
+
+    def __init__(self, port=0, host="127.0.0.1", path=None, wire_formats=True):
+        self.path = path
+        self.wire_formats = wire_formats
+        if path is None:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((host, port))
+            self.host = host
+            self.port = self.server.getsockname()[1]
+        else:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(path)
+            self.host = "unix://" + path
+            self.port = None
+        self.server.listen(16)
+        self.connections = list()
+        self.gateways = dict()
+        self.sunk = 0
+        self.is_shutdown = False
+        self.cv = threading.Condition()
+        self.thread = threading.Thread(target=self._accept, name="fakemaster", daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            if self.path is None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(self, sock)
+            with self.cv:
+                self.connections.append(conn)
+            threading.Thread(target=conn.serve, name="fakemaster-conn", daemon=True).start()
+
+    def _disconnected(self, conn):
+        with self.cv:
+            if conn in self.connections:
+                self.connections.remove(conn)
+            for name in conn.names:
+                self.gateways.pop(name, None)
+            self.cv.notify_all()
+
+    def _handle(self, conn, rq):
+        action = rq.get("action")
+        if action == "agents":
+            conn.send({"id": rq["id"], "inResponseTo": action, "agentIDs": list(self.AGENTS)})
+        elif action == "containsAgent":
+            name = rq.get("agentID")
+            answer = name in self.AGENTS or (name in self.gateways and self.gateways[name] is not conn)
+            conn.send({"id": rq["id"], "inResponseTo": action, "answer": answer})
+        elif action == "services":
+            services = sorted(set(s for v in self.AGENTS.values() for s in v))
+            conn.send({"id": rq["id"], "inResponseTo": action, "services": services})
+        elif action == "agentForService":
+            agents = [a for a, s in self.AGENTS.items() if rq.get("service") in s]
+            rsp = {"id": rq["id"], "inResponseTo": action}
+            if agents:
+                rsp["agentID"] = agents[0]
+            conn.send(rsp)
+        elif action == "agentsForService":
+            agents = [a for a, s in self.AGENTS.items() if rq.get("service") in s]
+            conn.send({"id": rq["id"], "inResponseTo": action, "agentIDs": agents})
+        elif action == "wireFormat":
+            if not self.wire_formats:
+                # like a master that predates wire formats, ignore the request
+                return
+            rsp = {"id": rq["id"], "inResponseTo": action}
+            if msgpack is not None and "msgpack" in (rq.get("formats") or ()):
+                rsp["format"] = "msgpack"
+                if "zlib" in (rq.get("compressions") or ()):
+                    rsp["compression"] = "zlib"
+            conn.switch(rsp)
+        elif action == "send":
+            self._send(conn, rq["message"])
+        elif action == "shutdown":
+            self.shutdown()
+            return False
+
+    def _send(self, conn, msg):
+        data = msg["data"]
+        recipient = data.get("recipient")
+        sender = data.get("sender")
+        if sender is not None and sender not in conn.names:
+            with self.cv:
+                conn.names.add(sender)
+                self.gateways[sender] = conn
+        if recipient is None:
+            return
+        if recipient.startswith("#"):
+            self.broadcast({"action": "send", "message": msg, "relay": False})
+        elif recipient == "sink":
+            with self.cv:
+                self.sunk += 1
+                self.cv.notify_all()
+        elif recipient in ("echo", "shell"):
+            fields = dict((k, v) for k, v in data.items() if k not in _ATTRIBUTES)
+            rsp = message("org.arl.fjage.Message", sender, recipient, perf="AGREE", inReplyTo=data.get("msgID"),
+                          **fields)
+            conn.send({"action": "send", "message": rsp, "relay": False})
+        elif recipient in self.gateways:
+            self.gateways[recipient].send({"action": "send", "message": msg, "relay": False})
+
+    def broadcast(self, req, n=1):
+        """Send a request to all connected gateways, n times.
+
+        :param req: JSON request.
+        :param n: number of copies to send.
+        """
+
+        data = dict()
+        with self.cv:
+            connections = list(self.connections)
+        for conn in connections:
+            key = (conn.binary, conn.compress)
+            if key not in data:
+                data[key] = encode(req, *key)
+            for i in range(0, n, 256):
+                conn.write(data[key] * min(256, n - i))
+
+    def publish(self, topic, msg, n=1):
+        """Send a message to a topic, n times (all copies share the message ID).
+
+        :param topic: topic name, without the leading '#'.
+        :param msg: message, as built by :func:`message`.
+        :param n: number of copies to send.
+        """
+
+        msg["data"]["recipient"] = "#" + topic
+        self.broadcast({"action": "send", "message": msg, "relay": False}, n)
+
+    def wait_sunk(self, n, timeout=None):
+        """Wait until the sink agent has received n messages in all.
+
+        :returns: True if it has, False on timeout.
+        """
+
+        with self.cv:
+            return self.cv.wait_for(lambda: self.sunk >= n, timeout)
+
+    def wait_connections(self, n, timeout=None):
+        """Wait until n gateways are connected.
+
+        :returns: True if they are, False on timeout.
+        """
+
+        with self.cv:
+            return self.cv.wait_for(lambda: len(self.connections) >= n, timeout)
+
+    def wait_shutdown(self, timeout=None):
+        """Wait until the master has shut down.
+
+        :returns: True if it has, False on timeout.
+        """
+
+        with self.cv:
+            return self.cv.wait_for(lambda: self.is_shutdown, timeout)
+
+    def shutdown(self):
+        """Shut down, as the master container does on a shutdown request: send a shutdown request to every
+        gateway, then stop listening and drop all connections."""
+
+        with self.cv:
+            self.is_shutdown = True
+            self.cv.notify_all()
+        self.broadcast({"action": "shutdown"})
+        self.close()
+
+    def close(self):
+        """Stop listening and drop all connections."""
+
+        self.server.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+        self.drop()
+
+    def drop(self):
+        """Drop all connections, as if the network failed, but keep listening."""
+
+        with self.cv:
+            connections = list(self.connections)
+        for conn in connections:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=5081, help='port to listen on')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--unix', default=None, metavar='PATH', help='listen on a Unix domain socket instead')
+    args = parser.parse_args(argv)
+    master = FakeMaster(args.port, args.host, args.unix)
+    if args.unix is None:
+        print("Fake master listening on %s:%d" % (master.host, master.port))
+    else:
+        print("Fake master listening on %s" % master.host)
+    try:
+        master.thread.join()
+    except KeyboardInterrupt:
+        master.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Measures the gateway against a local fake master container::
+
+    python -m benchmarks.gateway [--json] [--quick] [--codec NAME] [--transport tcp|unix] [--wire json|msgpack]
+        [--compression METHOD]
+
+Reports send throughput, request/response round trip latency percentiles, topic fan-in rate (receiving one
+message at a time, and streaming), and the rate at which received array messages are decoded, for a range of
+payload sizes. The CPU time used per message covers both the gateway and the fake master, which run in the
+same process.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import platform
+from fjagepy.org_arl_fjage import Message
+from fjagepy.org_arl_fjage_remote import Gateway, _json_codec
+from benchmarks.fakemaster import FakeMaster, message
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def send_throughput(master, gw, n):
+    """Messages sent per second, until the master has received them all."""
+
+    msgs = [Message(recipient="sink", perf="INFORM") for i in range(n)]
+    base = master.sunk
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    for msg in msgs:
+        gw.send(msg)
+    master.wait_sunk(base + n)
+    dt = time.perf_counter() - t0
+    return {"n": n, "msgs_per_s": n / dt, "cpu_us_per_msg": (time.process_time() - c0) / n * 1e6}
+
+
+def request_latency(master, gw, n):
+    """Round trip time of requests answered by the master, in microseconds."""
+
+    rtt = list()
+    c0 = time.process_time()
+    for i in range(n):
+        req = Message(recipient="echo", perf="REQUEST")
+        t0 = time.perf_counter()
+        rsp = gw.request(req, 5000)
+        rtt.append((time.perf_counter() - t0) * 1e6)
+        if rsp is None:
+            raise RuntimeError("request timed out")
+    return {"n": n, "p50_us": _percentile(rtt, 50), "p90_us": _percentile(rtt, 90),
+            "p99_us": _percentile(rtt, 99), "max_us": max(rtt),
+            "cpu_us_per_msg": (time.process_time() - c0) / n * 1e6}
+
+
+def topic_fan_in(master, gw, n, other=0):
+    """Notifications received per second from a subscribed topic, while the master also publishes `other`
+    notifications per notification on topics the gateway has not subscribed to."""
+
+    topic = gw.topic("bench")
+    gw.subscribe(topic)
+    ntf = message("org.arl.fjage.Message", None, "bench", seq=1)
+    t0 = time.perf_counter()
+    for i in range(0, n, 1000):
+        k = min(1000, n - i)
+        if other:
+            master.publish("other", message("org.arl.fjage.Message", None, "other"), k * other)
+        master.publish("bench", ntf, k)
+    for i in range(n):
+        if gw.receive(topic, 5000) is None:
+            raise RuntimeError("notification lost")
+    dt = time.perf_counter() - t0
+    gw.unsubscribe(topic)
+    return {"n": n, "other_per_ntf": other, "msgs_per_s": n / dt}
+
+
+def topic_stream(master, gw, n, max_batch=256):
+    """Notifications received per second from a subscribed topic with :meth:`Gateway.stream`, taking up to
+    `max_batch` queued notifications at a time."""
+
+    topic = gw.topic("bench")
+    gw.subscribe(topic)
+    ntf = message("org.arl.fjage.Message", None, "bench", seq=1)
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    for i in range(0, n, 1000):
+        master.publish("bench", ntf, min(1000, n - i))
+    k = 0
+    for msg in gw.stream(topic, max_batch, 5000):
+        k += 1
+        if k == n:
+            break
+    if k < n:
+        raise RuntimeError("notification lost")
+    dt = time.perf_counter() - t0
+    gw.unsubscribe(topic)
+    return {"n": n, "max_batch": max_batch, "msgs_per_s": n / dt, "cpu_us_per_msg": (time.process_time() - c0) / n * 1e6}
+
+
+def array_decode(master, gw, size, n):
+    """Received float array messages decoded per second, for an array of `size` bytes."""
+
+    data = base64.standard_b64encode(os.urandom(size)).decode()
+    topic = gw.topic("signal")
+    gw.subscribe(topic)
+    ntf = message("org.arl.fjage.GenericMessage", None, "phy", signal={"clazz": "[F", "data": data})
+    t0 = time.perf_counter()
+    master.publish("signal", ntf, n)
+    for i in range(n):
+        msg = gw.receive(topic, 5000)
+        if msg is None:
+            raise RuntimeError("notification lost")
+    dt = time.perf_counter() - t0
+    gw.unsubscribe(topic)
+    return {"bytes": size, "n": n, "msgs_per_s": n / dt, "mb_per_s": n * size / dt / 1e6}
+
+
+def run(quick=False, codec=None, transport="tcp", wire="json", compression=None):
+    """Run the benchmark suite, and return the results with a description of the environment."""
+
+    scale = 10 if quick else 1
+    results = {"python": platform.python_version(), "platform": platform.platform(),
+               "codec": type(_json_codec(codec)).__name__, "transport": transport, "wire": wire, "compression": compression, "timestamp": time.time()}
+    path = os.path.join(tempfile.mkdtemp(), "fjage.sock") if transport == "unix" else None
+    with FakeMaster(path=path) as master:
+        gw = Gateway(master.host, master.port, codec=codec, wire=wire, compression=compression)
+        try:
+            results["send"] = send_throughput(master, gw, 100000 // scale)
+            request_latency(master, gw, 100)
+            results["request"] = request_latency(master, gw, 5000 // scale)
+            results["topic"] = [topic_fan_in(master, gw, 50000 // scale),
+                                topic_fan_in(master, gw, 10000 // scale, other=9)]
+            results["stream"] = topic_stream(master, gw, 50000 // scale)
+            results["array"] = [array_decode(master, gw, size, max(10, (20000 // scale) // (1 + size // 4096)))
+                                for size in (64, 4096, 65536, 1048576)]
+            results["stats"] = gw.stats()["compression"]
+        finally:
+            gw.shutdown()
+    if path is not None:
+        os.rmdir(os.path.dirname(path))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--quick', action='store_true', help='run fewer iterations')
+    parser.add_argument('--codec', default=None, help='JSON codec to use')
+    parser.add_argument('--transport', default='tcp', choices=('tcp', 'unix'), help='connection to the master')
+    parser.add_argument('--wire', default='json', choices=('json', 'msgpack'), help='wire format')
+    parser.add_argument('--compression', default=None, help='compression method (needs --wire msgpack)')
+    args = parser.parse_args(argv)
+    results = run(args.quick, args.codec, args.transport, args.wire, args.compression)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("python %s, %s codec, %s transport, %s wire format, %s compression" %
+          (results["python"], results["codec"], results["transport"], results["wire"], results["compression"]))
+    r = results["send"]
+    print("send                          %10.0f msgs/s %8.1f us cpu/msg" % (r["msgs_per_s"], r["cpu_us_per_msg"]))
+    r = results["request"]
+    print("request rtt                   p50 %.0f us, p90 %.0f us, p99 %.0f us, max %.0f us, %.1f us cpu/msg" %
+          (r["p50_us"], r["p90_us"], r["p99_us"], r["max_us"], r["cpu_us_per_msg"]))
+    for r in results["topic"]:
+        print("topic fan-in (1:%d other)      %10.0f msgs/s" % (r["other_per_ntf"], r["msgs_per_s"]))
+    r = results["stream"]
+    print("topic stream (batch %-4d)      %10.0f msgs/s %8.1f us cpu/msg" % (r["max_batch"], r["msgs_per_s"], r["cpu_us_per_msg"]))
+    for r in results["array"]:
+        print("array decode %8d bytes     %10.0f msgs/s %10.1f MB/s" % (r["bytes"], r["msgs_per_s"], r["mb_per_s"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures the time taken to import the gateway, using ``python -X importtime`` in fresh interpreters::
+
+    python -m benchmarks.importtime [--json] [--number N] [--max-ms T]
+
+With ``--max-ms``, exits with an error if the median time of any import exceeds the given limit, so that
+import time regressions can be caught in CI.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+STATEMENTS = ['import fjagepy', 'from fjagepy import Gateway']
+
+
+def _importtime(stmt):
+    """Time a statement in a fresh interpreter, returning the wall time in microseconds and the self time of
+    each module it imports."""
+
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = "import time; t = time.perf_counter(); exec(%r); print(int((time.perf_counter() - t) * 1e6))" % stmt
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, env=env, universal_newlines=True, check=True)
+    modules = dict()
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            self_us, cumulative_us, name = line[12:].split('|')
+            modules[name.strip()] = int(self_us)
+            # everything up to site is interpreter startup
+            if name.strip() == 'site':
+                modules.clear()
+    return int(proc.stdout), modules
+
+
+def run(number=10):
+    """Run the benchmark, and return the median import times in milliseconds, with the slowest modules
+    imported by each statement."""
+
+    results = list()
+    for stmt in STATEMENTS:
+        _importtime(stmt)  # warm up bytecode caches
+        runs = [_importtime(stmt) for i in range(number)]
+        slowest = dict()
+        for name in runs[0][1]:
+            if all(name in r[1] for r in runs):
+                slowest[name] = statistics.median(r[1][name] for r in runs) / 1000
+        slowest = sorted(slowest.items(), key=lambda kv: kv[1], reverse=True)[:8]
+        results.append({"stmt": stmt, "n": number, "import_ms": statistics.median(r[0] for r in runs) / 1000,
+                        "slowest": [{"module": k, "self_ms": v} for k, v in slowest]})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--number', type=int, default=10, help='number of interpreters to run per statement')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if a median import time is larger')
+    args = parser.parse_args(argv)
+    results = run(args.number)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for r in results:
+            print("%-30s %8.1f ms (median of %d)" % (r["stmt"], r["import_ms"], r["n"]))
+            for m in r["slowest"]:
+                print("  %-40s %8.1f ms" % (m["module"], m["self_ms"]))
+    slow = [r for r in results if args.max_ms is not None and r["import_ms"] > args.max_ms]
+    if slow:
+        sys.exit("%s took %.1f ms, limit is %.1f ms" % (slow[0]["stmt"], slow[0]["import_ms"], args.max_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Stresses the gateway with many threads blocked in ``receive()`` at once, each waiting for messages on its own
+topic, against a local fake master container::
+
+    python -m benchmarks.receivers [--json] [--quick] [--threads N] [--timeout MS]
+
+Half the threads receive with a topic filter, and half with a lambda filter on the recipient. The master
+first publishes a burst of messages to the topics in turn, then publishes one message at a time, waiting for
+each to be received, so that all the other receivers are blocked when it arrives. Reports the message rate and
+latency from publishing to receiving for each phase, and the number of missed wakeups in the second phase:
+messages that took over 10 ms to be received, because their receiver was not woken when they arrived and
+waited out its timeout instead.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from fjagepy.org_arl_fjage_remote import Gateway
+from benchmarks.fakemaster import FakeMaster, message
+
+# time for a published message to reach a receiver that is woken when it arrives, with nothing else in flight
+MARGIN = 0.01
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _receiver(gw, i, n, burst, timeout, sent, got, results):
+    if i % 2 == 0:
+        filter = gw.topic("stress%d" % i)
+    else:
+        recipient = "#stress%d" % i
+        filter = lambda m: m["data"]["recipient"] == recipient
+    latency = list()
+    missed = 0
+    k = 0
+    while k < n:
+        msg = gw.receive(filter, timeout)
+        t = time.perf_counter()
+        if msg is None:
+            if len(sent[i]) > k and t - sent[i][k] > 5 + timeout / 1000:
+                # lost
+                break
+            continue
+        if msg.seq != k:
+            raise RuntimeError("receiver %d got message %d, expected %d" % (i, msg.seq, k))
+        latency.append(t - sent[i][k])
+        if k >= burst and latency[-1] > MARGIN:
+            missed += 1
+        k += 1
+        got[i].release()
+    results[i] = {"received": k, "missed": missed, "latency": latency}
+
+
+def _phase(latency, n):
+    return {"n": len(latency), "msgs_per_s": len(latency) / n, "p50_us": _percentile(latency, 50) * 1e6,
+            "p99_us": _percentile(latency, 99) * 1e6, "max_us": max(latency) * 1e6}
+
+
+def run(quick=False, threads=8, timeout=100):
+    """Run the benchmark, and return the results with a description of the environment."""
+
+    burst = (2000 if quick else 20000) // threads
+    sparse = 5 if quick else 25
+    n = burst + sparse
+    results = {"python": platform.python_version(), "platform": platform.platform(), "threads": threads,
+               "timeout_ms": timeout, "timestamp": time.time()}
+    with FakeMaster() as master:
+        gw = Gateway(master.host, master.port)
+        try:
+            for i in range(threads):
+                gw.subscribe(gw.topic("stress%d" % i))
+            # time each message was published, per receiver
+            sent = [list() for i in range(threads)]
+            got = [threading.Semaphore(0) for i in range(threads)]
+            received = [None] * threads
+            workers = [threading.Thread(target=_receiver, args=(gw, i, n, burst, timeout, sent, got, received))
+                       for i in range(threads)]
+            for w in workers:
+                w.start()
+
+            def publish(i, k):
+                sent[i].append(time.perf_counter())
+                master.publish("stress%d" % i, message("org.arl.fjage.Message", None, "stress", seq=k))
+
+            t0 = time.perf_counter()
+            for k in range(burst):
+                for i in range(threads):
+                    publish(i, k)
+                if k % 16 == 0:
+                    # let the receivers catch up and block again
+                    time.sleep(0.001)
+            for i in range(threads):
+                for k in range(burst):
+                    got[i].acquire()
+            t1 = time.perf_counter()
+            for k in range(burst, n):
+                for i in range(threads):
+                    publish(i, k)
+                    got[i].acquire()
+            t2 = time.perf_counter()
+            for w in workers:
+                w.join()
+            stats = gw.stats()["queue"]
+        finally:
+            gw.shutdown()
+    results["received"] = sum(r["received"] for r in received)
+    results["expected"] = n * threads
+    results["burst"] = _phase([t for r in received for t in r["latency"][:burst]], t1 - t0)
+    results["sparse"] = _phase([t for r in received for t in r["latency"][burst:]], t2 - t1)
+    results["missed"] = sum(r["missed"] for r in received)
+    results["handoffs"] = stats["handoffs"]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--quick', action='store_true', help='send fewer messages')
+    parser.add_argument('--threads', type=int, default=8, help='number of receiving threads')
+    parser.add_argument('--timeout', type=int, default=100, help='receive timeout in milliseconds')
+    args = parser.parse_args(argv)
+    results = run(args.quick, args.threads, args.timeout)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    r = results
+    print("python %s, %d receiving threads, %d ms receive timeout" % (r["python"], r["threads"], r["timeout_ms"]))
+    print("received        %d of %d, %d handed straight to a waiting receiver" %
+          (r["received"], r["expected"], r["handoffs"]))
+    for phase in ("burst", "sparse"):
+        p = r[phase]
+        print("%-15s %8.0f msgs/s, latency p50 %.0f us, p99 %.0f us, max %.0f us" %
+              (phase, p["msgs_per_s"], p["p50_us"], p["p99_us"], p["max_us"]))
+    print("missed wakeups  %d" % r["missed"])
+
+
+if __name__ == "__main__":
+    main()
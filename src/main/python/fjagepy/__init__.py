@@ -1,9 +1,38 @@
-from fjagepy.org_arl_fjage import AgentID
-from fjagepy.org_arl_fjage import Performative
-from fjagepy.org_arl_fjage import Message
-from fjagepy.org_arl_fjage import GenericMessage
-from fjagepy.org_arl_fjage_shell import ShellExecReq
-from fjagepy.org_arl_fjage_remote import Gateway
-from fjagepy.org_arl_fjage_remote import Action
+"""Python gateway for fjåge. Classes are imported from their subpackages on first use, so that importing
+``fjagepy`` is cheap."""
+
+import importlib as _importlib
+
+_exports = {
+    'AgentID': 'org_arl_fjage',
+    'Performative': 'org_arl_fjage',
+    'Message': 'org_arl_fjage',
+    'GenericMessage': 'org_arl_fjage',
+    'CompactMessage': 'org_arl_fjage',
+    'configure_logging': 'org_arl_fjage',
+    'ShellExecReq': 'org_arl_fjage_shell',
+    'Gateway': 'org_arl_fjage_remote',
+    'AsyncGateway': 'org_arl_fjage_remote',
+    'GatewayPool': 'org_arl_fjage_remote',
+    'Action': 'org_arl_fjage_remote',
+    'PrimitiveArray': 'org_arl_fjage_remote',
+    'register_message': 'org_arl_fjage_remote',
+    'register_package': 'org_arl_fjage_remote'
+}
 
 __all__ = ['org_arl_fjage', 'org_arl_fjage_remote', 'org_arl_fjage_shell']
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(_importlib.import_module(__name__ + '.' + _exports[name]), name)
+    elif name in __all__:
+        value = _importlib.import_module(__name__ + '.' + name)
+    else:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | set(__all__))
@@ -1,7 +1,38 @@
 import os
 import errno
-import uuid as _uuid
+import itertools as _itertools
 import logging
+import atexit as _atexit
+
+
+def _msgid_prefix():
+    h = os.urandom(10).hex()
+    return h[:8] + '-' + h[8:12] + '-4' + h[13:16] + '-' + '89ab'[int(h[16], 16) & 3] + h[17:20] + '-'
+
+
+_msgid_base = _msgid_prefix()
+_msgid_count = _itertools.count()
+
+
+def _reset_msgid():
+    global _msgid_base, _msgid_count
+    _msgid_base = _msgid_prefix()
+    _msgid_count = _itertools.count()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_msgid)
+
+
+def new_msgid():
+    """Generate a new message ID.
+
+    IDs are UUID-formatted strings made from a random per-process prefix and a counter, so they are
+    unique across processes without the cost of generating a random UUID for every message. A forked
+    child process picks a new prefix.
+    """
+
+    return _msgid_base + '%012x' % next(_msgid_count)
 
 
 class AgentID:
@@ -35,7 +66,23 @@ class Performative:
     CANCEL = "CANCEL"                 #: Cancel pending request.
 
 
-class Message(object):
+class _MessageBase(object):
+    """
+    Common base class of :class:`Message` and :class:`CompactMessage`. It declares no instance attributes,
+    so that compact messages are laid out without an instance dictionary. Code that accepts either kind of
+    message checks for this class.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        p = self.perf if self.perf else "MESSAGE"
+        if self.__class__ == Message:
+            return p
+        return p + ": " + str(self.__class__.__name__);
+
+
+class Message(_MessageBase):
     """
     Base class for messages transmitted by one agent to another. This class provides
     the basic attributes of messages and is typically extended by application-specific
@@ -45,19 +92,13 @@ class Message(object):
 
     def __init__(self, **kwargs):
 
-        self.msgID = str(_uuid.uuid4())
+        self.msgID = new_msgid()
         self.perf = None
         self.recipient = None
         self.sender = None
         self.inReplyTo = None
         self.__dict__.update(kwargs)
 
-    def __str__(self):
-        p = self.perf if self.perf else "MESSAGE"
-        if self.__class__ == Message:
-            return p
-        return p + ": " + str(self.__class__.__name__);
-
 
 class GenericMessage(Message):
     """A message class that can convey generic messages represented by key-value pairs."""
@@ -68,31 +109,120 @@ class GenericMessage(Message):
         self.__dict__.update(kwargs)
 
 
-def _initLogging():
-    # create logger
+class CompactMessage(_MessageBase):
+    """
+    Base class for messages with a fixed set of attributes. Attributes are declared in ``__slots__``
+    and their default values in ``defaults``, and the gateway serializes them using a plan computed once
+    per class rather than copying the instance dictionary of every message::
+
+        class PingReq(CompactMessage):
+            __slots__ = ('count', 'data')
+            defaults = {'perf': Performative.REQUEST, 'count': 1}
+
+    Default values are shared by all instances, so they should not be mutable. As with other messages,
+    an attribute name with a trailing underscore is sent without it, so attributes named after Python
+    keywords can be used.
+
+    Compact messages have no instance dictionary, so attributes not declared in ``__slots__`` cannot be
+    set. For the same reason, this class does not derive from :class:`Message`.
+    """
+
+    __slots__ = ('msgID', 'perf', 'recipient', 'sender', 'inReplyTo')
+    defaults = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = []
+        defaults = dict()
+        for c in cls.__mro__[::-1]:
+            slots = c.__dict__.get('__slots__', ())
+            fields = [f for f in ((slots,) if isinstance(slots, str) else slots) if not f.startswith('__')] + fields
+            defaults.update(c.__dict__.get('defaults', {}))
+        cls._defaults = tuple((f, defaults.get(f)) for f in fields if f != 'msgID')
+        cls._plan = tuple((f, f[:-1] if f[-1] == '_' else f) for f in fields)
+
+    def __init__(self, **kwargs):
+        self.msgID = new_msgid()
+        for f, v in self._defaults:
+            setattr(self, f, v)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+CompactMessage.__init_subclass__()
+
+
+class _Payload:
+    """A message line to log, formatted (and truncated to ``max_bytes``) only if the log record is emitted."""
+
+    __slots__ = ('data',)
+    max_bytes = 1024
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return data[:self.max_bytes].decode(errors='replace') + "... (" + str(len(data)) + " bytes)"
+        return data.decode(errors='replace').rstrip()
+
+
+_log_listener = None
+_log_handler = None
+
+# gateways log nothing until the application configures logging
+logging.getLogger('org.arl.fjage').addHandler(logging.NullHandler())
+
+
+def configure_logging(level=logging.INFO, filename="logs/log-python.txt", max_payload=1024):
+    """Configure logging of the 'org.arl.fjage' logger used by the gateways. Gateways log nothing until
+    this is called.
+
+    Messages sent and received are logged at DEBUG level. Log records are written to the log file by a
+    background thread, so that the gateway threads do not wait for disk I/O.
+
+    :param level: logging level, or None to disable logging.
+    :param filename: log file, or None to only use the handlers configured by the application.
+    :param max_payload: maximum number of bytes of a message line to log, or None to log whole lines.
+    """
+
+    global _log_listener, _log_handler
+    import logging.handlers
+    import queue
     logger = logging.getLogger('org.arl.fjage')
-    logger.setLevel(logging.DEBUG)
-    filename = "logs/log-python.txt"
-    if not os.path.exists(os.path.dirname(filename)):
+    if _log_listener is not None:
+        _log_listener.stop()
+        for h in _log_listener.handlers:
+            h.close()
+        logger.removeHandler(_log_handler)
+        _log_listener = None
+        _log_handler = None
+    _Payload.max_bytes = max_payload
+    logger.disabled = level is None
+    if level is None:
+        return
+    logger.setLevel(level)
+    if filename is None:
+        return
+    if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
         try:
             os.makedirs(os.path.dirname(filename))
         except OSError as exc:
             if exc.errno != errno.EEXIST:
                 raise
 
-    # create console handler and set level to debug
-    ch = logging.FileHandler('logs/log-python.txt')
-    ch.setLevel(logging.DEBUG)
-
-    # create formatter
+    # file handler runs on the listener thread, fed through a queue
+    fh = logging.FileHandler(filename)
     formatter = logging.Formatter('%(created)11.3f|%(levelname)s|%(filename)s@%(lineno)d:%(funcName)s|%(message)s', datefmt='%s')
-
-    # add formatter to ch
-    ch.setFormatter(formatter)
-
-    # add ch to logger
-    logger.addHandler(ch)
+    fh.setFormatter(formatter)
+    _log_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, fh)
+    _log_listener.start()
+    logger.addHandler(_log_handler)
 
 
-# Start logging
-_initLogging()
+@_atexit.register
+def _stopLogging():
+    if _log_listener is not None:
+        _log_listener.stop()
@@ -1,493 +1,3369 @@
+import io as _io
 import os as _os
+import re as _re
 import sys as _sys
 import json as _json
 import uuid as _uuid
 import time as _time
+import struct as _struct
 import socket as _socket
 import threading as _td
 import logging as _log
+import heapq as _heapq
+import itertools as _itertools
+import importlib as _importlib
+import concurrent.futures as _futures
 import fjagepy
 import base64
-import struct
+import array as _array
 from collections import OrderedDict
+from collections import deque as _deque
 from fjagepy.org_arl_fjage import AgentID
 from fjagepy.org_arl_fjage import Message
+from fjagepy.org_arl_fjage import _MessageBase
 from fjagepy.org_arl_fjage import GenericMessage
+from fjagepy.org_arl_fjage import _Payload
+
+_np = None
+_np_checked = False
+
+
+def _numpy():
+    """Import NumPy on first use, None if it is not installed."""
+
+    global _np, _np_checked, _ARRAY_LIKE
+    if not _np_checked:
+        _np_checked = True
+        try:
+            import numpy
+        except ImportError:
+            return None
+        _np = numpy
+        _ARRAY_LIKE = _ARRAY_LIKE + (numpy.ndarray,)
+    return _np
+
+
+def _sync_numpy():
+    # an application holding NumPy arrays has imported NumPy already
+    if not _np_checked and 'numpy' in _sys.modules:
+        _numpy()
+
+
+class _LazyModule:
+    """A module imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(_importlib.import_module(self._name), attr)
+
+
+_asyncio = _LazyModule('asyncio')
 
 
 def current_time_millis(): return int(round(_time.time() * 1000))
 
 
-class Action:
-    """
-    JSON message actions.
+class Action:
+    """
+    JSON message actions.
+
+    """
+
+    AGENTS = "agents"
+    CONTAINS_AGENT = "containsAgent"
+    SERVICES = "services"
+    AGENT_FOR_SERVICE = "agentForService"
+    AGENTS_FOR_SERVICE = "agentsForService"
+    SEND = "send"
+    SHUTDOWN = "shutdown"
+    WIRE_FORMAT = "wireFormat"
+
+
+def _typecode(size, candidates):
+    for tc in candidates:
+        if _array.array(tc).itemsize == size:
+            return tc
+    return None
+
+
+# Java primitive array type -> (little-endian NumPy dtype, array.array typecode)
+_ARRAY_TYPES = {
+    '[B': ('<i1', 'b'),
+    '[S': ('<i2', _typecode(2, 'hi')),
+    '[I': ('<i4', _typecode(4, 'il')),
+    '[J': ('<i8', _typecode(8, 'lq')),
+    '[F': ('<f4', 'f'),
+    '[D': ('<f8', 'd')
+}
+
+
+def _decode_array(clazz, data):
+    """Decode a base64 encoded (or, in the binary wire format, raw) Java primitive array, as a read-only NumPy
+    view over the decoded bytes if NumPy is available, else as an :class:`array.array`."""
+
+    dtype, typecode = _ARRAY_TYPES[clazz]
+    buf = data if isinstance(data, bytes) else base64.standard_b64decode(data)
+    np = _numpy()
+    if np is not None:
+        return np.frombuffer(buf, dtype=dtype)
+    a = _array.array(typecode)
+    a.frombytes(buf)
+    if _sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def _decode_arrays(obj):
+    """Replace every base64 encoded primitive array (``{"clazz": "[F", "data": "..."}``) nested in a JSON
+    object with the decoded array. Dicts and lists are updated in place; lists are only searched if their first
+    element is a dict or list."""
+
+    if isinstance(obj, dict):
+        clazz = obj.get("clazz")
+        if clazz in _ARRAY_TYPES and isinstance(obj.get("data"), (str, bytes)):
+            return _decode_array(clazz, obj["data"])
+        for key, value in obj.items():
+            if isinstance(value, (dict, list)):
+                obj[key] = _decode_arrays(value)
+    elif isinstance(obj, list) and obj and isinstance(obj[0], (dict, list)):
+        for i, value in enumerate(obj):
+            if isinstance(value, (dict, list)):
+                obj[i] = _decode_arrays(value)
+    return obj
+
+
+def _base64_arrays(obj):
+    """Replace the raw data of primitive arrays nested in an object received in the binary wire format with
+    base64, as in the JSON wire format. Dicts and lists are updated in place."""
+
+    if isinstance(obj, dict):
+        if obj.get("clazz") in _ARRAY_TYPES and isinstance(obj.get("data"), (bytes, bytearray, memoryview)):
+            obj["data"] = base64.standard_b64encode(obj["data"]).decode()
+            return obj
+        for value in obj.values():
+            _base64_arrays(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            _base64_arrays(value)
+    return obj
+
+
+# Java primitive array type -> (NumPy dtype kind, element size) it is encoded from
+_ARRAY_KINDS = {('i', 1): '[B', ('u', 1): '[B', ('b', 1): '[B', ('i', 2): '[S', ('u', 2): '[S',
+                ('i', 4): '[I', ('u', 4): '[I', ('i', 8): '[J', ('u', 8): '[J', ('f', 4): '[F', ('f', 8): '[D'}
+
+
+class PrimitiveArray:
+    """
+    Hint to send a sequence as a Java primitive array of a given element type, rather than letting the
+    gateway infer the type (or send a list as a JSON number list)::
+
+        req.signal = PrimitiveArray(samples, 'F')
+
+    :param data: sequence of numbers, :class:`array.array`, NumPy array or bytes-like object. Complex numbers
+                 are sent as interleaved real and imaginary parts.
+    :param type: Java array type, one of 'B' (byte), 'S' (short), 'I' (int), 'J' (long), 'F' (float)
+                 or 'D' (double), optionally with a leading '['.
+    """
+
+    def __init__(self, data, type):
+        if not type.startswith('['):
+            type = '[' + type
+        if type not in _ARRAY_TYPES:
+            raise ValueError("Unsupported array type: " + type)
+        self.data = data
+        self.type = type
+
+
+def _encode_array(value, binary=False):
+    """Encode a NumPy array, :class:`array.array`, bytes-like object or :class:`PrimitiveArray` as a base64
+    Java primitive array (or with raw data, for the binary wire format), None if the value is not an array.
+    Complex NumPy arrays are sent as interleaved real and imaginary parts."""
+
+    _sync_numpy()
+    if isinstance(value, PrimitiveArray):
+        clazz = value.type
+        dtype, typecode = _ARRAY_TYPES[clazz]
+        if _numpy() is not None:
+            data = value.data
+            if _np.iscomplexobj(data):
+                data = _np.ascontiguousarray(data)
+                data = data.view(data.real.dtype)
+            buf = _np.ascontiguousarray(data, dtype=dtype)
+        else:
+            data = value.data
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = memoryview(data).cast('B').tolist()
+            elif any(isinstance(x, complex) for x in data):
+                data = [y for x in data for y in (x.real, x.imag)]
+            buf = _array.array(typecode, data)
+            if _sys.byteorder == 'big':
+                buf.byteswap()
+    elif _np is not None and isinstance(value, _np.ndarray):
+        if value.dtype.kind == 'c':
+            value = value.view(value.real.dtype)
+        clazz = _ARRAY_KINDS.get((value.dtype.kind, value.dtype.itemsize))
+        if clazz is None:
+            return None
+        buf = _np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<'))
+    elif isinstance(value, _array.array):
+        if value.typecode in 'fd':
+            clazz = '[F' if value.typecode == 'f' else '[D'
+        elif value.typecode in 'bBhHiIlLqQ':
+            clazz = _ARRAY_KINDS[('i', value.itemsize)]
+        else:
+            return None
+        buf = value
+        if _sys.byteorder == 'big' and value.itemsize > 1:
+            buf = _array.array(value.typecode, value)
+            buf.byteswap()
+    elif isinstance(value, (bytes, bytearray)):
+        clazz = '[B'
+        buf = value
+    elif isinstance(value, memoryview):
+        clazz = '[B'
+        buf = value if value.c_contiguous else value.tobytes()
+    else:
+        return None
+    if binary:
+        return {"clazz": clazz, "data": memoryview(buf).cast('B')}
+    return {"clazz": clazz, "data": base64.standard_b64encode(buf).decode()}
+
+
+def _encode_arrays(obj, binary=False):
+    """Replace arrays in a message attribute with their base64 JSON representation (or raw data, for the
+    binary wire format), copying any dicts and lists that contain arrays rather than modifying them."""
+
+    _sync_numpy()
+    rv = _encode_array(obj, binary)
+    if rv is not None:
+        return rv
+    if isinstance(obj, dict):
+        rv = obj
+        for key, value in obj.items():
+            if isinstance(value, _ARRAY_LIKE):
+                if rv is obj:
+                    rv = dict(obj)
+                rv[key] = _encode_arrays(value, binary)
+        return rv
+    if isinstance(obj, list) and obj and isinstance(obj[0], _ARRAY_LIKE):
+        return [_encode_arrays(value, binary) for value in obj]
+    return obj
+
+
+_ARRAY_LIKE = (dict, list, PrimitiveArray, _array.array, bytes, bytearray, memoryview)
+
+
+class _StdlibCodec:
+    """JSON codec using the standard library :mod:`json` module."""
+
+    name = 'json'
+    binary = False
+
+    def loads(self, data):
+        return _json.loads(data)
+
+    def dumps(self, obj):
+        return (_json.dumps(obj) + '\n').encode()
+
+
+class _OrjsonCodec:
+    """JSON codec using orjson, which works directly on bytes."""
+
+    name = 'orjson'
+    binary = False
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._option = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def loads(self, data):
+        try:
+            return self._orjson.loads(data)
+        except self._orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which the Java side may send
+            return _json.loads(data)
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj, option=self._option)
+
+
+class _UjsonCodec:
+    """JSON codec using ujson."""
+
+    name = 'ujson'
+    binary = False
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        try:
+            return self._ujson.loads(data)
+        except ValueError:
+            return _json.loads(data)
+
+    def dumps(self, obj):
+        return (self._ujson.dumps(obj) + '\n').encode()
+
+
+_CODECS = OrderedDict([('orjson', _OrjsonCodec), ('ujson', _UjsonCodec), ('json', _StdlibCodec)])
+
+# binary wire format frame header: payload length, flags
+_FRAME = _struct.Struct('>IB')
+
+
+class _MsgpackCodec:
+    """Codec for the binary wire format, framing MessagePack payloads with a length and flags header.
+    Primitive arrays are sent as raw binary data rather than base64."""
+
+    name = 'msgpack'
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+    def dumps(self, obj):
+        payload = self._msgpack.packb(obj, use_bin_type=True)
+        return _FRAME.pack(len(payload), 0) + payload
+
+
+# compression methods for binary wire format frames, in order of preference -> frame flags
+_COMPRESSION = OrderedDict([('zstd', 2), ('lz4', 3), ('zlib', 1)])
+
+
+def _compression_methods(compression):
+    """Compression methods to offer the master, for the `compression` argument of a gateway."""
+
+    if not compression:
+        return []
+    if compression is True:
+        names = list(_COMPRESSION)
+    else:
+        names = [compression] if isinstance(compression, str) else list(compression)
+    rv = list()
+    for name in names:
+        if name not in _COMPRESSION:
+            raise ValueError("Unknown compression method: " + str(name))
+        try:
+            _Compressor(name)
+            rv.append(name)
+        except ImportError:
+            if compression is not True:
+                raise
+    return rv
+
+
+class _Compressor:
+    """
+    Compresses binary wire format frames, choosing adaptively which frames are worth compressing. Frames
+    smaller than `threshold` are never compressed. Larger frames are grouped into power-of-two size classes,
+    and the compression ratio achieved in each class is tracked as a moving average. Size classes where
+    compression does not save at least 10% (e.g. noise-like signals) are skipped, apart from one frame in
+    every 16 to notice when the data becomes compressible again.
+
+    :param method: compression method, 'zlib', 'zstd' (needs ``zstandard``) or 'lz4' (needs ``lz4``).
+    :param threshold: size in bytes of the smallest frame payload to compress.
+    """
+
+    MAX_RATIO = 0.9
+    PROBE = 16
+
+    def __init__(self, method, threshold=512):
+        self.method = method
+        self.flags = _COMPRESSION[method]
+        self.threshold = threshold
+        if method == 'zlib':
+            import zlib
+            self._compress = lambda data: zlib.compress(data, 1)
+            self._decompress = zlib.decompress
+        elif method == 'zstd':
+            import zstandard
+            local = _td.local()
+
+            def compress(data):
+                # compressor objects must not be shared between threads
+                c = getattr(local, 'c', None)
+                if c is None:
+                    c = local.c = zstandard.ZstdCompressor(level=1)
+                return c.compress(data)
+            self._compress = compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            import lz4.frame
+            self._compress = lz4.frame.compress
+            self._decompress = lz4.frame.decompress
+        self.ratio = [None] * 33
+        self.skips = [0] * 33
+
+    def compress(self, frame, metrics):
+        """Compress a frame if it is worth it, else return it as is."""
+
+        n = len(frame) - _FRAME.size
+        if n < self.threshold:
+            return frame
+        b = n.bit_length()
+        r = self.ratio[b]
+        if r is not None and r > self.MAX_RATIO:
+            self.skips[b] += 1
+            if self.skips[b] % self.PROBE:
+                metrics.compress_skipped += 1
+                return frame
+        t = _time.thread_time()
+        data = self._compress(memoryview(frame)[_FRAME.size:])
+        metrics.compress_time += _time.thread_time() - t
+        ratio = len(data) / n
+        self.ratio[b] = ratio if r is None else r + (ratio - r) / 4
+        metrics.compress_count += 1
+        metrics.compress_in += n
+        if len(data) >= n:
+            metrics.compress_out += n
+            return frame
+        metrics.compress_out += len(data)
+        return _FRAME.pack(len(data), self.flags) + data
+
+    def decompress(self, flags, payload, metrics):
+        """Decompress the payload of a frame received with the given flags."""
+
+        if flags != self.flags:
+            raise ValueError("Unsupported frame flags: %d" % flags)
+        t = _time.thread_time()
+        data = self._decompress(payload)
+        metrics.decompress_time += _time.thread_time() - t
+        metrics.decompress_count += 1
+        metrics.decompress_in += len(payload)
+        metrics.decompress_out += len(data)
+        return data
+
+    def effective_threshold(self):
+        """Size of the smallest frame payload that would currently be compressed."""
+
+        for b in range(self.threshold.bit_length(), len(self.ratio)):
+            if self.ratio[b] is None or self.ratio[b] <= self.MAX_RATIO:
+                return max(self.threshold, 1 << (b - 1) if b else 0)
+        return None
+
+
+class _SocketReader(_io.RawIOBase):
+    """Raw reader for a socket, returning data already read from the socket before reading any more."""
+
+    def __init__(self, sock, head=b''):
+        self.sock = sock
+        self.head = head
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        return self.sock.recv_into(b)
+
+
+def _json_codec(codec=None):
+    """Get a JSON codec by name, or the fastest one available if no name is given. Objects providing
+    ``loads(bytes)`` and ``dumps(obj)`` (returning a newline terminated bytes line) are used as is."""
+
+    if codec is None:
+        for cls in _CODECS.values():
+            try:
+                return cls()
+            except ImportError:
+                pass
+    if isinstance(codec, str):
+        if codec not in _CODECS:
+            raise ValueError("Unknown JSON codec: " + codec)
+        return _CODECS[codec]()
+    return codec
+
+
+class MessageRegistry:
+    """Maps Java message class names to Python message classes.
+
+    Classes are found by explicit registration, by Java package to Python module mappings, by the
+    ``fjagepy.messages`` entry point group, and finally by the default ``fjagepy``/``unetpy`` naming
+    convention (Java package ``org.arl.unet.phy`` lives in module ``unetpy.org_arl_unet_phy``). Lookups
+    are cached, including failed ones, so class loading only runs once per Java class name.
+
+    Entry points named after a Java class name load a message class, entry points named after a Java
+    package load the Python module holding the messages of that package.
+    """
+
+    ENTRY_POINTS = 'fjagepy.messages'
+
+    def __init__(self):
+        self._classes = dict()
+        self._packages = dict()
+        self._names = dict()
+        self._missing = set()
+        self._entry_points_loaded = False
+        self._lock = _td.Lock()
+
+    def register(self, clazz, cls=None):
+        """Register a Python message class for a Java class name. Can be used as a class decorator.
+
+        :param clazz: fully qualified Java class name.
+        :param cls: Python message class.
+        :returns: the Python message class, or a decorator if no class is given.
+        """
+
+        if cls is None:
+            return lambda c: self.register(clazz, c)
+        with self._lock:
+            self._classes[clazz] = cls
+            self._names[cls] = clazz
+            self._missing.discard(clazz)
+        return cls
+
+    def register_package(self, package, module):
+        """Register the Python module that holds the message classes of a Java package (and its subpackages).
+
+        :param package: Java package name, e.g. "com.example.msgs".
+        :param module: Python module name, e.g. "examplepy".
+        """
+
+        with self._lock:
+            self._packages[package] = module
+            self._missing.clear()
+
+    def lookup(self, clazz):
+        """Get the Python message class for a Java class name.
+
+        :param clazz: fully qualified Java class name.
+        :returns: Python message class, None if not found.
+        """
+
+        cls = self._classes.get(clazz)
+        if cls is not None or clazz in self._missing:
+            return cls
+        if not self._entry_points_loaded:
+            self._load_entry_points()
+            cls = self._classes.get(clazz)
+            if cls is not None:
+                return cls
+        cls = self._load(clazz)
+        with self._lock:
+            if cls is None:
+                self._missing.add(clazz)
+            else:
+                self._classes[clazz] = cls
+        if cls is None:
+            _log.getLogger('org.arl.fjage').critical("Exception in from_json, no class found for " + clazz)
+        return cls
+
+    def java_name(self, cls):
+        """Get the Java class name for a Python message class.
+
+        :param cls: Python message class.
+        :returns: fully qualified Java class name.
+        """
+
+        clazz = self._names.get(cls)
+        if clazz is None:
+            clazz = cls.__module__.split('.')[-1].replace("_", ".") + "." + cls.__name__
+            self._names[cls] = clazz
+        return clazz
+
+    def _module(self, package):
+        parts = package.split('.')
+        for n in range(len(parts), 0, -1):
+            module = self._packages.get('.'.join(parts[:n]))
+            if module is not None:
+                return module
+        return "fjagepy" if "fjage" in parts else "unetpy"
+
+    def _load(self, clazz):
+        package, _, name = clazz.rpartition('.')
+        module = self._module(package)
+        for module_name in (module + "." + package.replace(".", "_"), module):
+            try:
+                cls = getattr(_importlib.import_module(module_name), name, None)
+            except ImportError:
+                continue
+            if isinstance(cls, type):
+                return cls
+        return None
+
+    def _load_entry_points(self):
+        self._entry_points_loaded = True
+        try:
+            from importlib.metadata import entry_points
+            eps = entry_points()
+            eps = eps.select(group=self.ENTRY_POINTS) if hasattr(eps, 'select') else eps.get(self.ENTRY_POINTS, [])
+        except ImportError:
+            return
+        for ep in eps:
+            try:
+                obj = ep.load()
+            except Exception as e:
+                _log.getLogger('org.arl.fjage').warning("Failed to load message entry point " + ep.name + ": " + str(e))
+                continue
+            if isinstance(obj, type):
+                self.register(ep.name, obj)
+            else:
+                self.register_package(ep.name, obj.__name__)
+
+
+registry = MessageRegistry()
+
+
+def register_message(clazz, cls=None):
+    """Register a Python message class for a Java class name, in the default registry. Can be used as
+    a class decorator::
+
+        @register_message('com.example.msgs.PingReq')
+        class PingReq(Message):
+            ...
+
+    :param clazz: fully qualified Java class name.
+    :param cls: Python message class.
+    """
+
+    return registry.register(clazz, cls)
+
+
+def register_package(package, module):
+    """Register the Python module that holds the message classes of a Java package, in the default registry.
+
+    :param package: Java package name.
+    :param module: Python module name.
+    """
+
+    registry.register_package(package, module)
+
+
+_PEEK_WINDOW = 512
+_PEEK_VALUE = _re.compile(rb'\s*:\s*(?:"([^"\\]*)"|null)')
+
+
+def _peek_value(head, tail, key, depth):
+    """Find the value of a key at a given object nesting depth near the start (head) or end (tail) of a line.
+
+    :returns: tuple (found in head, value) or None if not found.
+    """
+
+    pos = head.find(key)
+    if pos >= 0:
+        m = _PEEK_VALUE.match(head, pos + len(key))
+        prefix = head[:pos]
+        if m is not None and prefix.count(b'{') == depth and b'}' not in prefix and b'[' not in prefix:
+            return True, m.group(1)
+    pos = tail.rfind(key)
+    if pos >= 0:
+        m = _PEEK_VALUE.match(tail, pos + len(key))
+        if m is not None:
+            suffix = tail[m.end():]
+            if suffix.count(b'}') == depth and b'{' not in suffix and b'[' not in suffix:
+                return False, m.group(1)
+    return None
+
+
+def _peek(line):
+    """
+    Extract the action, and for messages the class, recipient and inReplyTo, from a received JSON line
+    without parsing it. Only the start and end of the line are looked at, so large payloads are skipped.
+
+    This relies on the layout of JSON written by the master container: the action is a top-level key, the
+    message class precedes the message data, and the message attributes (msgID, perf, recipient, sender,
+    inReplyTo) are written together either at the start of the data (GenericMessage) or at its end.
+
+    :returns: tuple ``(action, clazz, recipient, inReplyTo)`` with None for absent values, or None if the line
+              does not have the expected layout and has to be parsed.
+    """
+
+    head = line[:_PEEK_WINDOW]
+    tail = line[-_PEEK_WINDOW:]
+    action = _peek_value(head, b'', b'"action"', 1)
+    if action is None or action[1] is None:
+        return None
+    action = action[1].decode()
+    if action != Action.SEND:
+        return action, None, None, None
+    clazz = _peek_value(head, b'', b'"clazz"', 2)
+    recipient = _peek_value(head, tail, b'"recipient"', 3)
+    if clazz is None or clazz[1] is None or recipient is None or recipient[1] is None:
+        return None
+    # inReplyTo is near the start of a GenericMessage and is the last field of other messages, which may have
+    # fields written before recipient, so it can be in either window
+    inReplyTo = _peek_value(head, tail, b'"inReplyTo"', 3)
+    inReplyTo = None if inReplyTo is None or inReplyTo[1] is None else inReplyTo[1].decode()
+    return action, clazz[1].decode(), recipient[1].decode(), inReplyTo
+
+
+class _QueueEntry:
+    """A message held in the receive queue, with the keys it is indexed by. The message is either held
+    parsed, or as the raw line received (along with its header from :func:`_peek`) and parsed on first use."""
+
+    __slots__ = ('_msg', 'raw', 'loads', 'clazz', 'inReplyTo', 'recipient', 'size', 'time', 'alive')
+
+    def __init__(self, msg, size, header=None, loads=None):
+        if header is None:
+            data = msg["data"]
+            self._msg = msg
+            self.raw = None
+            clazz = msg["clazz"]
+            self.inReplyTo = data.get("inReplyTo")
+            self.recipient = data.get("recipient")
+        else:
+            self._msg = None
+            self.raw = msg
+            self.loads = loads
+            action, clazz, self.recipient, self.inReplyTo = header
+        self.clazz = clazz.split(".")[-1]
+        self.size = size
+        self.time = _time.monotonic()
+        self.alive = True
+
+    @property
+    def msg(self):
+        if self._msg is None and self.raw is not None:
+            self._msg = self.loads(self.raw)
+            self.raw = None
+        return self._msg
+
+
+class _MessageQueue:
+    """
+    Receive queue holding messages in arrival order, with hash indexes by the message the entry is
+    in reply to, by class name and by recipient (agent or topic). Lookups by reply, class or topic
+    take the oldest matching message without scanning the queue.
+
+    Removed entries are only marked dead, and are dropped from the index deques lazily when they
+    reach the front, or by compaction once dead entries outnumber live ones.
+
+    The queue may be bounded in number of messages, in bytes, and per topic; see :meth:`set_limits`.
+    Counts of messages dropped on overflow and replies expired are kept in ``dropped`` and ``expired``.
+
+    The queue is not thread-safe; callers must hold the gateway lock.
+    """
+
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    BLOCK = 'block'
+
+    def __init__(self):
+        self.capacity = None
+        self.max_bytes = None
+        self.policy = self.DROP_OLDEST
+        self.topic_capacity = None
+        self.reply_ttl = None
+        self.dropped = 0
+        self.expired = 0
+        self.peak = 0
+        self.clear()
+
+    def set_limits(self, capacity=None, max_bytes=None, policy=DROP_OLDEST, topic_capacity=None, reply_ttl=None):
+        """Bound the queue. Limits apply from the next message appended.
+
+        :param capacity: maximum number of messages, None for no limit.
+        :param max_bytes: maximum total size of messages (as received), None for no limit.
+        :param policy: what to do with a message that does not fit: DROP_OLDEST drops older messages to make
+                       space, DROP_NEWEST drops the new message, BLOCK leaves it to the caller to wait for space.
+        :param topic_capacity: maximum number of messages per topic, either one limit for all topics or a dict
+                               of limits by topic name; the oldest message on the topic is dropped to make space.
+        :param reply_ttl: time in seconds after which unclaimed replies to requests are discarded.
+        """
+
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST, self.BLOCK):
+            raise ValueError("Unknown overflow policy: " + str(policy))
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.topic_capacity = topic_capacity
+        self.reply_ttl = reply_ttl
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        """Iterate over queued messages in arrival order."""
+        return (e.msg for e in self._fifo if e.alive)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def is_full(self, size=0):
+        """Check if a message of the given size would exceed the queue limits."""
+
+        if self.capacity is not None and self._len >= self.capacity:
+            return True
+        if self.max_bytes is not None and self._len > 0 and self._bytes + size > self.max_bytes:
+            return True
+        return False
+
+    def append(self, msg, size=0, header=None, loads=None):
+        """Add a received message to the queue, applying the queue limits.
+
+        :param msg: message as received in JSON, or the raw line if a header is given.
+        :param size: size of the message as received, in bytes.
+        :param header: header of the raw line from :func:`_peek`.
+        :param loads: function to parse the message from the raw line when it is needed.
+        :returns: True if the message was queued, False if it was dropped or the queue is full and the
+                  policy is BLOCK.
+        """
+
+        return self.append_entry(_QueueEntry(msg, size, header, loads))
+
+    def append_entry(self, e):
+        """Add a :class:`_QueueEntry` to the queue, applying the queue limits. See :meth:`append`."""
+
+        if self.reply_ttl is not None:
+            self.expire()
+        size = e.size
+        if self.topic_capacity is not None and e.recipient is not None and e.recipient[:1] == '#':
+            cap = self.topic_capacity
+            if isinstance(cap, dict):
+                cap = cap.get(e.recipient[1:])
+            if cap is not None:
+                if cap <= 0:
+                    self.dropped += 1
+                    return False
+                while self._count_by_recipient.get(e.recipient, 0) >= cap:
+                    if self._take_indexed(self._by_recipient, e.recipient) is None:
+                        break
+                    self.dropped += 1
+        if self.is_full(size):
+            if self.policy == self.BLOCK:
+                return False
+            if self.policy == self.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            while self._len > 0 and self.is_full(size):
+                self._take(self._fifo)
+                self.dropped += 1
+        self._fifo.append(e)
+        if e.inReplyTo is not None:
+            self._by_reply.setdefault(e.inReplyTo, _deque()).append(e)
+            self._replies.append(e)
+        self._by_clazz.setdefault(e.clazz, _deque()).append(e)
+        if e.recipient is not None:
+            self._by_recipient.setdefault(e.recipient, _deque()).append(e)
+            self._count_by_recipient[e.recipient] = self._count_by_recipient.get(e.recipient, 0) + 1
+        self._len += 1
+        self._bytes += size
+        if self._len > self.peak:
+            self.peak = self._len
+        return True
+
+    def expire(self):
+        """Discard replies older than the reply TTL, and return the number discarded."""
+
+        n = 0
+        if self.reply_ttl is None:
+            return n
+        deadline = _time.monotonic() - self.reply_ttl
+        while self._replies and (not self._replies[0].alive or self._replies[0].time < deadline):
+            e = self._replies.popleft()
+            if e.alive:
+                self._remove(e)
+                n += 1
+        self.expired += n
+        return n
+
+    def pop(self, filter=None, match=None):
+        """Remove and return the oldest message matching a receive filter, None if there is none.
+
+        :param filter: None, a message (match replies to it), a message class, a topic or a lambda.
+        :param match: predicate ``match(filter, msg)`` used for filters that cannot be looked up by index.
+        """
+
+        if filter is None:
+            return self._take(self._fifo, None)
+        if isinstance(filter, _MessageBase):
+            return self._take_indexed(self._by_reply, filter.msgID) if filter.msgID else None
+        if type(filter) == type(Message):
+            return self._take_indexed(self._by_clazz, filter.__name__)
+        if isinstance(filter, AgentID):
+            return self._take_indexed(self._by_recipient, ('#' + filter.name) if filter.is_topic else filter.name)
+        if match is None:
+            return None
+        for e in self._fifo:
+            if e.alive and match(filter, e.msg):
+                return self._remove(e)
+        return None
+
+    def pop_many(self, filter=None, n=1, match=None):
+        """Remove and return up to n of the oldest messages matching a receive filter, in arrival order.
+
+        :param filter: receive filter, as for :meth:`pop`.
+        :param n: maximum number of messages to return.
+        :param match: predicate ``match(filter, msg)`` used for filters that cannot be looked up by index.
+        """
+
+        rv = list()
+        if not (filter is None or isinstance(filter, (_MessageBase, AgentID)) or type(filter) == type(Message)):
+            # one scan for unindexed filters, rather than one per message
+            if match is None:
+                return rv
+            for e in list(self._fifo):
+                if len(rv) >= n:
+                    break
+                if e.alive and match(filter, e.msg):
+                    rv.append(self._remove(e))
+            return rv
+        while len(rv) < n:
+            msg = self.pop(filter, match)
+            if msg is None:
+                break
+            rv.append(msg)
+        return rv
+
+    def clear(self):
+        self._fifo = _deque()
+        self._replies = _deque()
+        self._by_reply = dict()
+        self._by_clazz = dict()
+        self._by_recipient = dict()
+        self._count_by_recipient = dict()
+        self._len = 0
+        self._bytes = 0
+        self._dead = 0
+
+    def _take(self, d, index=None, key=None):
+        while d:
+            if d[0].alive:
+                return self._remove(d[0])
+            d.popleft()
+        if index is not None:
+            del index[key]
+        return None
+
+    def _take_indexed(self, index, key):
+        d = index.get(key)
+        if d is None:
+            return None
+        return self._take(d, index, key)
+
+    def _remove(self, e):
+        msg = e.msg
+        e.alive = False
+        e._msg = None
+        self._len -= 1
+        self._bytes -= e.size
+        self._dead += 1
+        if e.recipient is not None:
+            n = self._count_by_recipient[e.recipient] - 1
+            if n:
+                self._count_by_recipient[e.recipient] = n
+            else:
+                del self._count_by_recipient[e.recipient]
+        while self._fifo and not self._fifo[0].alive:
+            self._fifo.popleft()
+        if self._len == 0:
+            self.clear()
+        elif self._dead > max(64, self._len):
+            self._compact()
+        return msg
+
+    def _compact(self):
+        self._fifo = _deque(e for e in self._fifo if e.alive)
+        self._replies = _deque(e for e in self._replies if e.alive)
+        for index in (self._by_reply, self._by_clazz, self._by_recipient):
+            for key in list(index):
+                d = _deque(e for e in index[key] if e.alive)
+                if d:
+                    index[key] = d
+                else:
+                    del index[key]
+        self._dead = 0
+
+
+class _Waiter:
+    """A receiver blocked waiting for a message matching its filter, with its own condition on the gateway lock."""
+
+    __slots__ = ('filter', 'key', 'seq', 'cv', 'msg')
+
+    def __init__(self, filter, key, seq, lock):
+        self.filter = filter
+        self.key = key
+        self.seq = seq
+        self.cv = _td.Condition(lock)
+        self.msg = None
+
+
+class _Waiters:
+    """
+    Receivers blocked waiting for messages, indexed like :class:`_MessageQueue` by the message their filter
+    is a reply to, by class name and by recipient (agent or topic). Receivers with other filters (none, or
+    a lambda) are kept in a list. A received message is handed to the receiver that has waited longest of
+    those whose filter matches, and only that receiver is woken.
+
+    Not thread-safe; callers must hold the gateway lock, which is also the lock of the waiters' conditions.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.seq = _itertools.count()
+        self.by_key = dict()
+        self.others = list()
+        self.handoffs = 0
+
+    def __len__(self):
+        return sum(len(d) for d in self.by_key.values()) + len(self.others)
+
+    def __bool__(self):
+        return bool(self.by_key) or bool(self.others)
+
+    def add(self, filter):
+        """Register a receiver waiting for a message matching a filter."""
+
+        key = None
+        if isinstance(filter, _MessageBase):
+            key = ('r', filter.msgID) if filter.msgID else None
+        elif type(filter) == type(Message):
+            key = ('c', filter.__name__)
+        elif isinstance(filter, AgentID):
+            key = ('t', ('#' + filter.name) if filter.is_topic else filter.name)
+        w = _Waiter(filter, key, next(self.seq), self.lock)
+        if key is None:
+            self.others.append(w)
+        else:
+            self.by_key.setdefault(key, _deque()).append(w)
+        return w
+
+    def remove(self, w):
+        if w.key is None:
+            if w in self.others:
+                self.others.remove(w)
+            return
+        d = self.by_key.get(w.key)
+        if d is not None and w in d:
+            d.remove(w)
+            if not d:
+                del self.by_key[w.key]
+
+    def deliver(self, e, match):
+        """Hand a queue entry's message to the longest waiting receiver whose filter matches, and wake it.
+
+        :param e: :class:`_QueueEntry` for the message.
+        :param match: predicate ``match(filter, msg)`` for filters that are not indexed.
+        :returns: True if the message was handed to a receiver, False if it should be queued.
+        """
+
+        best = None
+        for key in (('r', e.inReplyTo), ('c', e.clazz), ('t', e.recipient)):
+            d = self.by_key.get(key)
+            if d and (best is None or d[0].seq < best.seq):
+                best = d[0]
+        for w in self.others:
+            if best is not None and w.seq > best.seq:
+                break
+            try:
+                if w.filter is None or match(w.filter, e.msg):
+                    best = w
+                    break
+            except Exception:
+                # a failing filter matches nothing, as when receiving from the queue
+                continue
+        if best is None:
+            return False
+        self.remove(best)
+        best.msg = e.msg
+        best.cv.notify()
+        self.handoffs += 1
+        return True
+
+    def wake_all(self):
+        """Wake all waiting receivers, without a message."""
+
+        for w in self.others + [w for d in self.by_key.values() for w in d]:
+            w.cv.notify()
+
+
+class _Scheduler:
+    """Runs callbacks after a delay on a single daemon thread, started on first use."""
+
+    def __init__(self, name):
+        self.name = name
+        self.cv = _td.Condition()
+        self.heap = list()
+        self.seq = _itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, fn, *args):
+        """Schedule ``fn(*args)`` to run after ``delay`` seconds.
+
+        :returns: a handle whose ``cancel()`` method prevents the callback from running.
+        """
+
+        task = _ScheduledTask(fn, args)
+        with self.cv:
+            _heapq.heappush(self.heap, (_time.monotonic() + delay, next(self.seq), task))
+            if self.thread is None:
+                self.thread = _td.Thread(target=self._run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cv.notify()
+        return task
+
+    def _run(self):
+        while True:
+            with self.cv:
+                while not self.heap or self.heap[0][0] > _time.monotonic():
+                    self.cv.wait(self.heap[0][0] - _time.monotonic() if self.heap else None)
+                task = _heapq.heappop(self.heap)[2]
+            if not task.cancelled:
+                try:
+                    task.fn(*task.args)
+                except Exception as e:
+                    _log.getLogger('org.arl.fjage').critical("Exception: Scheduled task failed - " + str(e))
+
+
+class _ScheduledTask:
+
+    __slots__ = ('fn', 'args', 'cancelled')
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Writer:
+    """
+    Writes frames queued by any thread to a socket from a single writer thread, so that frames are never
+    interleaved. Frames queued while a write is in progress are coalesced into one vectored write.
+
+    :param sock: connected socket.
+    :param max_batch_bytes: maximum number of bytes to coalesce into one write.
+    :param max_linger_us: time to wait for more frames before writing a batch smaller than max_batch_bytes.
+    """
+
+    def __init__(self, sock, max_batch_bytes=65536, max_linger_us=0, name="fjage-writer"):
+        self.sock = sock
+        self.max_batch_bytes = max_batch_bytes
+        self.max_linger_us = max_linger_us
+        self.logger = _log.getLogger('org.arl.fjage')
+        self.cv = _td.Condition()
+        self.frames = _deque()
+        self.nbytes = 0
+        self.queued = 0
+        self.written = 0
+        self.closed = False
+        self.failed = False
+        self.thread = _td.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, frame):
+        """Queue a frame to be written.
+
+        :returns: False if the writer is closed or a write failed (the frame is dropped).
+        """
+
+        with self.cv:
+            if self.closed or self.failed:
+                return False
+            self.frames.append(frame)
+            self.nbytes += len(frame)
+            self.queued += 1
+            self.cv.notify_all()
+        return True
+
+    def write_many(self, frames):
+        """Queue frames to be written.
+
+        :returns: False if the writer is closed or a write failed (the frames are dropped).
+        """
+
+        with self.cv:
+            if self.closed or self.failed:
+                return False
+            for frame in frames:
+                self.frames.append(frame)
+                self.nbytes += len(frame)
+                self.queued += 1
+            self.cv.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until all frames queued so far are written.
+
+        :param timeout: timeout in seconds, or None to wait indefinitely.
+        :returns: True if all frames were written, False on timeout.
+        """
+
+        with self.cv:
+            target = self.queued
+            return self.cv.wait_for(lambda: self.written >= target or self.closed, timeout) and self.written >= target
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cv:
+                while not self.frames and not self.closed:
+                    self.cv.wait()
+                if not self.frames:
+                    return
+                if self.max_linger_us > 0 and self.nbytes < self.max_batch_bytes:
+                    deadline = _time.monotonic() + self.max_linger_us / 1e6
+                    while self.nbytes < self.max_batch_bytes and not self.closed:
+                        t = deadline - _time.monotonic()
+                        if t <= 0:
+                            break
+                        self.cv.wait(t)
+                batch = [self.frames.popleft()]
+                size = len(batch[0])
+                while self.frames and size + len(self.frames[0]) <= self.max_batch_bytes:
+                    frame = self.frames.popleft()
+                    batch.append(frame)
+                    size += len(frame)
+                self.nbytes -= size
+            if not self.failed:
+                try:
+                    _sendv(self.sock, batch)
+                except Exception as e:
+                    # the connection is gone; frames still queued are dropped
+                    self.logger.critical("Exception: Write failed - " + str(e))
+                    self.failed = True
+            with self.cv:
+                self.written += len(batch)
+                self.cv.notify_all()
+
+
+def _unix_path(hostname):
+    """Socket path of a ``unix://`` URL, or None if the hostname is not one."""
+
+    if isinstance(hostname, str) and hostname.startswith("unix://"):
+        return hostname[7:]
+    return None
+
+
+def _sendv(sock, bufs):
+    """Write all buffers to a socket, using a single vectored write where the platform supports it."""
+
+    if len(bufs) == 1 or not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(bufs) if len(bufs) > 1 else bufs[0])
+        return
+    bufs = [memoryview(b) for b in bufs]
+    while bufs:
+        n = sock.sendmsg(bufs[:1024])
+        while n > 0:
+            if n >= len(bufs[0]):
+                n -= len(bufs[0])
+                bufs.pop(0)
+            else:
+                bufs[0] = bufs[0][n:]
+                n = 0
+
+
+class _Listener:
+    """A callback registered with :meth:`Gateway.add_listener`. Callbacks for messages sent to the same
+    recipient run one at a time on the executor, in the order the messages were received. Messages waiting
+    for a callback to finish are queued in a lane per recipient, which is dropped once it drains."""
+
+    def __init__(self, filter, callback, executor):
+        self.filter = filter
+        self.callback = callback
+        self.executor = executor
+        self.lock = _td.Lock()
+        self.lanes = dict()
+
+    def deliver(self, msg, recipient):
+        with self.lock:
+            lane = self.lanes.get(recipient)
+            if lane is not None:
+                lane.append(msg)
+                return
+            self.lanes[recipient] = _deque()
+        self._submit(msg, recipient)
+
+    def _submit(self, msg, recipient):
+        try:
+            self.executor.submit(self._run, msg, recipient)
+        except RuntimeError:
+            # the gateway closed and shut the executor down: drop the lane, with the messages still queued in it
+            with self.lock:
+                lane = self.lanes.pop(recipient, ())
+            _log.getLogger('org.arl.fjage').debug("Listener closed, dropping " + str(len(lane) + 1) + " message(s)")
+
+    def _run(self, msg, recipient):
+        try:
+            self.callback(msg)
+        except Exception as e:
+            _log.getLogger('org.arl.fjage').critical("Exception: Listener failed - " + str(e))
+        with self.lock:
+            lane = self.lanes[recipient]
+            if not lane:
+                del self.lanes[recipient]
+                return
+            msg = lane.popleft()
+        self._submit(msg, recipient)
+
+
+class _Stats:
+    """Gateway counters, cheap enough to leave on. Counters are plain attributes updated without locks by
+    the threads that send and receive; a snapshot taken while messages are flowing may be slightly off.
+
+    Round trip times of requests are counted in a histogram with power-of-two buckets in microseconds.
+    """
+
+    RTT_BUCKETS = 24
+
+    def __init__(self):
+        self.sent = dict()
+        self.received = dict()
+        self.sent_by_class = dict()
+        self.received_by_class = dict()
+        self.rtt = [0] * self.RTT_BUCKETS
+        self.rtt_count = 0
+        self.rtt_sum = 0.0
+        self.parse_count = 0
+        self.parse_time = 0.0
+        self.decode_count = 0
+        self.decode_time = 0.0
+        self.unmatched = 0
+        self.invalid = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.compress_count = 0
+        self.compress_skipped = 0
+        self.compress_in = 0
+        self.compress_out = 0
+        self.compress_time = 0.0
+        self.decompress_count = 0
+        self.decompress_in = 0
+        self.decompress_out = 0
+        self.decompress_time = 0.0
+        self.directory_hits = 0
+        self.directory_misses = 0
+        self.directory_refreshes = 0
+
+    def count(self, table, key, nbytes):
+        c = table.get(key)
+        if c is None:
+            c = table[key] = [0, 0]
+        c[0] += 1
+        c[1] += nbytes
+
+    def add_rtt(self, dt):
+        self.rtt[min(self.RTT_BUCKETS - 1, int(dt * 1e6).bit_length())] += 1
+        self.rtt_count += 1
+        self.rtt_sum += dt
+
+    def snapshot(self):
+        """Copy the counters into a dict of plain values."""
+
+        def table(t):
+            return {k: {"msgs": v[0], "bytes": v[1]} for k, v in list(t.items())}
+
+        return {
+            "sent": table(self.sent),
+            "received": table(self.received),
+            "sent_by_class": table(self.sent_by_class),
+            "received_by_class": table(self.received_by_class),
+            "rtt": {
+                "count": self.rtt_count,
+                "mean_ms": self.rtt_sum / self.rtt_count * 1000 if self.rtt_count else None,
+                "buckets_us": [1 << i for i in range(self.RTT_BUCKETS)],
+                "counts": list(self.rtt)
+            },
+            "parse": {"count": self.parse_count, "time_ms": self.parse_time * 1000},
+            "decode": {"count": self.decode_count, "time_ms": self.decode_time * 1000},
+            "unmatched": self.unmatched,
+            "invalid": self.invalid,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "compression": {
+                "frames": self.compress_count,
+                "skipped": self.compress_skipped,
+                "bytes_in": self.compress_in,
+                "bytes_out": self.compress_out,
+                "ratio": self.compress_out / self.compress_in if self.compress_in else None,
+                "cpu_ms": self.compress_time * 1000,
+                "decompressed_frames": self.decompress_count,
+                "decompressed_bytes_in": self.decompress_in,
+                "decompressed_bytes_out": self.decompress_out,
+                "decompress_cpu_ms": self.decompress_time * 1000
+            },
+            "directory": {
+                "hits": self.directory_hits,
+                "misses": self.directory_misses,
+                "refreshes": self.directory_refreshes
+            }
+        }
+
+
+class _Profiler:
+    """Per-stage profiler for the gateway pipelines. A thread starts profiling a message with :meth:`begin`,
+    then calls :meth:`mark` at the end of each stage, which charges the wall and CPU time since the previous
+    mark to that stage. Only one in every `sample` messages is timed, and marks on other messages return
+    straight away.
+
+    Stage names are paths separated by ';', rooted at the pipeline given to :meth:`begin`, so the
+    collected times can be written out as folded stacks for flame graph tools.
+    """
+
+    def __init__(self, sample=1):
+        self.sample = max(1, int(sample))
+        self.stages = dict()
+        self.messages = 0
+        self.local = _td.local()
+
+    def begin(self, pipeline):
+        local = self.local
+        local.n = n = getattr(local, 'n', -1) + 1
+        local.active = n % self.sample == 0
+        if local.active:
+            self.messages += 1
+            local.pipeline = pipeline
+            local.stages = set()
+            local.wall = _time.perf_counter_ns()
+            local.cpu = _time.thread_time_ns()
+
+    def mark(self, stage):
+        local = self.local
+        if not getattr(local, 'active', False):
+            return
+        wall = _time.perf_counter_ns()
+        cpu = _time.thread_time_ns()
+        key = local.pipeline + ';' + stage
+        c = self.stages.get(key)
+        if c is None:
+            c = self.stages[key] = [0, 0, 0]
+        c[0] += 1
+        c[1] += wall - local.wall
+        c[2] += cpu - local.cpu
+        local.wall = wall
+        local.cpu = cpu
+        local.stages.add(stage)
+
+    def marked(self, stage):
+        """Whether the message being profiled was charged to the given stage already."""
+
+        local = self.local
+        return getattr(local, 'active', False) and stage in local.stages
+
+    def end(self):
+        self.local.active = False
+
+    def table(self):
+        """Summary table of stages, with call counts and total and mean wall and CPU time."""
+
+        stages = sorted(list(self.stages.items()))
+        total = sum(c[1] for k, c in stages) or 1
+        lines = ["%-28s %9s %11s %9s %9s %6s" % ("stage", "count", "wall ms", "wall us", "cpu us", "wall%")]
+        for k, (n, wall, cpu) in stages:
+            lines.append("%-28s %9d %11.3f %9.2f %9.2f %6.1f" % (k, n, wall / 1e6, wall / n / 1e3, cpu / n / 1e3,
+                                                                  100 * wall / total))
+        lines.append("%d messages profiled, 1 in %d sampled" % (self.messages, self.sample))
+        return '\n'.join(lines)
+
+    def folded(self, cpu=False):
+        """Folded stacks, one line per stage with its total wall (or CPU) time in microseconds, as read by
+        flamegraph.pl and speedscope."""
+
+        return '\n'.join("gateway;%s %d" % (k, (c[2] if cpu else c[1]) // 1000) for k, c in sorted(list(self.stages.items())))
+
+
+class _GatewayBase:
+    """Protocol helpers shared by the blocking and asyncio gateways."""
+
+    registry = registry
+    metrics = None
+    profiler = None
+    binary = False
+
+    def topic(self, topic):
+        """Returns an object representing the named topic.
+
+        :param topic: name of the topic.
+        :returns: object representing the topic.
+        """
+
+        if isinstance(topic, str):
+            return AgentID(topic, True)
+        elif isinstance(topic, AgentID):
+            if topic.is_topic:
+                return topic
+            return AgentID(topic.name + "__ntf", True)
+        else:
+            return AgentID(topic.__class__.__name__ + "." + str(topic), True)
+
+    def getAgentID(self):
+        """ Returns the gateway Agent ID."""
+        return self.name
+
+    def _directory_response(self, req):
+        """Build the response to a directory request from the master, None if the action needs no response."""
+
+        action = req["action"]
+        if action not in (Action.AGENTS, Action.CONTAINS_AGENT, Action.SERVICES, Action.AGENT_FOR_SERVICE, Action.AGENTS_FOR_SERVICE):
+            return None
+        rsp = dict()
+        rsp["inResponseTo"] = action
+        rsp["id"] = str(req["id"])
+        if action == Action.AGENTS:
+            rsp["agentIDs"] = [self.name]
+        elif action == Action.CONTAINS_AGENT:
+            rsp["answer"] = bool(req.get("agentID")) and req["agentID"] == self.name
+        elif action == Action.SERVICES:
+            rsp["services"] = []
+        elif action == Action.AGENT_FOR_SERVICE:
+            rsp["agentID"] = ""
+        elif action == Action.AGENTS_FOR_SERVICE:
+            rsp["agentIDs"] = []
+        return rsp
+
+    def _is_for_me(self, msg):
+        """Check if a received message is addressed to the gateway or to one of its subscribed topics."""
+
+        return self._accepts(msg["data"]["recipient"])
+
+    def _accepts(self, recipient):
+        if recipient is None:
+            return False
+        if recipient == self.name:
+            return True
+        return self._is_topic(recipient) and recipient[1:] in self.subscribers
+
+    def _send_request(self, msg, relay=True):
+        """Build the JSON request to send a message."""
+
+        j_dict = dict()
+        m_dict = OrderedDict()
+        j_dict["action"] = Action.SEND
+        j_dict["relay"] = relay
+        msg.sender = self.name
+        m_dict["clazz"] = self.registry.java_name(msg.__class__)
+        m_dict["data"] = self._to_json(msg)
+        j_dict["message"] = m_dict
+        if isinstance(msg, GenericMessage):
+            j_dict["map"] = _encode_arrays(msg.map, self.binary)
+        return j_dict
+
+    def _service_request(self, action, service):
+        """Build a directory request for a named service."""
+
+        j_dict = dict()
+        j_dict["action"] = action
+        j_dict["id"] = str(_uuid.uuid4())
+        j_dict["service"] = self._service_name(service)
+        return j_dict
+
+    def _service_name(self, service):
+        if isinstance(service, str):
+            return service
+        return service.__class__.__name__ + "." + str(service)
+
+    def _matches(self, filter, msg):
+        """Check if a queued message (as received in JSON) matches a receive filter."""
+
+        if filter is None:
+            return True
+        # If filter is a Message, look for a Message that was inReplyto that message.
+        if isinstance(filter, _MessageBase):
+            return bool(filter.msgID) and filter.msgID == msg["data"].get("inReplyTo")
+        # If filter is a class, look for a Message of that class.
+        if type(filter) == type(Message):
+            return msg["clazz"].split(".")[-1] == filter.__name__
+        # If filter is a topic or agent, look for a Message sent to it.
+        if isinstance(filter, AgentID):
+            return msg["data"].get("recipient") == (('#' + filter.name) if filter.is_topic else filter.name)
+        # If filter is a lambda, look for a Message that on which the lambda returns True.
+        if isinstance(filter, type(lambda: 0)):
+            return bool(filter(msg))
+        return False
+
+    def _to_json(self, inst):
+        """Convert the object attributes to a dict."""
+
+        _sync_numpy()
+        plan = getattr(inst.__class__, '_plan', None)
+        if plan is not None:
+            dt = dict()
+            for attr, key in plan:
+                value = getattr(inst, attr)
+                if value is not None:
+                    dt[key] = _encode_arrays(value, self.binary) if isinstance(value, _ARRAY_LIKE) else value
+            # subclasses that do not declare __slots__ also have an instance dictionary
+            attrs = getattr(inst, '__dict__', None)
+            if not attrs:
+                return dt
+            dt.update(self._to_json_dict(attrs))
+            return dt
+        return self._to_json_dict(inst.__dict__)
+
+    def _to_json_dict(self, attrs):
+        dt = attrs.copy()
+        for key in list(dt):
+            if dt[key] is None:
+                dt.pop(key)
+                continue
+            if isinstance(dt[key], _ARRAY_LIKE):
+                dt[key] = _encode_arrays(dt[key], self.binary)
+            if list(key)[-1] == '_':
+                dt[key[:-1]] = dt.pop(key)
+            if key == 'map':
+                dt.pop(key)
+        return dt
+
+    def _from_json(self, dt):
+        """If possible, do class loading, else return the dict."""
+
+        if 'clazz' in dt:
+            class_ = self.registry.lookup(dt['clazz'])
+            if class_ is None:
+                return dt
+            prof = self.profiler
+            if prof:
+                prof.mark("lookup")
+                args = _decode_arrays(dt["data"])
+                prof.mark("arrays")
+                inst = class_(**args)
+                prof.mark("construct")
+                return inst
+            inst = class_(**_decode_arrays(dt["data"]))
+        else:
+            inst = dt
+        return inst
+
+    def _decode(self, rmsg):
+        """Convert a queued message to a message object, None if class loading fails."""
+
+        if self.metrics is None:
+            return self._decode_message(rmsg)
+        t = _time.perf_counter()
+        rsp = self._decode_message(rmsg)
+        self.metrics.decode_time += _time.perf_counter() - t
+        self.metrics.decode_count += 1
+        return rsp
+
+    def _decode_message(self, rmsg):
+        try:
+            rsp = self._from_json(rmsg)
+            # add map if it is a Generic message
+            if isinstance(rsp, GenericMessage):
+                if "map" in rmsg["data"]:
+                    map = rmsg["data"]["map"]
+                    if not isinstance(map, dict):
+                        map = _json.loads(str(map))
+                    rsp.__dict__.update(map)
+                else:
+                    self.logger.warning("No map field found in Generic Message")
+        except Exception as e:
+            self.logger.critical("Exception: Class loading failed - " + str(e))
+            return None
+        return rsp
+
+    def _is_topic(self, recipient):
+        if recipient[0] == "#":
+            return True
+        return False
+
+
+class Gateway(_GatewayBase):
+    """ Gateway to communicate with agents from Python. Creates a gateway connecting to a specified master container.
+
+        :param hostname: hostname to connect to, or ``unix://`` followed by the path of a Unix domain socket
+                         to connect to a master container on the same host.
+        :param port: TCP port to connect to (not used for Unix domain sockets).
+        :param name: name of the gateway agent, generated if not specified.
+        :param codec: JSON codec ('orjson', 'ujson' or 'json'), the fastest one installed if not specified.
+        :param max_batch_bytes: maximum number of bytes of queued messages to coalesce into one socket write.
+        :param max_linger_us: time in microseconds to wait for more outgoing messages before writing a
+                              batch smaller than max_batch_bytes (0 to write as soon as possible).
+        :param listener_threads: maximum number of threads used to run listener callbacks.
+        :param reconnect: reconnect automatically, with exponential backoff, if the connection to the master is
+                          lost. Requests waiting for a response when the connection is lost fail with
+                          :class:`ConnectionError`. The gateway does not reconnect after the master shuts down
+                          the platform.
+        :param max_backoff: maximum time in milliseconds between reconnection attempts.
+        :param buffer_size: maximum number of outgoing messages to buffer while disconnected, to be sent once
+                            reconnected (0 to not buffer; sending then fails while disconnected).
+        :param wire: wire format, 'json' for newline delimited JSON, or 'msgpack' to ask the master for
+                     length-prefixed MessagePack frames with primitive arrays as raw binary data (needs the
+                     ``msgpack`` package). The gateway falls back to JSON if the master does not support it.
+        :param compression: compress large frames in the binary wire format, if the master agrees: True for
+                            any available method, or the name or list of names of methods to offer, in order
+                            of preference ('zstd', 'lz4' or 'zlib').
+        :param compress_threshold: size in bytes of the smallest frame to consider compressing. Which larger
+                                   frames are compressed adapts to the compression ratio achieved.
+        :param directory_ttl: time in milliseconds to cache the answers of :meth:`agentForService`,
+                              :meth:`agentsForService` and :meth:`resolveServices` (0 to not cache).
+        :param negative_ttl: time in milliseconds to cache answers that no agent provides a service, the same
+                             as directory_ttl if None.
+        :param refresh_ahead: fraction of directory_ttl after which a lookup answered from the cache also
+                              refreshes the entry in the background, so that frequently used entries do not
+                              expire (0 to not refresh ahead).
+    """
+
+    DEFAULT_TIMEOUT = 1000
+    NON_BLOCKING = 0
+    BLOCKING = -1
+    MIN_BACKOFF = 100
+    DROP_OLDEST = _MessageQueue.DROP_OLDEST
+    DROP_NEWEST = _MessageQueue.DROP_NEWEST
+    BLOCK = _MessageQueue.BLOCK
+
+    def __init__(self, hostname, port=None, name=None, codec=None, max_batch_bytes=65536, max_linger_us=0,
+                 listener_threads=4, reconnect=True, max_backoff=5000, buffer_size=0, wire='json',
+                 compression=None, compress_threshold=512, directory_ttl=0, negative_ttl=None, refresh_ahead=0):
+        """NOTE: Developer must make sure a duplicate name is not assigned to the Gateway."""
+
+        self.logger = _log.getLogger('org.arl.fjage')
+
+        try:
+            self.codec = self.json_codec = _json_codec(codec)
+            if wire == 'msgpack':
+                self.wire_codec = _MsgpackCodec()
+            elif wire == 'json':
+                self.wire_codec = None
+            else:
+                raise ValueError("Unknown wire format: " + str(wire))
+            self.compression = _compression_methods(compression)
+            if self.compression and self.wire_codec is None:
+                raise ValueError("Compression needs the binary wire format")
+            self.compress_threshold = compress_threshold
+            self.compressor = None
+            self.directory_ttl = directory_ttl
+            self.negative_ttl = directory_ttl if negative_ttl is None else negative_ttl
+            self.refresh_ahead = refresh_ahead
+            self.directory = dict()
+            self.refreshing = set()
+            if name == None:
+                self.name = "PythonGW-" + str(_uuid.uuid4())
+            else:
+                try:
+                    self.name = name
+                except Exception as e:
+                    self.self.logger.critical("Exception: Cannot assign name to gateway: " + str(e))
+                    raise
+
+            self.q = _MessageQueue()
+            self.subscribers = set()
+            self.pending = dict()
+            lock = _td.RLock()
+            self.cv = _td.Condition(lock)
+            self.waiters = _Waiters(lock)
+            self.scheduler = _Scheduler("fjage-timer")
+            self.metrics = _Stats()
+            self.stats_task = None
+            self.listener_threads = listener_threads
+            self.listener_pool = None
+            self.topic_listeners = dict()
+            self.filter_listeners = list()
+            self.hostname = hostname
+            self.port = port
+            self.max_batch_bytes = max_batch_bytes
+            self.max_linger_us = max_linger_us
+            self.reconnect = reconnect
+            self.max_backoff = max_backoff
+            self.buffer_size = buffer_size
+            self.outbox = _deque()
+            self.outbox_codec = self.codec
+            self.connected = False
+            self.conn_lock = _td.Lock()
+            self.closing = _td.Event()
+
+            self.recv_thread = _td.Thread(target=self.__recv_proc, args=(self.q, self.subscribers, ))
+            self.recv_thread.daemon = True
+
+            self._connect()
+            self.recv_thread.start()
+
+            if self._is_duplicate():
+                self.logger.critical("Duplicate Gateway found. Shutting down.")
+                self._close()
+                raise Exception('DuplicateGatewayException')
+
+        except Exception as e:
+            self.logger.critical("Exception: " + str(e))
+            raise
+
+    def _parse_dispatch(self, rmsg, q, codec=None):
+        """Parse incoming messages and respond to them or dispatch them."""
+
+        # fast path: drop messages not for us, and queue messages for us unparsed
+        metrics = self.metrics
+        prof = self.profiler
+        header = None if self.binary else _peek(rmsg)
+        if prof:
+            prof.mark("peek")
+        if header is not None:
+            metrics.count(metrics.received, header[0], len(rmsg))
+            if header[1] is not None:
+                metrics.count(metrics.received_by_class, header[1], len(rmsg))
+            if header[0] == Action.SEND and header[3] not in self.pending:
+                recipient = header[2]
+                if not self._accepts(recipient):
+                    metrics.unmatched += 1
+                    return True
+                if recipient not in self.topic_listeners and not self.filter_listeners:
+                    self._enqueue(q, rmsg, len(rmsg), header)
+                    return True
+
+        t = _time.perf_counter()
+        req = (codec or self.codec).loads(rmsg)
+        metrics.parse_time += _time.perf_counter() - t
+        metrics.parse_count += 1
+        if prof:
+            prof.mark("parse")
+        if header is None:
+            action = req.get("action", "response")
+            metrics.count(metrics.received, action, len(rmsg))
+            if action == Action.SEND and isinstance(req.get("message"), dict) and "clazz" in req["message"]:
+                metrics.count(metrics.received_by_class, req["message"]["clazz"], len(rmsg))
+        if "id" in req:
+            req['id'] = _uuid.UUID(req['id'])
+            if prof:
+                prof.mark("uuid")
+
+        if "action" in req:
+
+            rsp = self._directory_response(req)
+            if rsp is not None:
+                self._write_request(rsp)
+
+            elif req["action"] == Action.SEND:
+                try:
+                    msg = req["message"]
+                    if self._complete_request(msg):
+                        pass
+                    elif not self._is_for_me(msg):
+                        metrics.unmatched += 1
+                    elif self._notify_listeners(msg):
+                        pass
+                    else:
+                        if prof:
+                            prof.mark("dispatch")
+                        self._enqueue(q, msg, len(rmsg))
+                except Exception as e:
+                    self.logger.critical("Exception: Error adding to queue - " + str(e))
+            elif req["action"] == Action.SHUTDOWN:
+                self.logger.debug("ACTION: " + Action.SHUTDOWN)
+                # the platform is going down: close for good, rather than reconnect once the master drops us
+                self._disconnect()
+                return None
+            else:
+                metrics.invalid += 1
+                self.logger.warning("Invalid message, discarding")
+        else:
+            if "id" in req:
+                if req['id'] in self.pending:
+                    tup = self.pending[req["id"]]
+                    self.pending[req["id"]] = (tup[0], req)
+                    tup[0].set()
+        return True
+
+    def _enqueue(self, q, msg, size, header=None):
+        self.cv.acquire()
+        try:
+            e = _QueueEntry(msg, size, header, self._load_message)
+            prof = self.profiler
+            while True:
+                # a receiver may start waiting while the queue is full, so try it again after waiting
+                if self.waiters and self.waiters.deliver(e, self._matches):
+                    if prof:
+                        prof.mark("notify")
+                    return
+                if q.append_entry(e) or q.policy != q.BLOCK:
+                    break
+                if self.closing.is_set():
+                    # nobody will make space, so let the receive thread finish
+                    q.dropped += 1
+                    break
+                # hold off reading from the socket until a receiver makes space
+                self.cv.wait(1 if q.reply_ttl is not None else None)
+            if prof:
+                prof.mark("enqueue")
+        finally:
+            self.cv.release()
+
+    def _load_message(self, rmsg):
+        prof = self.profiler
+        if prof:
+            prof.mark("queue")
+        t = _time.perf_counter()
+        # only messages peeked at in the JSON wire format are queued unparsed
+        msg = self.json_codec.loads(rmsg)["message"]
+        self.metrics.parse_time += _time.perf_counter() - t
+        self.metrics.parse_count += 1
+        if prof:
+            prof.mark("parse")
+        return msg
+
+    def __recv_proc(self, q, subscribers):
+        """Receive process."""
+
+        while True:
+            prof = self.profiler
+            if prof:
+                prof.begin("recv")
+            try:
+                rmsg = self._read()
+            except (OSError, ValueError) as e:
+                self.logger.critical("Exception: " + str(e))
+                rmsg = None
+            if not rmsg:
+                if prof:
+                    prof.end()
+                if self._connection_lost():
+                    continue
+                return
+            if prof:
+                prof.mark("readline")
+            try:
+                if self.logger.isEnabledFor(_log.DEBUG):
+                    self.logger.debug("%s <<< %s", self.peer, _Payload(rmsg))
+                # Parse and dispatch incoming messages
+                self._parse_dispatch(rmsg, q)
+            except Exception as e:
+                self.logger.critical("Exception: " + str(e))
+            if prof:
+                prof.end()
+
+    def _connect(self):
+        """Open the connection to the master."""
+
+        path = _unix_path(self.hostname)
+        if path is None:
+            self.logger.info("Connecting to " + str(self.hostname) + ":" + str(self.port))
+            sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+            address = (self.hostname, self.port)
+        else:
+            self.logger.info("Connecting to " + self.hostname)
+            sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+            address = path
+        codec, head, early = self.json_codec, b'', []
+        self.compressor = None
+        try:
+            sock.connect(address)
+            if self.wire_codec is not None:
+                codec, head, early = self._negotiate(sock)
+        except OSError:
+            sock.close()
+            raise
+        self.socket = sock
+        self.socket_file = _io.BufferedReader(_SocketReader(sock, head), 65536) if head else sock.makefile('rb', 65536)
+        self.codec = codec
+        self.binary = getattr(codec, 'binary', False)
+        self._read = self._read_frame if self.binary else self.socket_file.readline
+        self.peer = self.hostname if path is not None else "%s:%s" % sock.getpeername()[:2]
+        self.writer = _Writer(sock, self.max_batch_bytes, self.max_linger_us)
+        with self.conn_lock:
+            # messages buffered while disconnected go out before any sent from now on
+            frames = self.outbox
+            if frames and self.outbox_codec is not codec:
+                frames = self._transcode(frames, self.outbox_codec)
+            self.writer.write_many(self._compress(frames))
+            self.outbox.clear()
+            self.connected = True
+        for line in early:
+            self._parse_dispatch(line, self.q, self.json_codec)
+
+    def _negotiate(self, sock):
+        """Ask the master to switch to the binary wire format. Masters that do not know the request ignore it,
+        so the gateway stays with JSON if there is no answer in time.
+
+        :returns: codec to use, data received after the answer, and JSON lines received before it.
+        """
+
+        req_id = str(_uuid.uuid4())
+        req = {"action": Action.WIRE_FORMAT, "id": req_id, "formats": [self.wire_codec.name]}
+        if self.compression:
+            req["compressions"] = self.compression
+        sock.sendall(self.json_codec.dumps(req))
+        buf = b''
+        lines = list()
+        deadline = _time.monotonic() + self.DEFAULT_TIMEOUT / 1000
+        try:
+            while True:
+                i = buf.find(b'\n')
+                if i < 0:
+                    timeout = deadline - _time.monotonic()
+                    if timeout <= 0:
+                        break
+                    sock.settimeout(timeout)
+                    data = sock.recv(65536)
+                    if not data:
+                        raise ConnectionError("Connection closed by master")
+                    buf += data
+                    continue
+                line, buf = buf[:i + 1], buf[i + 1:]
+                rsp = self.json_codec.loads(line)
+                if rsp.get("id") == req_id and "action" not in rsp:
+                    if rsp.get("format") == self.wire_codec.name:
+                        self.logger.info("Using " + self.wire_codec.name + " wire format")
+                        if rsp.get("compression") in self.compression:
+                            self.compressor = _Compressor(rsp["compression"], self.compress_threshold)
+                            self.logger.info("Using " + self.compressor.method + " compression")
+                        return self.wire_codec, buf, lines
+                    break
+                lines.append(line)
+        except _socket.timeout:
+            pass
+        finally:
+            sock.settimeout(None)
+        self.logger.info("Master does not support " + self.wire_codec.name + " wire format, using JSON")
+        return self.json_codec, b''.join(lines) + buf, []
+
+    def _read_frame(self):
+        """Read the payload of a binary wire format frame, empty at the end of the stream."""
+
+        head = self.socket_file.read(_FRAME.size)
+        if len(head) < _FRAME.size:
+            return b''
+        n, flags = _FRAME.unpack(head)
+        payload = self.socket_file.read(n)
+        if len(payload) < n:
+            return b''
+        if flags:
+            if self.compressor is None:
+                raise ValueError("Unsupported frame flags: %d" % flags)
+            payload = self.compressor.decompress(flags, payload, self.metrics)
+        return payload
+
+    def _compress(self, frames):
+        compressor = self.compressor
+        if compressor is None:
+            return frames
+        return [compressor.compress(frame, self.metrics) for frame in frames]
+
+    def _transcode(self, frames, codec):
+        """Re-encode frames buffered in another wire format, if the format changed on reconnecting."""
+
+        rv = list()
+        for frame in frames:
+            obj = codec.loads(frame[_FRAME.size:] if getattr(codec, 'binary', False) else frame)
+            rv.append(self.codec.dumps(obj if self.binary else _base64_arrays(obj)))
+        return rv
+
+    def _close(self):
+        """Close the connection to the master, for good."""
+
+        self.closing.set()
+        with self.conn_lock:
+            self.connected = False
+        self.writer.close()
+        try:
+            self.socket.shutdown(_socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self._stop_listeners()
+
+    def _stop_listeners(self):
+        """Shut down the listener thread pool. Callbacks already queued still run, then its threads exit."""
+
+        pool = self.listener_pool
+        if pool is not None:
+            self.listener_pool = None
+            pool.shutdown(wait=False)
+
+    def _connection_lost(self):
+        """Handle the loss of the connection to the master: fail the requests waiting for responses, and
+        reconnect with exponential backoff if enabled. Called from the receive thread.
+
+        :returns: True once reconnected, False if the gateway is closed.
+        """
+
+        with self.conn_lock:
+            self.connected = False
+        self.writer.close()
+        self.socket_file.close()
+        self.socket.close()
+        # agents may come and go while disconnected, or the master may restart
+        self.directory.clear()
+        self._fail_pending(ConnectionError("Connection to master lost"))
+        if self.closing.is_set():
+            return False
+        self.logger.critical("Exception: Socket Closed")
+        if not self.reconnect:
+            self.closing.set()
+            self._stop_listeners()
+            return False
+        backoff = self.MIN_BACKOFF
+        while not self.closing.wait(backoff / 1000):
+            try:
+                self._connect()
+            except OSError as e:
+                self.logger.warning("Reconnect to " + str(self.peer) + " failed - " + str(e))
+                backoff = min(2 * backoff, self.max_backoff)
+                continue
+            self.metrics.reconnects += 1
+            # the master learns the gateway name from directory requests; check that nobody took it meanwhile
+            _td.Thread(target=self._check_name, name="fjage-reconnect", daemon=True).start()
+            return True
+        return False
+
+    def _check_name(self):
+        if self._contains_agent(self.name, self.DEFAULT_TIMEOUT) and not self.closing.is_set():
+            self.logger.critical("Duplicate Gateway found after reconnecting. Shutting down.")
+            self._close()
+
+    def _fail_pending(self, exc):
+        """Fail all requests waiting for responses."""
+
+        for key in list(self.pending):
+            p = self.pending.pop(key, None)
+            if isinstance(p, _futures.Future):
+                p.set_exception(exc)
+            elif p is not None:
+                # directory request: wake the caller with no response
+                self.pending[key] = (p[0], None)
+                p[0].set()
+
+    def _write_frames(self, frames):
+        """Queue frames for the writer, or buffer them while disconnected.
+
+        :returns: False if the frames are dropped, because the connection failed or was closed, or because
+                  the gateway is disconnected and they do not fit in the buffer.
+        """
+
+        if not self.connected:
+            with self.conn_lock:
+                if not self.connected:
+                    if self.closing.is_set() or len(self.outbox) + len(frames) > self.buffer_size:
+                        return False
+                    if not self.outbox:
+                        self.outbox_codec = self.codec
+                    self.outbox.extend(frames)
+                    return True
+        return self.writer.write_many(self._compress(frames))
+
+    def __del__(self):
+        try:
+            self.socket.close
+        except Exception as e:
+            self.logger.critical("Exception: " + str(e))
+
+    def shutdown(self):
+        """ Closes the gateway. The gateway functionality may not longer be accessed after this method is called."""
+
+        j_dict = dict()
+        j_dict["action"] = Action.SHUTDOWN
+        self.closing.set()
+        if self.connected:
+            self.writer.write(self.codec.dumps(j_dict))
+            self.writer.flush(1)
+        self._disconnect()
+
+    def _disconnect(self):
+        """Close the gateway without asking the master to shut down, as :meth:`shutdown` does (the master
+        container shuts down the whole platform on a shutdown request)."""
+
+        self.closing.set()
+        with self.cv:
+            # wake up blocked receivers, so that they return
+            self.waiters.wake_all()
+            self.cv.notify_all()
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+        self._close()
+
+    def send(self, msg, relay=True):
+        """Sends a message to the recipient indicated in the message. The recipient may be an agent or a topic.
+        The message is queued for the writer thread, and may not have been written to the socket when this
+        method returns; use :meth:`flush` to wait for it."""
+
+        if not msg.recipient:
+            return False
+        return self._write_frames([self._frame(msg, relay)])
+
+    def send_many(self, msgs, relay=True):
+        """Sends several messages, queueing them for the writer thread together so that they are coalesced
+        into as few socket writes as possible.
+
+        :param msgs: messages to send.
+        :returns: True if all messages were sent, False if any had no recipient (those are skipped).
+        """
+
+        frames = [self._frame(msg, relay) for msg in msgs if msg.recipient]
+        return self._write_frames(frames) and len(frames) == len(msgs)
+
+    def flush(self, timeout=None):
+        """Waits until all messages sent so far have been written to the socket.
+
+        :param timeout: timeout in milliseconds, or None to wait indefinitely.
+        :returns: True if all messages were written, False on timeout.
+        """
+
+        return self.writer.flush(None if timeout is None else timeout / 1000)
+
+    def _frame(self, msg, relay):
+        req = self._send_request(msg, relay)
+        frame = self.codec.dumps(req)
+        self.metrics.count(self.metrics.sent, Action.SEND, len(frame))
+        self.metrics.count(self.metrics.sent_by_class, req["message"]["clazz"], len(frame))
+        if self.logger.isEnabledFor(_log.DEBUG):
+            self.logger.debug("%s >>> %s", self.peer, _Payload(frame))
+        return frame
+
+    def _write_request(self, req):
+        frame = self.codec.dumps(req)
+        self.metrics.count(self.metrics.sent, req.get("action", "response"), len(frame))
+        if not self._write_frames([frame]):
+            raise ConnectionError("Not connected to master")
+
+    def _retrieveManyFromQueue(self, filter, n, timeout):
+        """Take up to n matching messages from the queue, waiting until timeout for the first to arrive.
+        A waiting receiver registers with :attr:`waiters`, and is woken only by a message handed to it."""
+
+        rmsgs = list()
+        self.cv.acquire()
+        try:
+            rmsgs = self.q.pop_many(filter, n, self._matches)
+            if not rmsgs and timeout != self.NON_BLOCKING and not self.closing.is_set():
+                deadline = None if timeout == self.BLOCKING else _time.monotonic() + max(timeout, 0) / 1000
+                w = self.waiters.add(filter)
+                try:
+                    while w.msg is None and not self.closing.is_set():
+                        t = None if deadline is None else deadline - _time.monotonic()
+                        if t is not None and t <= 0:
+                            break
+                        w.cv.wait(t)
+                finally:
+                    self.waiters.remove(w)
+                if w.msg is not None:
+                    rmsgs = [w.msg]
+                    if n > 1:
+                        rmsgs.extend(self.q.pop_many(filter, n - 1, self._matches))
+            if rmsgs and self.q.policy == self.q.BLOCK:
+                self.cv.notify_all()
+        except Exception as e:
+            self.logger.critical("Error: Queue empty/timeout - " + str(e))
+        finally:
+            self.cv.release()
+        return rmsgs
+
+    def receive(self, filter=None, timeout=0):
+        """
+        Returns a message received by the gateway and matching the given filter. This method blocks until timeout if no message available.
+
+        :param filter: message filter.
+        :param timeout: timeout in milliseconds.
+        :returns: received message matching the filter, null on timeout.
+        """
+
+        prof = self.profiler
+        if prof:
+            prof.begin("receive")
+        rmsgs = self._retrieveManyFromQueue(filter, 1, timeout)
+        if prof and not prof.marked("queue"):
+            # messages queued unparsed mark the end of their wait when they are parsed
+            prof.mark("queue")
+        if not rmsgs:
+            return None
+        rsp = self._decode(rmsgs[0])
+        if prof:
+            prof.mark("decode")
+            prof.end()
+        return rsp
+
+    def receive_many(self, filter=None, n=64, timeout=0):
+        """
+        Returns up to n messages received by the gateway and matching the given filter, oldest first. This
+        method blocks until timeout if no message available, and returns as soon as there is at least one.
+
+        :param filter: message filter.
+        :param n: maximum number of messages to return.
+        :param timeout: timeout in milliseconds.
+        :returns: list of received messages matching the filter, empty on timeout.
+        """
+
+        return [msg for msg in map(self._decode, self._retrieveManyFromQueue(filter, n, timeout)) if msg is not None]
+
+    def stream(self, filter=None, max_batch=64, timeout=BLOCKING):
+        """
+        Yields messages received by the gateway and matching the given filter, as they arrive::
+
+            for ntf in gw.stream(gw.topic(node), timeout=5000):
+                print(ntf)
+
+        Messages are taken from the queue up to max_batch at a time, so a busy topic costs one lock
+        acquisition and wakeup per batch rather than per message.
+
+        :param filter: message filter.
+        :param max_batch: maximum number of messages taken from the queue at a time.
+        :param timeout: timeout in milliseconds for the next message, after which the stream ends; BLOCKING to
+                        wait until the gateway is shut down.
+        """
+
+        while True:
+            rmsgs = self._retrieveManyFromQueue(filter, max_batch, timeout)
+            if not rmsgs:
+                return
+            for rmsg in rmsgs:
+                msg = self._decode(rmsg)
+                if msg is not None:
+                    yield msg
+
+    def request(self, msg, timeout=1000):
+        """Sends a request and waits for a response. This method blocks until timeout if no response is received.
+
+        :param msg: message to send.
+        :param timeout: timeout in milliseconds.
+        :returns: received response message, null on timeout.
+        :raises ConnectionError: if the connection to the master is lost before the response arrives.
+        """
+
+        return self.request_async(msg, timeout).result()
+
+    def request_async(self, msg, timeout=1000):
+        """Sends a request and returns without waiting for the response. The response is delivered through
+        the returned future by the receive thread, so any number of requests may be in flight at once.
+
+        :param msg: message to send.
+        :param timeout: timeout in milliseconds, or BLOCKING to wait indefinitely.
+        :returns: a :class:`concurrent.futures.Future` whose result is the response message, None on timeout.
+        """
+
+        fut = self._pending_request(msg, timeout)
+        if not self.send(msg) and msg.recipient:
+            self._fail_request(msg.msgID)
+        return fut
+
+    def request_many(self, msgs, timeout=1000):
+        """Sends several requests back-to-back and waits for all their responses.
+
+        :param msgs: messages to send.
+        :param timeout: timeout in milliseconds for each request.
+        :returns: list of response messages in the order of the requests, with None for requests that timed out
+                  or have no recipient.
+        :raises ConnectionError: if the requests could not be sent, or the connection to the master is lost
+                                 before the responses arrive.
+        """
+
+        futs = [self._pending_request(msg, timeout) for msg in msgs]
+        msgs = [msg for msg in msgs if msg.recipient]
+        if not self._write_frames([self._frame(msg, True) for msg in msgs]):
+            for msg in msgs:
+                self._fail_request(msg.msgID)
+        return [fut.result() for fut in futs]
+
+    def _pending_request(self, msg, timeout):
+        """Register a future for the response to a request about to be sent."""
+
+        fut = _futures.Future()
+        if not msg.recipient:
+            fut.set_result(None)
+            return fut
+        fut.sent = _time.perf_counter()
+        self.pending[msg.msgID] = fut
+        if timeout != self.BLOCKING:
+            timer = self.scheduler.schedule(max(timeout, 0) / 1000, self._expire_request, msg.msgID)
+            fut.add_done_callback(lambda f: timer.cancel())
+        return fut
+
+    def _complete_request(self, msg):
+        """Complete the pending request that a received message is in reply to, if any."""
+
+        inReplyTo = msg["data"].get("inReplyTo")
+        if inReplyTo is None:
+            return False
+        fut = self.pending.pop(inReplyTo, None)
+        if fut is None:
+            return False
+        self.metrics.add_rtt(_time.perf_counter() - fut.sent)
+        fut.set_result(self._decode(msg))
+        return True
+
+    def _fail_request(self, msgID):
+        fut = self.pending.pop(msgID, None)
+        if fut is not None:
+            fut.set_exception(ConnectionError("Not connected to master"))
+
+    def _expire_request(self, msgID):
+        fut = self.pending.pop(msgID, None)
+        if fut is not None:
+            self.metrics.timeouts += 1
+            fut.set_result(None)
+
+    def set_queue_limits(self, size=None, nbytes=None, policy=DROP_OLDEST, topic_size=None, reply_ttl=None):
+        """Bounds the queue of received messages waiting for :meth:`receive`. By default the queue is unbounded.
+        The number of messages dropped is counted in ``q.dropped``, and of replies expired in ``q.expired``.
+
+        :param size: maximum number of queued messages, None for no limit.
+        :param nbytes: maximum total size in bytes of queued messages, None for no limit.
+        :param policy: on overflow, DROP_OLDEST drops the oldest queued messages, DROP_NEWEST drops the message
+                       just received, and BLOCK stops reading from the socket until a message is received
+                       (pushing back on the master through TCP flow control; note that no replies or
+                       directory responses are processed while blocked).
+        :param topic_size: maximum number of queued messages per topic, either for all topics or as a dict
+                           keyed by topic name. The oldest message on the topic is dropped on overflow.
+        :param reply_ttl: time in milliseconds after which replies nobody has received (such as late replies to
+                          requests that timed out) are discarded, None to keep them.
+        """
+
+        self.cv.acquire()
+        try:
+            self.q.set_limits(size, nbytes, policy, topic_size, None if reply_ttl is None else reply_ttl / 1000)
+            self.cv.notify_all()
+        finally:
+            self.cv.release()
+
+    def stats(self, reset=False):
+        """Returns gateway statistics: messages and bytes sent and received per action and per message class,
+        queue depth (current and peak), queued bytes, receivers waiting and messages handed straight to them,
+        pending requests, a histogram of request round trip times, time spent parsing and decoding received
+        messages, and counts of messages dropped, expired,
+        unmatched (not addressed to the gateway or a subscribed topic) and invalid, requests timed out,
+        reconnections, and frames compressed and decompressed with the bytes saved and CPU time spent.
+
+        :param reset: reset the counters after reading them.
+        :returns: dict of statistics, suitable for JSON export.
+        """
+
+        rv = self.metrics.snapshot()
+        rv["queue"] = {"depth": len(self.q), "peak": self.q.peak, "bytes": self.q.nbytes,
+                       "dropped": self.q.dropped, "expired": self.q.expired,
+                       "waiting": len(self.waiters), "handoffs": self.waiters.handoffs}
+        rv["pending"] = len(self.pending)
+        rv["writer"] = {"queued": self.writer.queued, "written": self.writer.written}
+        compressor = self.compressor
+        rv["compression"]["method"] = compressor.method if compressor is not None else None
+        rv["compression"]["threshold"] = compressor.effective_threshold() if compressor is not None else None
+        if reset:
+            self.metrics = _Stats()
+            self.q.peak = len(self.q)
+        return rv
+
+    def start_profiling(self, sample=1):
+        """Starts profiling the time taken by each stage of receiving messages, both on the receive thread
+        (reading, parsing, dispatching and queueing messages) and in :meth:`receive` (taking messages from the
+        queue and decoding them). Wall time of reading and of taking messages from the queue includes time
+        spent waiting for messages.
+
+        :param sample: profile one in every `sample` messages, to reduce the overhead.
+        """
+
+        self.profiler = _Profiler(sample)
+
+    def stop_profiling(self):
+        """Stops profiling. The profile collected remains available from :meth:`profile`."""
+
+        self._profile = self.profiler
+        self.profiler = None
+
+    def profile(self, format='table'):
+        """Returns the profile collected since profiling was started.
+
+        :param format: 'table' for a summary of wall and CPU time per stage, 'folded' for folded stacks
+                       of wall time in microseconds (for flamegraph.pl or speedscope), 'folded-cpu' for folded
+                       stacks of CPU time.
+        :returns: the profile as a string, None if profiling was never started.
+        """
+
+        prof = self.profiler or getattr(self, '_profile', None)
+        if prof is None:
+            return None
+        if format == 'table':
+            return prof.table()
+        if format in ('folded', 'folded-cpu'):
+            return prof.folded(format == 'folded-cpu')
+        raise ValueError("Unknown profile format: " + str(format))
+
+    def export_stats(self, interval, callback=None, reset=False):
+        """Periodically exports gateway statistics (see :meth:`stats`).
+
+        :param interval: export interval in milliseconds, None to stop exporting.
+        :param callback: function called with the statistics from the timer thread, None to log them as JSON
+                         at INFO level.
+        :param reset: reset the counters after each export, so that each export covers one interval.
+        """
+
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            self.stats_task = None
+        if interval is None:
+            return
+
+        def export():
+            stats = self.stats(reset)
+            try:
+                if callback is None:
+                    self.logger.info("Stats: " + _json.dumps(stats))
+                else:
+                    callback(stats)
+            finally:
+                if self.stats_task is current:
+                    schedule()
+
+        def schedule():
+            nonlocal current
+            current = self.stats_task = self.scheduler.schedule(interval / 1000, export)
+
+        current = None
+        schedule()
+
+    def subscribe(self, topic):
+        """Subscribes the gateway to receive all messages sent to the given topic.
+
+        :param topic: the topic to subscribe to.
+        """
+
+        if isinstance(topic, AgentID):
+            new_topic = self.topic(topic)
+            if new_topic.name in self.subscribers:
+                self.logger.critical("Error: Already subscribed to topic")
+                return
+            self.subscribers.add(new_topic.name)
+        else:
+            self.logger.critical("Invalid AgentID")
+
+    def unsubscribe(self, topic):
+        """Unsubscribes the gateway from a given topic.
+
+        :param topic: the topic to unsubscribe.
+
+        """
+
+        if isinstance(topic, AgentID):
+            new_topic = self.topic(topic)
+            if len(self.subscribers) == 0:
+                return False
+            try:
+                self.subscribers.remove(new_topic.name)
+            except KeyError:
+                self.logger.critical("Exception: No such topic subscribed: " + new_topic.name)
+            return True
+        else:
+            self.logger.critical("Invalid AgentID")
+
+    def add_listener(self, topic_or_filter, callback, executor=None):
+        """Registers a callback for received messages. Messages handled by a listener are not queued for
+        :meth:`receive`.
+
+        Callbacks run on a bounded thread pool (or on the given executor). Callbacks of a listener for
+        messages sent to the same topic are called one at a time, in the order the messages were received.
+
+        :param topic_or_filter: a topic (which is subscribed to) or an agent, or a message filter as accepted by
+                                :meth:`receive`.
+        :param callback: function called with each matching message.
+        :param executor: :class:`concurrent.futures.Executor` to run the callback on.
+        :returns: listener handle, for :meth:`remove_listener`.
+        """
+
+        if executor is None:
+            if self.listener_pool is None:
+                self.listener_pool = _futures.ThreadPoolExecutor(self.listener_threads, thread_name_prefix="fjage-listener")
+            executor = self.listener_pool
+        listener = _Listener(topic_or_filter, callback, executor)
+        if isinstance(topic_or_filter, AgentID):
+            if topic_or_filter.is_topic:
+                self.subscribers.add(topic_or_filter.name)
+                key = '#' + topic_or_filter.name
+            else:
+                key = topic_or_filter.name
+            self.topic_listeners[key] = self.topic_listeners.get(key, ()) + (listener, )
+        else:
+            self.filter_listeners = self.filter_listeners + [listener]
+        return listener
+
+    def remove_listener(self, listener):
+        """Removes a listener registered with :meth:`add_listener`. Topics subscribed to stay subscribed.
+
+        :param listener: listener handle.
+        :returns: True if the listener was removed, False if it was not registered.
+        """
+
+        if listener in self.filter_listeners:
+            self.filter_listeners = [x for x in self.filter_listeners if x is not listener]
+            return True
+        for key, listeners in list(self.topic_listeners.items()):
+            if listener in listeners:
+                listeners = tuple(x for x in listeners if x is not listener)
+                if listeners:
+                    self.topic_listeners[key] = listeners
+                else:
+                    del self.topic_listeners[key]
+                return True
+        return False
+
+    def _notify_listeners(self, msg):
+        """Hand a received message to the listeners it matches, if any."""
+
+        recipient = msg["data"]["recipient"]
+        listeners = self.topic_listeners.get(recipient, ())
+        if self.filter_listeners:
+            listeners = listeners + tuple(x for x in self.filter_listeners if self._matches(x.filter, msg))
+        if not listeners:
+            return False
+        rsp = self._decode(msg)
+        if rsp is None:
+            return False
+        for listener in listeners:
+            listener.deliver(rsp, recipient)
+        return True
+
+    def agentForService(self, service, timeout=1000):
+        """ Finds an agent that provides a named service. If multiple agents are registered
+            to provide a given service, any of the agents' id may be returned.
+
+        :param service: the named service of interest.
+        :param timeout: timeout in milliseconds.
+        :returns: an agent id for an agent that provides the service.
+        """
+
+        return self._lookup(Action.AGENT_FOR_SERVICE, [service], timeout)[0]
+
+    def agentsForService(self, service, timeout=1000):
+        """Finds all agents that provides a named service.
+
+        :param service: the named service of interest.
+        :param timeout: timeout in milliseconds.
+        :returns: a list of agent ids representing all agent that provide the service.
+        """
+
+        return self._lookup(Action.AGENTS_FOR_SERVICE, [service], timeout)[0]
+
+    def resolveServices(self, services, timeout=1000):
+        """Finds an agent for each of several named services. The lookups not answered from the directory
+        cache are sent to the master back-to-back, and their answers awaited together, so resolving many
+        services takes about one round trip.
+
+        :param services: named services of interest.
+        :param timeout: timeout in milliseconds for all lookups together.
+        :returns: list with an agent id for each service, None for services that no agent provides or
+                  that timed out.
+        """
+
+        return self._lookup(Action.AGENT_FOR_SERVICE, services, timeout)
+
+    def invalidate(self, service=None):
+        """Removes a named service, or all services, from the directory cache.
+
+        :param service: the named service, None for all services.
+        """
+
+        if service is None:
+            self.directory.clear()
+            return
+        name = self._service_name(service)
+        for action in (Action.AGENT_FOR_SERVICE, Action.AGENTS_FOR_SERVICE):
+            self.directory.pop((action, name), None)
+
+    def _lookup(self, action, services, timeout):
+        """Look up services in the directory cache, and ask the master for those missing."""
+
+        keys = [(action, self._service_name(service)) for service in services]
+        rv = [None] * len(keys)
+        missing = OrderedDict()
+        metrics = self.metrics
+        for i, key in enumerate(keys):
+            entry = self.directory.get(key) if self.directory_ttl > 0 else None
+            now = _time.monotonic()
+            if entry is not None and now < entry[1]:
+                metrics.directory_hits += 1
+                if entry[2] is not None and now >= entry[2] and key not in self.refreshing:
+                    self.refreshing.add(key)
+                    _td.Thread(target=self._refresh, args=(key,), name="fjage-directory", daemon=True).start()
+                # lists of agents are copied, so that callers cannot change the cached list
+                rv[i] = list(entry[0]) if isinstance(entry[0], list) else entry[0]
+            else:
+                metrics.directory_misses += 1
+                missing.setdefault(key, list()).append(i)
+        if missing:
+            answers = self._directory_requests([self._service_request(*key) for key in missing], timeout)
+            for (key, indices), rsp in zip(missing.items(), answers):
+                value = self._cache(key, rsp)
+                for i in indices:
+                    rv[i] = list(value) if isinstance(value, list) else value
+        return rv
+
+    def _cache(self, key, rsp):
+        """Cache the answer to a directory request, and return the value answered, None on timeout."""
+
+        if rsp is None:
+            return None
+        value = rsp.get("agentID" if key[0] == Action.AGENT_FOR_SERVICE else "agentIDs")
+        ttl = self.directory_ttl if value else self.negative_ttl
+        if self.directory_ttl > 0 and ttl > 0:
+            now = _time.monotonic()
+            refresh = now + ttl * self.refresh_ahead / 1000 if value and self.refresh_ahead > 0 else None
+            self.directory[key] = (value, now + ttl / 1000, refresh)
+        return value
+
+    def _refresh(self, key):
+        try:
+            rsp = self._directory_requests([self._service_request(key[0], key[1])], self.DEFAULT_TIMEOUT)[0]
+            self._cache(key, rsp)
+            self.metrics.directory_refreshes += 1
+        except ConnectionError:
+            pass
+        finally:
+            self.refreshing.discard(key)
+
+    def _directory_requests(self, reqs, timeout):
+        """Send directory requests back-to-back and wait for all the responses.
+
+        :param reqs: directory requests.
+        :param timeout: timeout in milliseconds for all responses together.
+        :returns: list of responses, with None for requests that timed out or lost their connection.
+        """
 
-    """
+        events = list()
+        for req in reqs:
+            key = _uuid.UUID(req["id"])
+            event = _td.Event()
+            self.pending[key] = (event, None)
+            events.append((key, event))
+        frames = list()
+        for req in reqs:
+            frame = self.codec.dumps(req)
+            self.metrics.count(self.metrics.sent, req["action"], len(frame))
+            frames.append(frame)
+        if not self._write_frames(frames):
+            for key, event in events:
+                self.pending.pop(key, None)
+            raise ConnectionError("Not connected to master")
+        deadline = _time.monotonic() + timeout / 1000
+        rv = list()
+        for key, event in events:
+            event.wait(max(0, deadline - _time.monotonic()))
+            # always removed here, whether answered or not
+            tup = self.pending.pop(key, None)
+            rv.append(tup[1] if tup is not None else None)
+        return rv
 
-    AGENTS = "agents"
-    CONTAINS_AGENT = "containsAgent"
-    SERVICES = "services"
-    AGENT_FOR_SERVICE = "agentForService"
-    AGENTS_FOR_SERVICE = "agentsForService"
-    SEND = "send"
-    SHUTDOWN = "shutdown"
+    def _is_duplicate(self):
+        answer = self._contains_agent(self.name, self.DEFAULT_TIMEOUT)
+        return True if answer is None else answer
 
+    def _ping(self, timeout=DEFAULT_TIMEOUT):
+        """Check that the master answers a directory request.
 
-class Gateway:
-    """ Gateway to communicate with agents from Python. Creates a gateway connecting to a specified master container.
+        :param timeout: timeout in milliseconds.
+        :returns: True if the master answered in time.
+        """
 
-        :param hostname: hostname to connect to.
-        :param port: TCP port to connect to.
-    """
+        return self.connected and self._contains_agent(self.name, timeout) is not None
 
-    DEFAULT_TIMEOUT = 1000
-    NON_BLOCKING = 0
-    BLOCKING = -1
+    def _contains_agent(self, name, timeout):
+        """Ask the master if an agent exists, None on timeout (timeout in milliseconds)."""
 
-    def __init__(self, hostname, port, name=None):
-        """NOTE: Developer must make sure a duplicate name is not assigned to the Gateway."""
+        req = dict()
+        req["action"] = Action.CONTAINS_AGENT
+        req["id"] = str(_uuid.uuid4())
+        req["agentID"] = name
+        try:
+            rsp = self._directory_requests([req], timeout)[0]
+        except ConnectionError:
+            return None
+        if rsp is None:
+            return None
+        return rsp["answer"] if "answer" in rsp else True
+
+
+class GatewayPool:
+    """ A pool of gateways connected to the same master container, for multi-threaded applications. Requests
+        are routed to the least loaded gateway, or a thread may check out a gateway for its exclusive use
+        (for example, to subscribe to a topic and receive notifications)::
+
+            pool = GatewayPool(hostname, port, size=4)
+            rsp = pool.request(req, 1000)
+            with pool.gateway() as gw:
+                gw.subscribe(gw.topic("abc"))
+                ntf = gw.receive(timeout=1000)
+                gw.unsubscribe(gw.topic("abc"))
+
+        The gateways are connected in parallel when the pool is created. A background health check pings each
+        gateway that is not checked out, and replaces gateways that do not answer.
+
+        :param hostname: hostname of the master container, or a ``unix://`` URL.
+        :param port: TCP port of the master container.
+        :param size: number of gateways.
+        :param name: name prefix for the gateways (a number is appended), or None for generated names.
+        :param health_interval: interval between health checks in milliseconds, None to disable them.
+        :param kwargs: other arguments for the :class:`Gateway` constructor.
+    """
 
+    def __init__(self, hostname, port=None, size=4, name=None, health_interval=10000, **kwargs):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
         self.logger = _log.getLogger('org.arl.fjage')
-
+        self.hostname = hostname
+        self.port = port
+        self.name = name
+        self.kwargs = kwargs
+        self.health_interval = health_interval
+        self.cv = _td.Condition()
+        self.free = list()
+        self.checked_out = set()
+        self.closed = False
+        self.checkouts = 0
+        self.checkout_waits = 0
+        self.checkout_wait_time = 0.0
+        self.routed = 0
+        self.health_checks = 0
+        self.replaced = 0
+        t = _time.perf_counter()
+        with _futures.ThreadPoolExecutor(size) as executor:
+            futs = [executor.submit(self._connect, i) for i in range(size)]
+        errors = [fut.exception() for fut in futs if fut.exception() is not None]
+        self.gateways = [fut.result() for fut in futs if fut.exception() is None]
+        self.warmup_time = _time.perf_counter() - t
+        if errors:
+            for gw in self.gateways:
+                self._close_gateway(gw)
+            raise errors[0]
+        self.free = list(self.gateways)
+        self.scheduler = _Scheduler("fjage-pool")
+        if health_interval is not None:
+            self.scheduler.schedule(health_interval / 1000, self._health_check)
+
+    def _connect(self, i):
+        name = None if self.name is None else self.name + "-" + str(i)
+        return Gateway(self.hostname, self.port, name, **self.kwargs)
+
+    def _close_gateway(self, gw):
+        # only close the connection: a shutdown request would shut down the master container
         try:
-            if name == None:
-                self.name = "PythonGW-" + str(_uuid.uuid4())
-            else:
-                try:
-                    self.name = name
-                except Exception as e:
-                    self.self.logger.critical("Exception: Cannot assign name to gateway: " + str(e))
-                    raise
+            gw._disconnect()
+        except Exception as e:
+            self.logger.warning("Exception: Closing pooled gateway - " + str(e))
 
-            self.q = list()
-            self.subscribers = list()
-            self.pending = dict()
-            self.cv = _td.Condition()
+    def _least_loaded(self, gateways):
+        return min(gateways, key=lambda gw: len(gw.pending) + gw.writer.queued - gw.writer.written)
 
-            self.socket = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
-            self.recv_thread = _td.Thread(target=self.__recv_proc, args=(self.q, self.subscribers, ))
-            self.recv_thread.daemon = True
+    def checkout(self, timeout=Gateway.BLOCKING):
+        """Checks out a gateway for the exclusive use of the caller, waiting for one if all are checked out.
+        The least loaded free gateway is chosen. The gateway must be returned with :meth:`checkin`.
 
-            self.logger.info("Connecting to " + str(hostname) + ":" + str(port))
-            self.socket.connect((hostname, port))
-            self.socket_file = self.socket.makefile('r', 65536)
+        :param timeout: timeout in milliseconds, or BLOCKING to wait indefinitely.
+        :returns: a gateway, None on timeout.
+        """
 
-            self.recv_thread.start()
+        t = _time.perf_counter()
+        with self.cv:
+            if not self.free:
+                self.checkout_waits += 1
+                if not self.cv.wait_for(lambda: self.free or self.closed,
+                                        None if timeout == Gateway.BLOCKING else timeout / 1000):
+                    self.checkout_wait_time += _time.perf_counter() - t
+                    return None
+            if self.closed:
+                raise RuntimeError("Gateway pool closed")
+            gw = self._least_loaded(self.free)
+            self.free.remove(gw)
+            self.checked_out.add(gw)
+            self.checkouts += 1
+            self.checkout_wait_time += _time.perf_counter() - t
+        return gw
+
+    def checkin(self, gw):
+        """Returns a checked out gateway to the pool.
+
+        :param gw: gateway returned by :meth:`checkout`.
+        """
 
-            if self._is_duplicate():
-                self.logger.critical("Duplicate Gateway found. Shutting down.")
-                self.socket.close
-                raise Exception('DuplicateGatewayException')
+        with self.cv:
+            self.checked_out.discard(gw)
+            if gw in self.gateways and not self.closed:
+                self.free.append(gw)
+                self.cv.notify()
 
-        except Exception as e:
-            self.logger.critical("Exception: " + str(e))
-            raise
+    def gateway(self, timeout=Gateway.BLOCKING):
+        """Checks out a gateway for use in a ``with`` statement, returning it to the pool at the end.
 
-    def _parse_dispatch(self, rmsg, q):
-        """Parse incoming messages and respond to them or dispatch them."""
+        :param timeout: timeout in milliseconds, or BLOCKING to wait indefinitely.
+        """
 
-        req = _json.loads(rmsg)
-        rsp = dict()
-        if "id" in req:
-            req['id'] = _uuid.UUID(req['id'])
+        pool = self
 
-        if "action" in req:
+        class _Checkout:
+            def __enter__(self):
+                self.gw = pool.checkout(timeout)
+                if self.gw is None:
+                    raise TimeoutError("No gateway available in the pool")
+                return self.gw
 
-            if req["action"] == Action.AGENTS:
-                rsp["inResponseTo"] = req["action"]
-                rsp["id"] = str(req["id"])
-                rsp["agentIDs"] = [self.name]
-                self.socket.sendall((_json.dumps(rsp) + '\n').encode())
-
-            elif req["action"] == Action.CONTAINS_AGENT:
-                rsp["inResponseTo"] = req["action"]
-                rsp["id"] = str(req["id"])
-                answer = False
-                if req["agentID"]:
-                    if req["agentID"] == self.name:
-                        answer = True
-                rsp["answer"] = answer
-                self.socket.sendall((_json.dumps(rsp) + '\n').encode())
-
-            elif req["action"] == Action.SERVICES:
-                rsp["inResponseTo"] = req["action"]
-                rsp["id"] = str(req["id"])
-                rsp["services"] = []
-                self.socket.sendall((_json.dumps(rsp) + '\n').encode())
-
-            elif req["action"] == Action.AGENT_FOR_SERVICE:
-                rsp["inResponseTo"] = req["action"]
-                rsp["id"] = str(req["id"])
-                rsp["agentID"] = ""
-                self.socket.sendall((_json.dumps(rsp) + '\n').encode())
-
-            elif req["action"] == Action.AGENTS_FOR_SERVICE:
-                rsp["inResponseTo"] = req["action"]
-                rsp["id"] = str(req["id"])
-                rsp["agentIDs"] = []
-                self.socket.sendall((_json.dumps(rsp) + '\n').encode())
+            def __exit__(self, *exc):
+                pool.checkin(self.gw)
 
-            elif req["action"] == Action.SEND:
-                try:
-                    msg = req["message"]
-                    if msg["data"]["recipient"] == self.name:
-                        q.append(msg)
-                        self.cv.acquire()
-                        self.cv.notify()
-                        self.cv.release()
-
-                    if self._is_topic(msg["data"]["recipient"]):
-                        if self.subscribers.count(msg["data"]["recipient"].replace("#", "")):
-                            q.append(msg)
-                            self.cv.acquire()
-                            self.cv.notify()
-                            self.cv.release()
-                except Exception as e:
-                    self.logger.critical("Exception: Error adding to queue - " + str(e))
-            elif value == Action.SHUTDOWN:
-                self.logger.debug("ACTION: " + Action.SHUTDOWN)
-                return None
-            else:
-                self.logger.warning("Invalid message, discarding")
+        return _Checkout()
+
+    def _route(self):
+        with self.cv:
+            if self.closed:
+                raise RuntimeError("Gateway pool closed")
+            self.routed += 1
+            return self._least_loaded(self.gateways)
+
+    def send(self, msg, relay=True):
+        """Sends a message through the least loaded gateway. See :meth:`Gateway.send`."""
+
+        return self._route().send(msg, relay)
+
+    def request(self, msg, timeout=1000):
+        """Sends a request through the least loaded gateway and waits for the response. See :meth:`Gateway.request`."""
+
+        return self._route().request(msg, timeout)
+
+    def request_async(self, msg, timeout=1000):
+        """Sends a request through the least loaded gateway, returning a future for the response.
+        See :meth:`Gateway.request_async`."""
+
+        return self._route().request_async(msg, timeout)
+
+    def agentForService(self, service, timeout=1000):
+        """Finds an agent that provides a named service. See :meth:`Gateway.agentForService`."""
+
+        return self._route().agentForService(service, timeout)
+
+    def agentsForService(self, service, timeout=1000):
+        """Finds all agents that provide a named service. See :meth:`Gateway.agentsForService`."""
+
+        return self._route().agentsForService(service, timeout)
+
+    def resolveServices(self, services, timeout=1000):
+        """Finds an agent for each of several named services. See :meth:`Gateway.resolveServices`."""
+
+        return self._route().resolveServices(services, timeout)
+
+    def invalidate(self, service=None):
+        """Removes a named service, or all services, from the directory cache of every gateway.
+        See :meth:`Gateway.invalidate`."""
+
+        with self.cv:
+            gateways = list(self.gateways)
+        for gw in gateways:
+            gw.invalidate(service)
+
+    def _health_check(self):
+        with self.cv:
+            if self.closed:
+                return
+            idle = list(self.free)
+        for gw in idle:
+            self.health_checks += 1
+            if gw._ping():
+                continue
+            self.logger.warning("Pooled gateway " + gw.name + " is not responding, replacing it")
+            try:
+                new = self._connect(self.gateways.index(gw))
+            except Exception as e:
+                self.logger.critical("Exception: Cannot replace pooled gateway - " + str(e))
+                continue
+            with self.cv:
+                replace = not self.closed and gw in self.free
+                if replace:
+                    self.gateways[self.gateways.index(gw)] = new
+                    self.free[self.free.index(gw)] = new
+                    self.replaced += 1
+                    self.cv.notify()
+            self._close_gateway(gw if replace else new)
+        if not self.closed:
+            self.scheduler.schedule(self.health_interval / 1000, self._health_check)
+
+    def stats(self):
+        """Returns pool statistics: gateways free and checked out, checkouts and how many had to wait (with the
+        total wait), requests routed, health checks, gateways replaced, connection warm-up time, and the
+        statistics of each gateway (see :meth:`Gateway.stats`).
+
+        :returns: dict of statistics, suitable for JSON export.
+        """
+
+        with self.cv:
+            gateways = list(self.gateways)
+            rv = {"size": len(gateways), "free": len(self.free), "checked_out": len(self.checked_out),
+                  "checkouts": self.checkouts, "checkout_waits": self.checkout_waits,
+                  "checkout_wait_ms": self.checkout_wait_time * 1000, "routed": self.routed,
+                  "health_checks": self.health_checks, "replaced": self.replaced,
+                  "warmup_ms": self.warmup_time * 1000}
+        rv["gateways"] = [dict(gw.stats(), name=gw.name) for gw in gateways]
+        return rv
+
+    def close(self):
+        """Closes the connections of all gateways in the pool. Unlike :meth:`Gateway.shutdown`, this does not
+        ask the master container to shut down."""
+
+        with self.cv:
+            self.closed = True
+            gateways = list(self.gateways)
+            self.free = list()
+            self.cv.notify_all()
+        for gw in gateways:
+            self._close_gateway(gw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncGateway(_GatewayBase):
+    """ Gateway to communicate with agents from asyncio code. Speaks the same JSON protocol as :class:`Gateway`,
+        but runs on the event loop instead of a receive thread, so any number of requests may be in flight
+        concurrently without a thread per request.
+
+        The gateway is created unconnected; use ``await AsyncGateway.open(hostname, port)`` or
+        ``await gw.connect()`` before use, or use it as an async context manager::
+
+            async with AsyncGateway('localhost', 5081) as gw:
+                shell = await gw.agent_for_service("org.arl.fjage.shell.Services.SHELL")
+
+        :param hostname: hostname to connect to, or ``unix://`` followed by the path of a Unix domain socket.
+        :param port: TCP port to connect to (not used for Unix domain sockets).
+        :param name: name of the gateway agent, generated if not specified.
+        :param codec: JSON codec ('orjson', 'ujson' or 'json'), the fastest one installed if not specified.
+    """
+
+    DEFAULT_TIMEOUT = 1000
+    NON_BLOCKING = 0
+    BLOCKING = -1
+    MAX_LINE = 1 << 30
+
+    def __init__(self, hostname, port=None, name=None, codec=None):
+        """NOTE: Developer must make sure a duplicate name is not assigned to the Gateway."""
+
+        self.logger = _log.getLogger('org.arl.fjage')
+        self.codec = _json_codec(codec)
+        self.name = "PythonGW-" + str(_uuid.uuid4()) if name is None else name
+        self.hostname = hostname
+        self.port = port
+        self.q = _MessageQueue()
+        self.subscribers = set()
+        self.pending = dict()
+        self._replies = dict()
+        self._waiters = list()
+        self._subscriptions = dict()
+        self._reader = None
+        self._writer = None
+        self._recv_task = None
+
+    @classmethod
+    async def open(cls, hostname, port=None, name=None, codec=None):
+        """Creates a gateway and connects it to the master container."""
+
+        gw = cls(hostname, port, name, codec)
+        await gw.connect()
+        return gw
+
+    async def connect(self):
+        """Connects to the master container and checks that the gateway name is not a duplicate."""
+
+        path = _unix_path(self.hostname)
+        if path is None:
+            self.logger.info("Connecting to " + str(self.hostname) + ":" + str(self.port))
+            self._reader, self._writer = await _asyncio.open_connection(self.hostname, self.port, limit=self.MAX_LINE)
         else:
-            if "id" in req:
-                if req['id'] in self.pending:
-                    tup = self.pending[req["id"]]
-                    self.pending[req["id"]] = (tup[0], req)
-                    tup[0].set()
-        return True
+            self.logger.info("Connecting to " + self.hostname)
+            self._reader, self._writer = await _asyncio.open_unix_connection(path, limit=self.MAX_LINE)
+        self._recv_task = _asyncio.ensure_future(self._recv_proc())
+        if await self._is_duplicate():
+            self.logger.critical("Duplicate Gateway found. Shutting down.")
+            await self.close()
+            raise Exception('DuplicateGatewayException')
+
+    async def close(self):
+        """Closes the connection to the master container, without shutting the master down."""
+
+        if self._recv_task is not None:
+            self._recv_task.cancel()
+            self._recv_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._end(lambda fut: fut.set_result(None))
+
+    def _end(self, complete):
+        """Complete everything waiting on the connection: directory requests, requests waiting for replies,
+        receivers and subscriptions.
+
+        :param complete: function completing a future.
+        """
 
-    def __recv_proc(self, q, subscribers):
-        """Receive process."""
+        futs = list(self.pending.values()) + list(self._replies.values()) + [fut for filter, fut in self._waiters]
+        self.pending.clear()
+        self._replies.clear()
+        self._waiters = list()
+        for fut in futs:
+            if not fut.done():
+                complete(fut)
+        for queues in self._subscriptions.values():
+            for q in queues:
+                q.put_nowait(None)
+
+    async def __aenter__(self):
+        if self._writer is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _write(self, j_dict):
+        if self._writer is None:
+            raise ConnectionError("Not connected to master")
+        frame = self.codec.dumps(j_dict)
+        if self.logger.isEnabledFor(_log.DEBUG):
+            self.logger.debug("%s:%s >>> %s", self.hostname, self.port, _Payload(frame))
+        self._writer.write(frame)
+        await self._writer.drain()
+
+    async def _recv_proc(self):
+        """Receive task."""
 
-        parenthesis_count = 0
-        rmsg = ""
-        name = self.socket.getpeername()
         while True:
             try:
-                rmsg = self.socket_file.readline()
-                if not rmsg:
-                    self.logger.critical("Exception: Socket Closed")
-
-                self.logger.debug(str(name[0]) + ":" + str(name[1]) + " <<< " + rmsg)
-                # Parse and dispatch incoming messages
-                self._parse_dispatch(rmsg, q)
-            except:
+                rmsg = await self._reader.readline()
+            except (OSError, ValueError) as e:
+                self.logger.critical("Exception: " + str(e))
+                rmsg = None
+            if not rmsg:
+                self.logger.critical("Exception: Socket Closed")
+                self._recv_task = None
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                self._end(lambda fut: fut.set_exception(ConnectionError("Connection to master lost")))
+                break
+            if self.logger.isEnabledFor(_log.DEBUG):
+                self.logger.debug("%s:%s <<< %s", self.hostname, self.port, _Payload(rmsg))
+            try:
+                self._parse_dispatch(rmsg)
+            except Exception as e:
                 self.logger.critical("Exception: " + str(e))
-                pass
 
-    def __del__(self):
-        try:
-            self.socket.close
-        except Exception as e:
-            self.logger.critical("Exception: " + str(e))
+    def _parse_dispatch(self, rmsg):
+        """Parse incoming messages and respond to them or dispatch them."""
 
-    def shutdown(self):
-        """ Closes the gateway. The gateway functionality may not longer be accessed after this method is called."""
+        header = _peek(rmsg)
+        if header is not None and header[0] == Action.SEND and not self._accepts(header[2]):
+            return
+        req = self.codec.loads(rmsg)
+        if "action" in req:
+            rsp = self._directory_response(req)
+            if rsp is not None:
+                _asyncio.ensure_future(self._write(rsp))
+            elif req["action"] == Action.SEND:
+                msg = req["message"]
+                if self._is_for_me(msg):
+                    self._dispatch(msg)
+            elif req["action"] == Action.SHUTDOWN:
+                self.logger.debug("ACTION: " + Action.SHUTDOWN)
+            else:
+                self.logger.warning("Invalid message, discarding")
+        elif "id" in req:
+            fut = self.pending.pop(req["id"], None)
+            if fut is not None and not fut.done():
+                fut.set_result(req)
+
+    def _dispatch(self, msg):
+        """Hand a received message to a waiting request, a waiting receiver, a subscription or the queue, in
+        that order."""
+
+        inReplyTo = msg["data"].get("inReplyTo")
+        if inReplyTo is not None:
+            fut = self._replies.pop(inReplyTo, None)
+            if fut is not None and not fut.done():
+                fut.set_result(msg)
+                return
+        for i, (filter, fut) in enumerate(self._waiters):
+            if fut.done():
+                continue
+            if self._matches(filter, msg):
+                del self._waiters[i]
+                fut.set_result(msg)
+                return
+        recipient = msg["data"]["recipient"]
+        queues = self._subscriptions.get(recipient[1:]) if self._is_topic(recipient) else None
+        if queues:
+            for q in queues:
+                q.put_nowait(msg)
+            return
+        self.q.append(msg)
 
-        j_dict = dict()
-        j_dict["action"] = Action.SHUTDOWN
-        self.socket.sendall((_json.dumps(j_dict) + '\n').encode())
+    def _retrieveFromQueue(self, filter):
+        return self.q.pop(filter, self._matches)
 
-    def send(self, msg, relay=True):
+    def _seconds(self, timeout):
+        """Timeout in seconds for :func:`asyncio.wait_for`, None to wait indefinitely."""
+
+        return None if timeout == self.BLOCKING else max(timeout, 0) / 1000
+
+    async def send(self, msg, relay=True):
         """Sends a message to the recipient indicated in the message. The recipient may be an agent or a topic."""
 
         if not msg.recipient:
             return False
-        j_dict = dict()
-        m_dict = OrderedDict()
-        d_dict = dict()
-        j_dict["action"] = Action.SEND
-        j_dict["relay"] = relay
-        msg.sender = self.name
-        d_dict = self._to_json(msg)
-        module_ = msg.__module__
-        m_dict["clazz"] = module_.split('.')[-1].replace("_", ".") + "." + msg.__class__.__name__
-        m_dict["data"] = d_dict
-        j_dict["message"] = m_dict
-        if msg.__class__.__name__ == GenericMessage().__class__.__name__:
-            j_dict["map"] = msg.map
-        json_str = _json.dumps(j_dict)
-        name = self.socket.getpeername()
-        self.logger.debug(str(name[0]) + ":" + str(name[1]) + " >>> " + json_str)
-        self.socket.sendall((json_str + '\n').encode())
+        await self._write(self._send_request(msg, relay))
         return True
 
-    def _retrieveFromQueue(self, filter):
-        rmsg = None
-        try:
-            if filter == None and len(self.q):
-                rmsg = self.q.pop()
-            # If filter is a Message, look for a Message in the
-            # receive Queue which was inReplyto that message.
-            elif isinstance(filter, Message):
-                if filter.msgID:
-                    for i in self.q:
-                        if "inReplyTo" in i["data"] and filter.msgID == i["data"]["inReplyTo"]:
-                            try:
-                                rmsg = self.q.pop(self.q.index(i))
-                            except Exception as e:
-                                self.logger.critical("Error: Getting item from list - " + str(e))
-            # If filter is a class, look for a Message of that class.
-            elif type(filter) == type(Message):
-                for i in self.q:
-                    if i["clazz"].split(".")[-1] == filter.__name__:
-                        try:
-                            rmsg = self.q.pop(self.q.index(i))
-                        except Exception as e:
-                            self.logger.critical("Error: Getting item from list - " + str(e))
-            # If filter is a lambda, look for a Message that on which the
-            # lambda returns True.
-            elif isinstance(filter, type(lambda: 0)):
-                for i in self.q:
-                    if filter(i):
-                        try:
-                            rmsg = self.q.pop(self.q.index(i))
-                        except Exception as e:
-                            self.logger.critical("Error: Getting item from list - " + str(e))
-        except Exception as e:
-            self.logger.critical("Error: Queue empty/timeout - " + str(e))
-        return rmsg
-
-    def receive(self, filter=None, timeout=0):
+    async def receive(self, filter=None, timeout=0):
         """
-        Returns a message received by the gateway and matching the given filter. This method blocks until timeout if no message available.
+        Returns a message received by the gateway and matching the given filter. This coroutine waits until
+        timeout if no message available.
 
         :param filter: message filter.
         :param timeout: timeout in milliseconds.
-        :returns: received message matching the filter, null on timeout.
+        :returns: received message matching the filter, None on timeout or if the gateway is closed.
+        :raises ConnectionError: if the connection to the master is lost while waiting.
         """
 
         rmsg = self._retrieveFromQueue(filter)
-        if (rmsg == None and timeout != self.NON_BLOCKING):
-            deadline = current_time_millis() + timeout
-            while (rmsg == None and (timeout == self.BLOCKING or current_time_millis() < deadline)):
-                if timeout == self.BLOCKING:
-                    self.cv.acquire()
-                    self.cv.wait()
-                    self.cv.release()
-                elif timeout > 0:
-                    self.cv.acquire()
-                    t = deadline - current_time_millis()
-                    self.cv.wait(t / 1000)
-                    self.cv.release()
-                rmsg = self._retrieveFromQueue(filter)
+        if rmsg is None and timeout != self.NON_BLOCKING and self._writer is not None:
+            fut = _asyncio.get_running_loop().create_future()
+            waiter = (filter, fut)
+            self._waiters.append(waiter)
+            try:
+                rmsg = await _asyncio.wait_for(fut, self._seconds(timeout))
+            except _asyncio.TimeoutError:
+                rmsg = None
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
         if not rmsg:
             return None
-        try:
-            rsp = self._from_json(rmsg)
-            found_map = False
-            # add map if it is a Generic message
-            if rsp.__class__.__name__ == GenericMessage().__class__.__name__:
-                if "map" in rmsg["data"]:
-                    map = _json.loads(str(rmsg["data"]["map"]))
-                    rsp.__dict__.update(map)
-                    found_map = True
-                if not found_map:
-                    self.logger.warning("No map field found in Generic Message")
-        except Exception as e:
-            self.logger.critical("Exception: Class loading failed - " + str(e))
-            return None
-        return rsp
+        return self._decode(rmsg)
 
-    def request(self, msg, timeout=1000):
-        """Sends a request and waits for a response. This method blocks until timeout if no response is received.
+    async def request(self, msg, timeout=1000):
+        """Sends a request and waits for a response. This coroutine waits until timeout if no response is received.
 
         :param msg: message to send.
         :param timeout: timeout in milliseconds.
-        :returns: received response message, null on timeout.
+        :returns: received response message, None on timeout.
+        :raises ConnectionError: if not connected, or the connection to the master is lost before the response
+                                 arrives.
         """
 
-        self.send(msg)
-        return self.receive(msg, timeout)
-
-    def topic(self, topic):
-        """Returns an object representing the named topic.
+        if not msg.recipient:
+            return None
+        fut = _asyncio.get_running_loop().create_future()
+        self._replies[msg.msgID] = fut
+        try:
+            await self.send(msg)
+            rmsg = await _asyncio.wait_for(fut, self._seconds(timeout))
+        except _asyncio.TimeoutError:
+            return None
+        finally:
+            if self._replies.get(msg.msgID) is fut:
+                del self._replies[msg.msgID]
+        return self._decode(rmsg)
 
-        :param topic: name of the topic.
-        :returns: object representing the topic.
-        """
+    def subscribe(self, topic):
+        """Subscribes the gateway to receive all messages sent to the given topic. The returned subscription
+        is an async iterator over messages on the topic::
 
-        if isinstance(topic, str):
-            return AgentID(topic, True)
-        elif isinstance(topic, AgentID):
-            if topic.is_topic:
-                return topic
-            return AgentID(topic.name + "__ntf", True)
-        else:
-            return AgentID(topic.__class__.__name__ + "." + str(topic), True)
+            async for ntf in gw.subscribe(gw.topic(node)):
+                print(ntf)
 
-    def subscribe(self, topic):
-        """Subscribes the gateway to receive all messages sent to the given topic.
+        Messages on topics subscribed to, but not iterated over, are available through :meth:`receive`.
 
         :param topic: the topic to subscribe to.
+        :returns: subscription to the topic.
         """
 
-        if isinstance(topic, AgentID):
-            if topic.is_topic == False:
-                new_topic = AgentID(topic.name + "__ntf", True)
-            else:
-                new_topic = topic
-
-            if len(self.subscribers) == 0:
-                self.subscribers.append(new_topic.name)
-            else:
-                if new_topic.name in self.subscribers:
-                    self.logger.critical("Error: Already subscribed to topic")
-                    return
-                self.subscribers.append(new_topic.name)
-        else:
+        if not isinstance(topic, AgentID):
             self.logger.critical("Invalid AgentID")
+            return None
+        topic = self.topic(topic)
+        self.subscribers.add(topic.name)
+        return _Subscription(self, topic.name)
 
     def unsubscribe(self, topic):
-        """Unsubscribes the gateway from a given topic.
+        """Unsubscribes the gateway from a given topic, and ends all subscriptions to it.
 
         :param topic: the topic to unsubscribe.
-
         """
 
-        if isinstance(topic, AgentID):
-            if topic.is_topic == False:
-                new_topic = AgentID(topic.name + "__ntf", True)
-            if len(self.subscribers) == 0:
-                return False
-            try:
-                self.subscribers.remove(topic.name)
-            except:
-                self.logger.critical("Exception: No such topic subscribed: " + new_topic.name)
-            return True
-        else:
+        if not isinstance(topic, AgentID):
             self.logger.critical("Invalid AgentID")
+            return False
+        topic = self.topic(topic)
+        if topic.name not in self.subscribers:
+            return False
+        self.subscribers.remove(topic.name)
+        for q in self._subscriptions.pop(topic.name, []):
+            q.put_nowait(None)
+        return True
 
-    def agentForService(self, service, timeout=1000):
+    async def _directory_request(self, j_dict, timeout):
+        fut = _asyncio.get_running_loop().create_future()
+        self.pending[j_dict["id"]] = fut
+        try:
+            await self._write(j_dict)
+            return await _asyncio.wait_for(fut, self._seconds(timeout))
+        except _asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(j_dict["id"], None)
+
+    async def agent_for_service(self, service, timeout=1000):
         """ Finds an agent that provides a named service. If multiple agents are registered
             to provide a given service, any of the agents' id may be returned.
 
         :param service: the named service of interest.
+        :param timeout: timeout in milliseconds.
         :returns: an agent id for an agent that provides the service.
         """
 
-        req_id = _uuid.uuid4()
-        j_dict = dict()
-        j_dict["action"] = Action.AGENT_FOR_SERVICE
-        j_dict["id"] = str(req_id)
-        if isinstance(service, str):
-            j_dict["service"] = service
-        else:
-            j_dict["service"] = service.__class__.__name__ + "." + str(service)
-        self.socket.sendall((_json.dumps(j_dict) + '\n').encode())
-        res_event = _td.Event()
-        self.pending[req_id] = (res_event, None)
-        ret = res_event.wait(timeout)
-        if not ret:
-            return None
-        else:
-            tup = self.pending.pop(req_id)
-            return tup[1]["agentID"] if "agentID" in tup[1] else None
+        rsp = await self._directory_request(self._service_request(Action.AGENT_FOR_SERVICE, service), timeout)
+        return rsp.get("agentID") if rsp else None
 
-    def agentsForService(self, service, timeout=1000):
+    async def agents_for_service(self, service, timeout=1000):
         """Finds all agents that provides a named service.
 
         :param service: the named service of interest.
+        :param timeout: timeout in milliseconds.
         :returns: a list of agent ids representing all agent that provide the service.
         """
 
-        req_id = _uuid.uuid4()
-        j_dict = dict()
-        j_dict["action"] = Action.AGENTS_FOR_SERVICE
-        j_dict["id"] = str(req_id)
-        if isinstance(service, str):
-            j_dict["service"] = service
-        else:
-            j_dict["service"] = service.__class__.__name__ + "." + str(service)
-        self.socket.sendall((_json.dumps(j_dict) + '\n').encode())
-        res_event = _td.Event()
-        self.pending[req_id] = (res_event, None)
-        ret = res_event.wait(timeout)
-        if not ret:
-            return None
-        else:
-            tup = self.pending.pop(req_id)
-            return tup[1]["agentIDs"] if "agentIDs" in tup[1] else None
-
-    def getAgentID(self):
-        """ Returns the gateway Agent ID."""
-        return self.name
-
-    def _to_json(self, inst):
-        """Convert the object attributes to a dict."""
-
-        dt = inst.__dict__.copy()
-        for key in list(dt):
-            if dt[key] == None:
-                dt.pop(key)
-            elif list(key)[-1] == '_':
-                dt[key[:-1]] = dt.pop(key)
-            if key == 'map':
-                dt.pop(key)
-        return dt
+        rsp = await self._directory_request(self._service_request(Action.AGENTS_FOR_SERVICE, service), timeout)
+        return rsp.get("agentIDs") if rsp else None
 
-    def _from_json(self, dt):
-        """If possible, do class loading, else return the dict."""
+    async def shutdown(self):
+        """ Shuts down the master container. The gateway functionality may not longer be accessed after this
+        method is called."""
 
-        if 'clazz' in dt:
-            class_name = dt['clazz'].split(".")[-1]
-            module_name = dt['clazz'].split(".")
-            module_name.remove(module_name[-1])
-            if "fjage" in module_name:
-                module_name = "fjagepy." + "_".join(module_name)
-            else:
-                module_name = "unetpy." + "_".join(module_name)
-            try:
-                module = __import__(module_name)
-            except Exception as e:
-                self.logger.critical("Exception in from_json, module: " + str(e))
-                return dt
-            try:
-                class_ = getattr(module, class_name)
-            except Exception as e:
-                self.logger.critical("Exception in from_json, class: " + str(e))
-                return dt
-            args = dict()
-            for key, value in dt["data"].items():
-                args[key] = value
-            if 'signal' in args.keys():
-                type_ = args['signal']['clazz']
-                x_ = base64.standard_b64decode(args['signal']['data'])
-                count = len(x_) // 4
-                if 'F' in type_:
-                    x_ = struct.unpack('<{0}f'.format(count), x_)
-                elif 'I' in type_:
-                    x_ = struct.unpack('<{0}i'.format(count), x_)
-                elif 'D' in type_:
-                    x_ = struct.unpack('<{0}d'.format(count), x_)
-                elif 'J' in type_:
-                    x_ = struct.unpack('<{0}l'.format(count), x_)
-                args["signal"]["data"] = list(x_)
-                del args["signal"]["clazz"]
-                args["signal"] = args["signal"]["data"]
-            inst = class_(**args)
-        else:
-            inst = dt
-        return inst
+        await self._write({"action": Action.SHUTDOWN})
+        await self.close()
 
-    def _is_duplicate(self):
-        req_id = _uuid.uuid4()
+    async def _is_duplicate(self):
         req = dict()
         req["action"] = Action.CONTAINS_AGENT
-        req["id"] = str(req_id)
+        req["id"] = str(_uuid.uuid4())
         req["agentID"] = self.name
-        self.socket.sendall((_json.dumps(req) + '\n').encode())
-        res_event = _td.Event()
-        self.pending[req_id] = (res_event, None)
-        ret = res_event.wait(self.DEFAULT_TIMEOUT)
-        if not ret:
+        rsp = await self._directory_request(req, self.DEFAULT_TIMEOUT)
+        if rsp is None:
             return True
-        else:
-            tup = self.pending.pop(req_id)
-            return tup[1]["answer"] if "answer" in tup[1] else True
+        return rsp["answer"] if "answer" in rsp else True
 
-    def _is_topic(self, recipient):
-        if recipient[0] == "#":
-            return True
-        return False
+
+class _Subscription:
+    """Async iterator over messages received on a subscribed topic."""
+
+    def __init__(self, gw, topic):
+        self.gw = gw
+        self.topic = topic
+        self.q = _asyncio.Queue()
+        gw._subscriptions.setdefault(topic, []).append(self.q)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        rmsg = await self.q.get()
+        if rmsg is None:
+            raise StopAsyncIteration
+        return self.gw._decode(rmsg)
+
+    def close(self):
+        """Stops iterating over the topic. The gateway remains subscribed to the topic."""
+
+        queues = self.gw._subscriptions.get(self.topic, [])
+        if self.q in queues:
+            queues.remove(self.q)
+            self.q.put_nowait(None)
@@ -16,11 +16,11 @@ setup(
     author_email='prasad@subnero.com',
     url='https://github.com/org-arl/fjage/tree/dev/src/main/python',
     license='BSD (3-clause)',
-    python_requires='>=3',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 4 - Beta',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
 )
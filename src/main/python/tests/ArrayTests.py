@@ -0,0 +1,88 @@
+import base64
+import struct
+import unittest
+import unittest.mock
+from fjagepy import *
+import array
+from fjagepy.org_arl_fjage_remote import _decode_arrays
+from fjagepy.org_arl_fjage_remote import _encode_arrays
+from fjagepy.org_arl_fjage_remote import PrimitiveArray
+
+
+def b64(fmt, *values):
+    return base64.b64encode(struct.pack(fmt, *values)).decode()
+
+
+class ArrayTestCase(unittest.TestCase):
+
+    def test_decode_types(self):
+        self.assertEqual(list(_decode_arrays({"clazz": "[B", "data": b64('<2b', -1, 7)})), [-1, 7])
+        self.assertEqual(list(_decode_arrays({"clazz": "[S", "data": b64('<2h', -300, 7)})), [-300, 7])
+        self.assertEqual(list(_decode_arrays({"clazz": "[I", "data": b64('<2i', -70000, 7)})), [-70000, 7])
+        self.assertEqual(list(_decode_arrays({"clazz": "[J", "data": b64('<2q', -2**40, 7)})), [-2**40, 7])
+        self.assertEqual(list(_decode_arrays({"clazz": "[F", "data": b64('<2f', 1.5, -2)})), [1.5, -2])
+        self.assertEqual(list(_decode_arrays({"clazz": "[D", "data": b64('<2d', 1.5, -2)})), [1.5, -2])
+
+    def test_decode_nested(self):
+        data = {
+            "signal": {"clazz": "[F", "data": b64('<3f', 1, 2, 3)},
+            "map": {"x": {"clazz": "[D", "data": b64('<1d', 4)}},
+            "list": [{"clazz": "[I", "data": b64('<1i', 5)}],
+            "other": {"clazz": "org.arl.fjage.Message", "data": "abc"}
+        }
+        data = _decode_arrays(data)
+        self.assertEqual(list(data["signal"]), [1, 2, 3])
+        self.assertEqual(list(data["map"]["x"]), [4])
+        self.assertEqual(list(data["list"][0]), [5])
+        self.assertEqual(data["other"], {"clazz": "org.arl.fjage.Message", "data": "abc"})
+
+    def test_from_json(self):
+        g = org_arl_fjage_remote._GatewayBase()
+        msg = g._from_json({"clazz": "org.arl.fjage.GenericMessage", "data": {"msgID": "1", "signal": {"clazz": "[D", "data": b64('<2d', 1, 2)}}})
+        self.assertIsInstance(msg, org_arl_fjage.GenericMessage)
+        self.assertEqual(list(msg.signal), [1, 2])
+
+    def test_encode_types(self):
+        self.assertEqual(_encode_arrays(b'\x00\xff'), {"clazz": "[B", "data": "AP8="})
+        self.assertEqual(_encode_arrays(array.array('h', [-300, 7])), {"clazz": "[S", "data": b64('<2h', -300, 7)})
+        self.assertEqual(_encode_arrays(array.array('d', [1.5, -2])), {"clazz": "[D", "data": b64('<2d', 1.5, -2)})
+        self.assertEqual(_encode_arrays(PrimitiveArray([1, 2], 'F')), {"clazz": "[F", "data": b64('<2f', 1, 2)})
+        self.assertEqual(_encode_arrays(PrimitiveArray([1, 2], '[J')), {"clazz": "[J", "data": b64('<2q', 1, 2)})
+        self.assertEqual(_encode_arrays([1, 2]), [1, 2])
+
+    def test_encode_roundtrip(self):
+        data = {"signal": PrimitiveArray([1, 2, 3], 'I'), "map": {"x": array.array('f', [4])}, "n": 1}
+        rv = _decode_arrays(_encode_arrays(data))
+        self.assertEqual(list(rv["signal"]), [1, 2, 3])
+        self.assertEqual(list(rv["map"]["x"]), [4])
+        self.assertIsInstance(data["map"]["x"], array.array)
+
+    def test_fallback(self):
+        # without NumPy, arrays are encoded from and decoded to array.array
+        data = {"f": array.array('f', [1.5, -2]), "d": array.array('d', [0.1, 1e300]),
+                "c": PrimitiveArray([1+2j, 2-0.5j], 'F'), "z": PrimitiveArray([complex(1e-300, 3)], 'D')}
+        with unittest.mock.patch.multiple('fjagepy.org_arl_fjage_remote', _np=None, _np_checked=True):
+            dt = _encode_arrays(data)
+            rv = _decode_arrays(dict(dt))
+            raw = _encode_arrays(data["c"], binary=True)
+            c = _decode_arrays({"clazz": raw["clazz"], "data": bytes(raw["data"])})
+        self.assertEqual(dt["c"], {"clazz": "[F", "data": b64('<4f', 1, 2, 2, -0.5)})
+        self.assertEqual(dt["c"], _encode_arrays(data["c"]))
+        for key, typecode in (("f", 'f'), ("d", 'd'), ("c", 'f'), ("z", 'd')):
+            self.assertIsInstance(rv[key], array.array)
+            self.assertEqual(rv[key].typecode, typecode)
+        self.assertEqual(list(rv["f"]), [1.5, -2])
+        self.assertEqual(list(rv["d"]), [0.1, 1e300])
+        self.assertEqual([complex(*rv["c"][i:i+2]) for i in range(0, len(rv["c"]), 2)], [1+2j, 2-0.5j])
+        self.assertEqual(complex(*rv["z"]), complex(1e-300, 3))
+        self.assertEqual(c, rv["c"])
+
+    def test_to_json(self):
+        msg = org_arl_fjage.GenericMessage(signal=array.array('f', [1, 2]), fc=None)
+        dt = org_arl_fjage_remote._GatewayBase()._to_json(msg)
+        self.assertEqual(dt["signal"], {"clazz": "[F", "data": b64('<2f', 1, 2)})
+        self.assertNotIn("fc", dt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,710 @@
+import os
+import json
+import time
+import logging.handlers
+import socket
+import asyncio
+import tempfile
+import unittest
+import threading
+import benchmarks.fakemaster
+from fjagepy import *
+from benchmarks.fakemaster import FakeMaster, SHELL, message
+
+
+class GatewayTestCase(unittest.TestCase):
+
+    # gateways connected to the shared master are closed with _disconnect(), as shutdown() shuts the master down
+
+    @classmethod
+    def setUpClass(cls):
+        cls.master = FakeMaster()
+        cls.g = org_arl_fjage_remote.Gateway(cls.master.host, cls.master.port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.g.shutdown()
+        cls.master.close()
+
+    def test_agentForService(self):
+        self.assertEqual(self.g.agentForService(SHELL), "shell")
+        self.assertEqual(self.g.agentsForService(SHELL), ["shell"])
+
+    def test_request(self):
+        req = org_arl_fjage.Message(recipient='echo', perf=org_arl_fjage.Performative.REQUEST)
+        rsp = self.g.request(req, 1000)
+        self.assertEqual(rsp.perf, org_arl_fjage.Performative.AGREE)
+        self.assertEqual(rsp.inReplyTo, req.msgID)
+
+    def test_request_long_reply(self):
+        for n in (300, 400, 1000):
+            req = org_arl_fjage.Message(recipient='echo', perf=org_arl_fjage.Performative.REQUEST)
+            req.text = "x" * n
+            rsp = self.g.request(req, 1000)
+            self.assertIsNotNone(rsp, n)
+            self.assertEqual((rsp.inReplyTo, rsp.text), (req.msgID, req.text))
+        self.assertEqual(len(self.g.q), 0)
+
+    def test_request_many(self):
+        reqs = [org_arl_fjage.Message(recipient='echo') for i in range(3)]
+        self.assertEqual([rsp.inReplyTo for rsp in self.g.request_many(reqs, 1000)], [req.msgID for req in reqs])
+        # a request without a recipient is not sent, and does not affect the others
+        reqs = [org_arl_fjage.Message(recipient='echo'), org_arl_fjage.Message(),
+                org_arl_fjage.Message(recipient='echo')]
+        rsps = self.g.request_many(reqs, 1000)
+        self.assertEqual(rsps[0].inReplyTo, reqs[0].msgID)
+        self.assertIsNone(rsps[1])
+        self.assertEqual(rsps[2].inReplyTo, reqs[2].msgID)
+        # requests nobody answers time out, while the others are answered
+        reqs = [org_arl_fjage.Message(recipient='sink'), org_arl_fjage.Message(recipient='echo')]
+        rsps = self.g.request_many(reqs, 200)
+        self.assertIsNone(rsps[0])
+        self.assertEqual(rsps[1].inReplyTo, reqs[1].msgID)
+        self.assertEqual(len(self.g.pending), 0)
+
+    def test_request_async(self):
+        reqs = [org_arl_fjage.Message(recipient='echo') for i in range(20)]
+        futs = [self.g.request_async(req, 1000) for req in reqs]
+        self.assertEqual([fut.result(5).inReplyTo for fut in futs], [req.msgID for req in reqs])
+        # requests nobody answers complete with None once they time out
+        n = self.g.stats()["timeouts"]
+        fut = self.g.request_async(org_arl_fjage.Message(recipient='sink'), 100)
+        self.assertIsNone(fut.result(5))
+        self.assertEqual(self.g.stats()["timeouts"], n + 1)
+        fut = self.g.request_async(org_arl_fjage.Message(), 1000)
+        self.assertTrue(fut.done())
+        self.assertIsNone(fut.result())
+        self.assertEqual(len(self.g.pending), 0)
+
+    def test_request_async_closed(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        try:
+            # a blocking request waits until the connection goes away
+            fut = g.request_async(org_arl_fjage.Message(recipient='sink'), g.BLOCKING)
+            time.sleep(0.2)
+            self.assertFalse(fut.done())
+        finally:
+            g._disconnect()
+        with self.assertRaises(ConnectionError):
+            fut.result(5)
+        with self.assertRaises(ConnectionError):
+            g.request_async(org_arl_fjage.Message(recipient='echo'), 1000).result(5)
+        self.assertEqual(len(g.pending), 0)
+
+    def test_stats(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        try:
+            g.stats(reset=True)
+            for i in range(3):
+                self.assertIsNotNone(g.request(org_arl_fjage.Message(recipient='echo'), 1000))
+            topic = g.topic("stats")
+            g.subscribe(topic)
+            self.master.publish("stats", message("org.arl.fjage.GenericMessage", None, "x"), 2)
+            self.master.publish("other", message("org.arl.fjage.GenericMessage", None, "x"))
+            for i in range(2):
+                self.assertIsNotNone(g.receive(topic, 1000))
+            for i in range(50):
+                if g.stats()["unmatched"]:
+                    break
+                time.sleep(0.01)
+            stats = g.stats(reset=True)
+            json.dumps(stats)
+            self.assertEqual(stats["sent"]["send"]["msgs"], 3)
+            self.assertEqual(stats["sent_by_class"]["org.arl.fjage.Message"]["msgs"], 3)
+            self.assertEqual(stats["received"]["send"]["msgs"], 6)
+            self.assertGreater(stats["received"]["send"]["bytes"], 0)
+            self.assertEqual(stats["received_by_class"]["org.arl.fjage.GenericMessage"]["msgs"], 3)
+            self.assertEqual(stats["rtt"]["count"], 3)
+            self.assertEqual(sum(stats["rtt"]["counts"]), 3)
+            self.assertEqual(stats["unmatched"], 1)
+            self.assertEqual((stats["queue"]["depth"], stats["queue"]["peak"] >= 1, stats["pending"]), (0, True, 0))
+            self.assertEqual(stats["decode"]["count"], 5)
+            # counters start again from zero after a reset
+            stats = g.stats()
+            self.assertEqual((stats["sent"], stats["rtt"]["count"], stats["unmatched"]), ({}, 0, 0))
+            self.assertEqual(stats["queue"]["peak"], 0)
+        finally:
+            g._disconnect()
+
+    def test_request_many_closed(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        g._disconnect()
+        with self.assertRaises(ConnectionError):
+            g.request_many([org_arl_fjage.Message(recipient='echo'), org_arl_fjage.Message()])
+        self.assertEqual(len(g.pending), 0)
+
+    def test_send_failed(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        try:
+            self.assertTrue(g.send(org_arl_fjage.Message(recipient='sink')))
+            # a write fails before the receive thread finds the connection lost
+            g.writer.failed = True
+            self.assertFalse(g.send(org_arl_fjage.Message(recipient='sink')))
+            self.assertFalse(g.send_many([org_arl_fjage.Message(recipient='sink') for i in range(2)]))
+            with self.assertRaises(ConnectionError):
+                g.request(org_arl_fjage.Message(recipient='echo'), 1000)
+            self.assertEqual(len(g.pending), 0)
+        finally:
+            g._disconnect()
+
+    def test_send_many(self):
+        n = self.master.sunk
+        self.assertTrue(self.g.send_many([org_arl_fjage.Message(recipient='sink') for i in range(100)]))
+        self.assertTrue(self.master.wait_sunk(n + 100, 5))
+
+    def test_topic(self):
+        topic = self.g.topic("abc")
+        self.g.subscribe(topic)
+        self.master.publish("xyz", message("org.arl.fjage.Message", None, "x"), 10)
+        self.master.publish("abc", message("org.arl.fjage.GenericMessage", None, "x", map={"n": 1}))
+        msg = self.g.receive(topic, 1000)
+        self.assertIsInstance(msg, org_arl_fjage.GenericMessage)
+        self.assertEqual(msg.n, 1)
+        self.g.unsubscribe(topic)
+        self.assertIsNone(self.g.receive(None, 100))
+
+    def test_stream(self):
+        topic = self.g.topic("bulk")
+        self.g.subscribe(topic)
+        self.master.publish("bulk", message("org.arl.fjage.Message", None, "y"), 5)
+        for i in range(10):
+            self.master.publish("bulk", message("org.arl.fjage.Message", None, "x", seq=i))
+        # everything before the marker has been queued once it is received
+        self.master.publish("bulk", message("org.arl.fjage.Message", None, "z"))
+        self.assertIsNotNone(self.g.receive(lambda m: m["data"]["sender"] == "z", 1000))
+        self.assertEqual(len(self.g.receive_many(lambda m: m["data"]["sender"] == "y", 10, 1000)), 5)
+        msgs = self.g.receive_many(topic, 4, 1000)
+        self.assertEqual([m.seq for m in msgs], [0, 1, 2, 3])
+        self.assertEqual([m.seq for m in self.g.stream(topic, max_batch=4, timeout=500)], list(range(4, 10)))
+        self.assertEqual(self.g.receive_many(topic, 4, 100), [])
+        self.g.unsubscribe(topic)
+
+    def test_waiters(self):
+        topics = [self.g.topic("wait%d" % i) for i in range(4)]
+        for topic in topics:
+            self.g.subscribe(topic)
+        got = dict()
+
+        def receive(i):
+            t0 = time.monotonic()
+            msg = self.g.receive(topics[i], 2000)
+            got[i] = (msg, time.monotonic() - t0)
+
+        threads = [threading.Thread(target=receive, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for i in range(50):
+            if self.g.stats()["queue"]["waiting"] == 4:
+                break
+            time.sleep(0.01)
+        # the last receiver to block is woken, and only it
+        self.master.publish("wait3", message("org.arl.fjage.Message", None, "x"))
+        threads[3].join(2)
+        self.assertIsNotNone(got[3][0])
+        self.assertLess(got[3][1], 1)
+        self.assertEqual(self.g.stats()["queue"]["waiting"], 3)
+        for i in range(3):
+            self.master.publish("wait%d" % i, message("org.arl.fjage.Message", None, "x"))
+        for t in threads:
+            t.join(2)
+        self.assertTrue(all(got[i][0] is not None for i in range(4)))
+        for topic in topics:
+            self.g.unsubscribe(topic)
+
+    def test_listener_order(self):
+        topic = self.g.topic("lane")
+        got = list()
+        done = threading.Event()
+
+        def callback(msg):
+            # later messages would overtake this one if callbacks ran concurrently
+            time.sleep(0.001 * (msg.seq % 3))
+            got.append(msg.seq)
+            if len(got) == 50:
+                done.set()
+
+        listener = self.g.add_listener(topic, callback)
+        try:
+            for i in range(50):
+                self.master.publish("lane", message("org.arl.fjage.Message", None, "x", seq=i))
+            self.assertTrue(done.wait(5))
+            self.assertEqual(got, list(range(50)))
+            time.sleep(0.05)
+            self.assertEqual(listener.lanes, {})
+        finally:
+            self.g.remove_listener(listener)
+            self.g.unsubscribe(topic)
+
+    def test_listener_lanes(self):
+        a = self.g.topic("lane-a")
+        b = self.g.topic("lane-b")
+        b_called = threading.Event()
+        a_saw_b = list()
+
+        def callback(msg):
+            if msg.recipient == "#lane-a":
+                # blocks its own lane, but not the other
+                a_saw_b.append(b_called.wait(5))
+            else:
+                b_called.set()
+
+        listeners = [self.g.add_listener(a, callback), self.g.add_listener(b, callback)]
+        try:
+            self.master.publish("lane-a", message("org.arl.fjage.Message", None, "x"))
+            time.sleep(0.05)
+            self.master.publish("lane-b", message("org.arl.fjage.Message", None, "x"))
+            self.assertTrue(b_called.wait(5))
+            for i in range(50):
+                if a_saw_b:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(a_saw_b, [True])
+        finally:
+            for listener in listeners:
+                self.g.remove_listener(listener)
+            self.g.unsubscribe(a)
+            self.g.unsubscribe(b)
+
+    def test_listener_shutdown(self):
+        threads = list()
+        called = threading.Event()
+
+        def callback(msg):
+            threads.append(threading.current_thread())
+            called.set()
+
+        with FakeMaster() as master:
+            g = org_arl_fjage_remote.Gateway(master.host, master.port)
+            g.add_listener(g.topic("abc"), callback)
+            master.publish("abc", message("org.arl.fjage.Message", None, "x"))
+            self.assertTrue(called.wait(5))
+            g.shutdown()
+            self.assertIsNone(g.listener_pool)
+            for t in threads:
+                t.join(5)
+                self.assertFalse(t.is_alive())
+
+    def test_listener_close_busy(self):
+        busy = threading.Event()
+        release = threading.Event()
+        seqs = list()
+
+        def callback(msg):
+            seqs.append(msg.seq)
+            busy.set()
+            release.wait(5)
+
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        try:
+            listener = g.add_listener(g.topic("busy"), callback)
+            for i in range(3):
+                self.master.publish("busy", message("org.arl.fjage.Message", None, "x", seq=i))
+            self.assertTrue(busy.wait(5))
+            for i in range(50):
+                if len(listener.lanes.get("#busy", ())) == 2:
+                    break
+                time.sleep(0.01)
+        finally:
+            g._disconnect()
+        # messages still queued behind the busy callback are dropped once it returns
+        release.set()
+        for i in range(50):
+            if not listener.lanes:
+                break
+            time.sleep(0.01)
+        self.assertEqual(listener.lanes, {})
+        self.assertEqual(seqs, [0])
+
+    def test_queue_limits(self):
+        for policy, seqs in ((org_arl_fjage_remote.Gateway.DROP_OLDEST, [7, 8, 9]),
+                             (org_arl_fjage_remote.Gateway.DROP_NEWEST, [0, 1, 2]),
+                             (org_arl_fjage_remote.Gateway.BLOCK, list(range(10)))):
+            g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+            try:
+                g.set_queue_limits(size=3, policy=policy)
+                topic = g.topic("limits")
+                g.subscribe(topic)
+                for i in range(10):
+                    self.master.publish("limits", message("org.arl.fjage.Message", None, "x", seq=i))
+                for i in range(50):
+                    if len(g.q) == 3 and g.q.dropped == 10 - len(seqs):
+                        break
+                    time.sleep(0.01)
+                time.sleep(0.05)
+                self.assertEqual(len(g.q), 3, policy)
+                got = list()
+                while len(got) < len(seqs):
+                    msg = g.receive(topic, 1000)
+                    if msg is None:
+                        break
+                    got.append(msg.seq)
+                self.assertEqual(got, seqs, policy)
+                self.assertIsNone(g.receive(topic, 50))
+                self.assertEqual(g.stats()["queue"]["dropped"], 10 - len(seqs), policy)
+            finally:
+                g._disconnect()
+
+    def test_queue_block_shutdown(self):
+        with FakeMaster() as master:
+            g = org_arl_fjage_remote.Gateway(master.host, master.port)
+            g.set_queue_limits(size=1, policy=org_arl_fjage_remote.Gateway.BLOCK)
+            g.subscribe(g.topic("limits"))
+            master.publish("limits", message("org.arl.fjage.Message", None, "x"), 5)
+            for i in range(50):
+                if len(g.q) == 1:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.05)
+            # the receive thread is blocked waiting for space in the queue
+            self.assertTrue(g.recv_thread.is_alive())
+            g.shutdown()
+            g.recv_thread.join(5)
+            self.assertFalse(g.recv_thread.is_alive())
+
+    def test_waiters_block(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port)
+        try:
+            g.set_queue_limits(size=2, policy=org_arl_fjage_remote.Gateway.BLOCK)
+            topic = g.topic("block")
+            g.subscribe(topic)
+            for i in range(10):
+                self.master.publish("block", message("org.arl.fjage.Message", None, "x", seq=i))
+            time.sleep(0.1)
+            # messages held back while the queue was full are received in order, before later ones
+            self.assertEqual([g.receive(topic, 1000).seq for i in range(10)], list(range(10)))
+        finally:
+            g._disconnect()
+
+    def test_pool(self):
+        with org_arl_fjage_remote.GatewayPool(self.master.host, self.master.port, size=2) as pool:
+            req = org_arl_fjage.Message(recipient='echo')
+            self.assertEqual(pool.request(req, 1000).inReplyTo, req.msgID)
+            gw1 = pool.checkout()
+            gw2 = pool.checkout()
+            self.assertIsNot(gw1, gw2)
+            self.assertIsNone(pool.checkout(100))
+            pool.checkin(gw1)
+            with pool.gateway(100) as gw:
+                self.assertIs(gw, gw1)
+            pool.checkin(gw2)
+            stats = pool.stats()
+            self.assertEqual((stats["free"], stats["checkouts"], stats["checkout_waits"]), (2, 3, 1))
+        self.assertFalse(self.master.is_shutdown)
+        self.assertEqual(self.g.agentForService(SHELL), "shell")
+
+    def test_pool_replace(self):
+        with FakeMaster() as master:
+            with org_arl_fjage_remote.GatewayPool(master.host, master.port, size=2, health_interval=100) as pool:
+                gw = pool.gateways[0]
+                # the gateway stops answering pings, as if its connection had hung
+                gw._ping = lambda: False
+                for i in range(50):
+                    # the gateway replaced is closed after the pool is updated
+                    if gw.closing.is_set():
+                        break
+                    time.sleep(0.05)
+                self.assertGreater(pool.stats()["replaced"], 0)
+                self.assertNotIn(gw, pool.gateways)
+                self.assertTrue(gw.closing.is_set())
+                req = org_arl_fjage.Message(recipient='echo')
+                self.assertEqual(pool.request(req, 1000).inReplyTo, req.msgID)
+                self.assertFalse(master.is_shutdown)
+            self.assertFalse(master.is_shutdown)
+            g = org_arl_fjage_remote.Gateway(master.host, master.port)
+            try:
+                self.assertEqual(g.agentForService(SHELL), "shell")
+            finally:
+                g.shutdown()
+            self.assertTrue(master.wait_shutdown(5))
+
+    def test_reconnect(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port, max_backoff=200, buffer_size=10)
+        try:
+            topic = g.topic("reconnect")
+            g.subscribe(topic)
+            n = self.master.sunk
+            fut = g.request_async(org_arl_fjage.Message(recipient='sink'), 5000)
+            self.assertTrue(self.master.wait_sunk(n + 1, 5))
+            self.master.drop()
+            with self.assertRaises(ConnectionError):
+                fut.result()
+            self.assertTrue(g.send(org_arl_fjage.Message(recipient='sink')))
+            req = org_arl_fjage.Message(recipient='echo')
+            self.assertEqual(g.request(req, 5000).inReplyTo, req.msgID)
+            self.assertTrue(self.master.wait_sunk(n + 2, 5))
+            self.master.publish("reconnect", message("org.arl.fjage.Message", None, "x"))
+            self.assertIsNotNone(g.receive(topic, 1000))
+            self.assertEqual(g.stats()["reconnects"], 1)
+        finally:
+            g._disconnect()
+        for i in range(50):
+            if self.g.connected:
+                break
+            time.sleep(0.1)
+        self.assertEqual(self.g.agentForService(SHELL), "shell")
+
+    def test_master_shutdown(self):
+        with FakeMaster() as master:
+            g = org_arl_fjage_remote.Gateway(master.host, master.port, max_backoff=200)
+            try:
+                self.assertEqual(g.agentForService(SHELL), "shell")
+                # the master keeps listening, so the gateway could reconnect if it tried
+                master.broadcast({"action": "shutdown"})
+                master.drop()
+                self.assertTrue(g.closing.wait(5))
+                g.recv_thread.join(5)
+                self.assertFalse(g.recv_thread.is_alive())
+                self.assertFalse(g.connected)
+                self.assertEqual(g.stats()["reconnects"], 0)
+            finally:
+                g._disconnect()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets not supported")
+    def test_unix(self):
+        with tempfile.TemporaryDirectory() as d:
+            with FakeMaster(path=os.path.join(d, "fjage.sock")) as master:
+                g = org_arl_fjage_remote.Gateway(master.host)
+                try:
+                    self.assertEqual(g.agentForService(SHELL), "shell")
+                    req = org_arl_fjage.Message(recipient='echo')
+                    self.assertEqual(g.request(req, 1000).inReplyTo, req.msgID)
+                finally:
+                    g.shutdown()
+
+    @unittest.skipUnless(benchmarks.fakemaster.msgpack, "msgpack not installed")
+    def test_msgpack(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port, wire='msgpack')
+        try:
+            self.assertTrue(g.binary)
+            req = org_arl_fjage.Message(recipient='echo')
+            self.assertEqual(g.request(req, 1000).inReplyTo, req.msgID)
+            topic = g.topic("signal")
+            g.subscribe(topic)
+            self.master.publish("signal", message("org.arl.fjage.GenericMessage", None, "x",
+                                                  signal={"clazz": "[F", "data": "AACAPwAAAEA="}))
+            self.assertEqual(list(g.receive(topic, 1000).signal), [1.0, 2.0])
+        finally:
+            g._disconnect()
+        with FakeMaster(wire_formats=False) as master:
+            g = org_arl_fjage_remote.Gateway(master.host, master.port, wire='msgpack')
+            try:
+                self.assertFalse(g.binary)
+                self.assertEqual(g.agentForService(SHELL), "shell")
+            finally:
+                g.shutdown()
+
+    @unittest.skipUnless(benchmarks.fakemaster.msgpack, "msgpack not installed")
+    def test_compression(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port, wire='msgpack', compression='zlib')
+        try:
+            topic = g.topic("text")
+            g.subscribe(topic)
+            self.master.publish("text", message("org.arl.fjage.GenericMessage", None, "x", map={"s": "a" * 10000}))
+            self.assertEqual(g.receive(topic, 1000).s, "a" * 10000)
+            n = self.master.sunk
+            msg = org_arl_fjage.GenericMessage(recipient='sink')
+            msg.s = "b" * 10000
+            self.assertTrue(g.send(msg))
+            self.assertTrue(self.master.wait_sunk(n + 1, 5))
+            stats = g.stats()["compression"]
+            self.assertEqual((stats["method"], stats["frames"], stats["decompressed_frames"]), ("zlib", 1, 1))
+            self.assertLess(stats["ratio"], 0.1)
+        finally:
+            g._disconnect()
+
+    @unittest.skipUnless(benchmarks.fakemaster.msgpack, "msgpack not installed")
+    def test_profiling(self):
+        n = 20
+        for wire in ('json', 'msgpack'):
+            g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port, wire=wire)
+            try:
+                topic = g.topic("profile")
+                g.subscribe(topic)
+                g.start_profiling()
+                # the receive thread may have started reading before profiling started, so count from a first
+                # message onwards
+                self.master.publish("profile", message("org.arl.fjage.Message", None, "x", seq=-1))
+                self.assertEqual(g.receive(topic, 1000).seq, -1)
+                before = dict((k, c[0]) for k, c in g.profiler.stages.items())
+                for i in range(n):
+                    self.master.publish("profile", message("org.arl.fjage.Message", None, "x", seq=i))
+                self.assertEqual([g.receive(topic, 1000).seq for i in range(n)], list(range(n)))
+                g.stop_profiling()
+                stages = dict((k, c[0] - before.get(k, 0)) for k, c in g._profile.stages.items())
+                self.assertEqual(stages.get("recv;enqueue", 0) + stages.get("recv;notify", 0), n, wire)
+                self.assertEqual(stages["receive;queue"], n, wire)
+                self.assertEqual(stages["receive;decode"], n, wire)
+                if g.binary:
+                    # messages are parsed and dispatched on the receive thread
+                    self.assertEqual((stages["recv;parse"], stages["recv;dispatch"]), (n, n))
+                else:
+                    # messages are queued unparsed, and parsed when first matched against a filter
+                    self.assertEqual(stages["recv;peek"], n)
+                    self.assertEqual(stages.get("recv;parse", 0) + stages.get("receive;parse", 0), n)
+                    self.assertNotIn("recv;dispatch", stages)
+                self.assertIn("receive;decode", g.profile())
+            finally:
+                g._disconnect()
+
+    def test_directory_cache(self):
+        g = org_arl_fjage_remote.Gateway(self.master.host, self.master.port, directory_ttl=10000, negative_ttl=100)
+        try:
+            self.assertEqual(g.resolveServices([SHELL, "none", SHELL]), ["shell", None, "shell"])
+            self.assertEqual(g.agentForService(SHELL), "shell")
+            agents = g.agentsForService(SHELL)
+            self.assertEqual(agents, ["shell"])
+            agents.append("x")
+            self.assertIsNone(g.agentForService("none"))
+            stats = g.stats()["directory"]
+            self.assertEqual((stats["hits"], stats["misses"]), (2, 4))
+            self.assertEqual(len(g.pending), 0)
+            # changing a list returned does not change the cached list
+            agents = g.agentsForService(SHELL)
+            self.assertEqual(agents, ["shell"])
+            agents.append("x")
+            self.assertEqual(g.agentsForService(SHELL), ["shell"])
+            time.sleep(0.2)
+            self.assertIsNone(g.agentForService("none"))
+            g.invalidate(SHELL)
+            self.assertEqual(g.agentForService(SHELL), "shell")
+            self.assertEqual(g.stats()["directory"]["misses"], 6)
+        finally:
+            g._disconnect()
+
+
+class AsyncGatewayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.master = FakeMaster()
+
+    def tearDown(self):
+        self.master.close()
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 10))
+
+    def test_open(self):
+        async def run():
+            gw = await org_arl_fjage_remote.AsyncGateway.open(self.master.host, self.master.port, codec='json')
+            try:
+                self.assertIsInstance(gw.codec, org_arl_fjage_remote._StdlibCodec)
+                self.assertEqual(await gw.agent_for_service(SHELL), "shell")
+            finally:
+                await gw.close()
+        self.run_async(run())
+
+    def test_request(self):
+        async def run():
+            async with org_arl_fjage_remote.AsyncGateway(self.master.host, self.master.port) as gw:
+                reqs = [org_arl_fjage.Message(recipient='echo') for i in range(100)]
+                rsps = await asyncio.gather(*[gw.request(req, 1000) for req in reqs])
+                self.assertEqual([rsp.inReplyTo for rsp in rsps], [req.msgID for req in reqs])
+                self.assertIsNone(await gw.request(org_arl_fjage.Message(recipient='sink'), 100))
+                self.assertIsNone(await gw.request(org_arl_fjage.Message(), 100))
+                self.assertEqual(len(gw._replies), 0)
+        self.run_async(run())
+
+    def test_blocking(self):
+        async def run():
+            async with org_arl_fjage_remote.AsyncGateway(self.master.host, self.master.port) as gw:
+                req = org_arl_fjage.Message(recipient='echo')
+                self.assertEqual((await gw.request(req, gw.BLOCKING)).inReplyTo, req.msgID)
+                self.assertEqual(await gw.agent_for_service(SHELL, gw.BLOCKING), "shell")
+                self.assertEqual(await gw.agents_for_service(SHELL, gw.BLOCKING), ["shell"])
+                # waits for a response that never comes, rather than timing out straight away
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(gw.request(org_arl_fjage.Message(recipient='sink'), gw.BLOCKING), 0.2)
+                self.assertEqual(len(gw._replies), 0)
+        self.run_async(run())
+
+    def test_receive(self):
+        async def run():
+            async with org_arl_fjage_remote.AsyncGateway(self.master.host, self.master.port) as gw:
+                topic = gw.topic("abc")
+                sub = gw.subscribe(topic)
+                sub.close()
+                self.assertIsNone(await gw.receive(topic, 100))
+                self.master.publish("abc", message("org.arl.fjage.GenericMessage", None, "x", map={"n": 1}))
+                msg = await gw.receive(topic, 1000)
+                self.assertEqual(msg.n, 1)
+                # a receiver waiting when the message arrives gets it
+                fut = asyncio.ensure_future(gw.receive(org_arl_fjage.GenericMessage, 1000))
+                await asyncio.sleep(0.05)
+                self.master.publish("abc", message("org.arl.fjage.GenericMessage", None, "x", map={"n": 2}))
+                self.assertEqual((await fut).n, 2)
+        self.run_async(run())
+
+    def test_disconnect(self):
+        async def run():
+            gw = await org_arl_fjage_remote.AsyncGateway.open(self.master.host, self.master.port)
+            try:
+                sub = gw.subscribe(gw.topic("abc"))
+                req = asyncio.ensure_future(gw.request(org_arl_fjage.Message(recipient='sink'), 5000))
+                rcv = asyncio.ensure_future(gw.receive(org_arl_fjage.GenericMessage, 5000))
+                await asyncio.sleep(0.05)
+                self.master.drop()
+                with self.assertRaises(ConnectionError):
+                    await req
+                with self.assertRaises(ConnectionError):
+                    await rcv
+                with self.assertRaises(StopAsyncIteration):
+                    await sub.__anext__()
+                with self.assertRaises(ConnectionError):
+                    await gw.request(org_arl_fjage.Message(recipient='echo'), 1000)
+            finally:
+                await gw.close()
+        self.run_async(run())
+
+
+class LoggingTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        # back to the state before logging is configured
+        org_arl_fjage.configure_logging(logging.NOTSET, None)
+
+    def test_not_configured(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp, FakeMaster() as master:
+            os.chdir(tmp)
+            try:
+                g = org_arl_fjage_remote.Gateway(master.host, master.port)
+                try:
+                    self.assertEqual(g.agentForService(SHELL), "shell")
+                finally:
+                    g.shutdown()
+                self.assertEqual(os.listdir(tmp), [])
+            finally:
+                os.chdir(cwd)
+        handlers = logging.getLogger('org.arl.fjage').handlers
+        self.assertEqual([type(h) for h in handlers], [logging.NullHandler])
+
+    def test_configure(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "logs", "log-python.txt")
+            org_arl_fjage.configure_logging(logging.DEBUG, filename, max_payload=16)
+            logger = logging.getLogger('org.arl.fjage')
+            self.assertTrue(any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers))
+            with FakeMaster() as master:
+                g = org_arl_fjage_remote.Gateway(master.host, master.port)
+                try:
+                    self.assertEqual(g.agentForService(SHELL), "shell")
+                finally:
+                    g.shutdown()
+            # stops the log listener, which writes out the records queued
+            org_arl_fjage.configure_logging(logging.NOTSET, None)
+            self.assertEqual([type(h) for h in logger.handlers], [logging.NullHandler])
+            with open(filename) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(any("|INFO|" in s and "Connecting to" in s for s in lines))
+            self.assertTrue(any("|DEBUG|" in s and "<<<" in s and s.endswith("bytes)") for s in lines))
+
+    def test_disable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "log-python.txt")
+            org_arl_fjage.configure_logging(None, filename)
+            self.assertTrue(logging.getLogger('org.arl.fjage').disabled)
+            self.assertFalse(os.path.exists(filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
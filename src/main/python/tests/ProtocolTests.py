@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import unittest
+import subprocess
+import unittest.mock
+import fjagepy
+from fjagepy import *
+from fjagepy.org_arl_fjage import CompactMessage
+from fjagepy.org_arl_fjage_remote import _GatewayBase
+from fjagepy.org_arl_fjage_remote import _peek
+from fjagepy.org_arl_fjage_remote import _MessageQueue
+from fjagepy.org_arl_fjage_remote import MessageRegistry
+from fjagepy.org_arl_fjage_remote import _Compressor, _Stats, _FRAME
+from fjagepy.org_arl_fjage_remote import _json_codec, _StdlibCodec
+
+
+def line(obj):
+    return (json.dumps(obj, separators=(',', ':')) + '\n').encode()
+
+
+def msg(msgID, recipient='gw', inReplyTo=None, clazz='org.arl.fjage.Message'):
+    return {"clazz": clazz, "data": {"msgID": msgID, "recipient": recipient, "inReplyTo": inReplyTo}}
+
+
+class ProtocolTestCase(unittest.TestCase):
+
+    def test_peek(self):
+        data = {"signal": {"clazz": "[F", "data": "A" * 4096}, "msgID": "1", "perf": "INFORM", "recipient": "#phy__ntf", "sender": "phy", "inReplyTo": "2"}
+        rq = {"action": "send", "message": {"clazz": "org.arl.unet.phy.RxBasebandSignalNtf", "data": data}, "relay": False}
+        self.assertEqual(_peek(line(rq)), ("send", "org.arl.unet.phy.RxBasebandSignalNtf", "#phy__ntf", "2"))
+        data = {"msgID": "1", "perf": "INFORM", "recipient": "gw", "sender": "x", "map": {"recipient": "y", "s": "A" * 4096}}
+        rq = {"action": "send", "message": {"clazz": "org.arl.fjage.GenericMessage", "data": data}, "relay": False}
+        self.assertEqual(_peek(line(rq)), ("send", "org.arl.fjage.GenericMessage", "gw", None))
+        self.assertEqual(_peek(line({"id": "1", "action": "agents"})), ("agents", None, None, None))
+        self.assertIsNone(_peek(line({"id": "1", "inResponseTo": "agents", "agentIDs": []})))
+        rq = {"action": "send", "message": {"clazz": "a.B", "data": {"inner": {"recipient": "z"}, "s": "A" * 4096}}}
+        self.assertIsNone(_peek(line(rq)))
+
+    def test_peek_reply(self):
+        # fields of the message class come first, so inReplyTo may be past the window with recipient in it
+        for n in range(0, 1200, 20):
+            data = {"text": "x" * n, "msgID": "1", "perf": "AGREE", "recipient": "gw", "sender": "echo"}
+            rq = {"action": "send", "message": {"clazz": "org.arl.fjage.Message", "data": data}, "relay": False}
+            self.assertEqual(_peek(line(rq)), ("send", "org.arl.fjage.Message", "gw", None), n)
+            data["inReplyTo"] = "2"
+            self.assertEqual(_peek(line(rq)), ("send", "org.arl.fjage.Message", "gw", "2"), n)
+
+    def test_queue_order(self):
+        q = _MessageQueue()
+        req = org_arl_fjage.Message()
+        for i in range(100):
+            q.append(msg(str(i), recipient='#ntf'))
+        q.append(msg('rsp', inReplyTo=req.msgID))
+        q.append(msg('gm', clazz='org.arl.fjage.GenericMessage'))
+        self.assertEqual(q.pop(req)["data"]["msgID"], 'rsp')
+        self.assertEqual(q.pop(org_arl_fjage.GenericMessage)["data"]["msgID"], 'gm')
+        self.assertEqual(q.pop()["data"]["msgID"], '0')
+        self.assertEqual(q.pop(org_arl_fjage.Message)["data"]["msgID"], '1')
+        self.assertEqual(q.pop(org_arl_fjage.AgentID('ntf', True))["data"]["msgID"], '2')
+        self.assertEqual(len(q), 97)
+
+    def test_queue_index(self):
+        q = _MessageQueue()
+        req = org_arl_fjage.Message()
+        q.append(msg('a', recipient='#ntf'))
+        q.append(msg('r1', inReplyTo=req.msgID))
+        q.append(msg('b', recipient='other', clazz='com.example.Message'))
+        q.append(msg('r2', inReplyTo=req.msgID, recipient='#ntf'))
+        q.append(msg('gm', clazz='org.arl.fjage.GenericMessage'))
+        self.assertEqual([m["data"]["msgID"] for m in q], ['a', 'r1', 'b', 'r2', 'gm'])
+        # each index hands out the oldest matching message
+        self.assertEqual(q.pop(req)["data"]["msgID"], 'r1')
+        self.assertEqual(q.pop(req)["data"]["msgID"], 'r2')
+        self.assertIsNone(q.pop(req))
+        self.assertIsNone(q.pop(org_arl_fjage.Message(inReplyTo=req.msgID)))
+        # classes are indexed by name without their package
+        self.assertEqual(q.pop(org_arl_fjage.Message)["data"]["msgID"], 'a')
+        self.assertEqual(q.pop(org_arl_fjage.Message)["data"]["msgID"], 'b')
+        self.assertIsNone(q.pop(org_arl_fjage.AgentID('ntf', True)))
+        self.assertIsNone(q.pop(org_arl_fjage.AgentID('other')))
+        self.assertIsNone(q.pop(lambda m: True))
+        self.assertEqual(q.pop(lambda m: True, lambda f, m: f(m))["data"]["msgID"], 'gm')
+        self.assertEqual(len(q), 0)
+        self.assertIsNone(q.pop())
+
+    def test_queue_compact(self):
+        q = _MessageQueue()
+        for i in range(300):
+            q.append(msg(str(i), recipient='#a' if i % 3 else '#b'), 10)
+        got = q.pop_many(org_arl_fjage.AgentID('a', True), 150)
+        self.assertEqual([m["data"]["msgID"] for m in got[:3]], ['1', '2', '4'])
+        self.assertEqual((len(q), q.nbytes), (150, 1500))
+        # entries taken through an index are skipped by the others
+        self.assertEqual([q.pop()["data"]["msgID"] for i in range(3)], ['0', '3', '6'])
+        self.assertEqual(q.pop(org_arl_fjage.AgentID('a', True))["data"]["msgID"], '226')
+        self.assertEqual(len(list(q)), len(q))
+        q.clear()
+        self.assertEqual((len(q), q.nbytes, list(q)), (0, 0, []))
+
+    def test_queue_limits(self):
+        q = _MessageQueue()
+        q.set_limits(capacity=10)
+        for i in range(100):
+            q.append(msg(str(i)), 10)
+        self.assertEqual((len(q), q.dropped, q.nbytes), (10, 90, 100))
+        self.assertEqual(q.pop()["data"]["msgID"], '90')
+        q = _MessageQueue()
+        q.set_limits(capacity=10, policy=_MessageQueue.DROP_NEWEST)
+        for i in range(100):
+            q.append(msg(str(i)))
+        self.assertEqual(q.pop()["data"]["msgID"], '0')
+        q = _MessageQueue()
+        q.set_limits(topic_capacity={'a': 5})
+        for i in range(100):
+            q.append(msg(str(i), recipient='#a'))
+            q.append(msg(str(i), recipient='#b'))
+        self.assertEqual((len(q), q.dropped), (105, 95))
+        self.assertEqual(q.pop(org_arl_fjage.AgentID('a', True))["data"]["msgID"], '95')
+
+    def test_queue_bytes(self):
+        q = _MessageQueue()
+        q.set_limits(max_bytes=100)
+        q.append(msg('big'), 500)
+        self.assertEqual(len(q), 1)
+        for i in range(10):
+            q.append(msg(str(i)), 30)
+        self.assertEqual((len(q), q.nbytes, q.dropped), (3, 90, 8))
+        self.assertEqual(q.pop()["data"]["msgID"], '7')
+        q = _MessageQueue()
+        q.set_limits(capacity=2, policy=_MessageQueue.BLOCK, topic_capacity=0)
+        self.assertFalse(q.append(msg('t', recipient='#a')))
+        self.assertTrue(q.append(msg('0')))
+        self.assertTrue(q.append(msg('1')))
+        self.assertTrue(q.is_full())
+        # with BLOCK, the caller waits for space; nothing is dropped
+        self.assertFalse(q.append(msg('2')))
+        self.assertEqual((len(q), q.dropped, q.peak), (2, 1, 2))
+        with self.assertRaises(ValueError):
+            q.set_limits(policy='drop-all')
+
+    def test_queue_expire(self):
+        q = _MessageQueue()
+        q.set_limits(reply_ttl=0.05)
+        q.append(msg('r1', inReplyTo='1'))
+        q.append(msg('n1'))
+        time.sleep(0.1)
+        q.append(msg('r2', inReplyTo='2'))
+        # orphaned replies expire, other messages stay however old
+        self.assertEqual([m["data"]["msgID"] for m in q], ['n1', 'r2'])
+        self.assertEqual(q.expired, 1)
+        time.sleep(0.1)
+        self.assertEqual(q.expire(), 1)
+        self.assertEqual((len(q), q.expired), (1, 2))
+
+    def test_registry(self):
+        r = MessageRegistry()
+        self.assertIs(r.lookup('org.arl.fjage.GenericMessage'), org_arl_fjage.GenericMessage)
+        self.assertIs(r.lookup('org.arl.fjage.shell.ShellExecReq'), org_arl_fjage_shell.ShellExecReq)
+        self.assertIsNone(r.lookup('com.example.PingReq'))
+
+        @r.register('com.example.PingReq')
+        class PingReq(org_arl_fjage.Message):
+            pass
+
+        self.assertIs(r.lookup('com.example.PingReq'), PingReq)
+        self.assertEqual(r.java_name(PingReq), 'com.example.PingReq')
+        self.assertEqual(r.java_name(org_arl_fjage_shell.ShellExecReq), 'org.arl.fjage.shell.ShellExecReq')
+        r.register_package('com.example.more', 'fjagepy')
+        self.assertIs(r.lookup('com.example.more.Message'), org_arl_fjage.Message)
+
+    def test_compact_message(self):
+
+        class PingReq(CompactMessage):
+            __slots__ = ('count', 'type_', 'data')
+            defaults = {'perf': org_arl_fjage.Performative.REQUEST, 'count': 1}
+
+        ping = PingReq(recipient='abc', type_=2, data=b'\x01\x02')
+        self.assertFalse(hasattr(ping, '__dict__'))
+        with self.assertRaises(AttributeError):
+            ping.other = 1
+        self.assertEqual(uuid.UUID(ping.msgID).version, 4)
+        self.assertNotEqual(ping.msgID, PingReq().msgID)
+        self.assertEqual(_GatewayBase()._to_json(ping), {'count': 1, 'type': 2, 'data': {'clazz': '[B', 'data': 'AQI='},
+                                                         'msgID': ping.msgID, 'perf': 'REQUEST', 'recipient': 'abc'})
+        self.assertEqual(str(ping), 'REQUEST: PingReq')
+        # a compact request is a filter for its reply, like any other message
+        q = _MessageQueue()
+        q.append(msg('rsp', inReplyTo=ping.msgID))
+        self.assertEqual(q.pop(ping)["data"]["msgID"], 'rsp')
+
+    def test_codecs(self):
+        rq = {"action": "send", "message": {"clazz": "org.arl.fjage.Message", "data": {"msgID": "1", "text": "\u00b5s"}}}
+        for name in ('orjson', 'ujson', 'json'):
+            with self.subTest(codec=name):
+                try:
+                    codec = _json_codec(name)
+                except ImportError:
+                    continue
+                self.assertEqual(codec.name, name)
+                data = codec.dumps(rq)
+                self.assertIsInstance(data, bytes)
+                self.assertTrue(data.endswith(b'\n'))
+                self.assertEqual(codec.loads(data), rq)
+                self.assertEqual(codec.loads(line(rq)), rq)
+                # the Java side may send NaN, which not every codec parses
+                self.assertTrue(math.isnan(codec.loads(b'{"x":NaN}\n')["x"]))
+
+    def test_codec_fallback(self):
+        with unittest.mock.patch.dict(sys.modules, {'orjson': None, 'ujson': None}):
+            self.assertIsInstance(_json_codec(), _StdlibCodec)
+            with self.assertRaises(ImportError):
+                _json_codec('orjson')
+        with self.assertRaises(ValueError):
+            _json_codec('yaml')
+        codec = _StdlibCodec()
+        self.assertIs(_json_codec(codec), codec)
+
+    def test_stats(self):
+        stats = _Stats()
+        stats.count(stats.sent, 'send', 100)
+        stats.count(stats.sent, 'send', 50)
+        for dt in (0.5e-6, 3e-6, 3e-6, 100.0):
+            stats.add_rtt(dt)
+        snap = stats.snapshot()
+        self.assertEqual(snap["sent"], {'send': {"msgs": 2, "bytes": 150}})
+        # round trip times land in power-of-two buckets of microseconds, the last one open ended
+        counts = snap["rtt"]["counts"]
+        self.assertEqual((counts[0], counts[2], counts[-1], sum(counts)), (1, 2, 1, 4))
+        self.assertAlmostEqual(snap["rtt"]["mean_ms"], 25000.0017, 3)
+        self.assertIsNone(_Stats().snapshot()["rtt"]["mean_ms"])
+        self.assertIsNone(snap["compression"]["ratio"])
+
+    def test_compressor(self):
+        c = _Compressor('zlib', threshold=512)
+        stats = _Stats()
+
+        def frame(payload):
+            return _FRAME.pack(len(payload), 0) + payload
+
+        small = frame(b'\0' * 100)
+        self.assertIs(c.compress(small, stats), small)
+        zeros = frame(b'\0' * 5000)
+        compressed = c.compress(zeros, stats)
+        n, flags = _FRAME.unpack_from(compressed)
+        self.assertEqual((n + _FRAME.size, flags), (len(compressed), 1))
+        self.assertEqual(c.decompress(flags, compressed[_FRAME.size:], stats), b'\0' * 5000)
+        # noise does not compress, so frames of that size are mostly skipped from then on
+        for i in range(32):
+            noise = frame(os.urandom(20000))
+            self.assertIs(c.compress(noise, stats), noise)
+        self.assertEqual(stats.compress_skipped, 30)
+        self.assertEqual(c.effective_threshold(), 512)
+
+
+class PackageTestCase(unittest.TestCase):
+
+    def test_lazy_import(self):
+        # run in a fresh interpreter, as other tests have imported the subpackages already
+        code = "import sys, fjagepy; print(sorted(m for m in sys.modules if m.startswith('fjagepy.')))"
+        path = os.path.dirname(os.path.dirname(os.path.abspath(fjagepy.__file__)))
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=path, env=dict(os.environ, PYTHONPATH=path))
+        self.assertEqual(out.decode().strip(), "[]")
+
+    def test_exports(self):
+        from fjagepy import org_arl_fjage, org_arl_fjage_remote
+        self.assertIs(fjagepy.Gateway, org_arl_fjage_remote.Gateway)
+        self.assertIs(fjagepy.Message, org_arl_fjage.Message)
+        self.assertIs(fjagepy.configure_logging, org_arl_fjage.configure_logging)
+        with self.assertRaises(AttributeError):
+            fjagepy.NoSuchName
+        names = dir(fjagepy)
+        for name in fjagepy.__all__ + list(fjagepy._exports):
+            self.assertIn(name, names)
+            self.assertIsNotNone(getattr(fjagepy, name))
+        self.assertEqual(names, sorted(set(names)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+/******************************************************************************
+
+Copyright (c) 2015, Mandar Chitre
+
+This file is part of fjage which is released under Simplified BSD License.
+See file LICENSE.txt or go to http://www.opensource.org/licenses/BSD-3-Clause
+for full license details.
+
+******************************************************************************/
+
+package org.arl.fjage.remote;
+
+import static org.junit.Assert.*;
+import java.io.IOException;
+import java.nio.*;
+import java.util.*;
+import org.arl.fjage.*;
+import org.junit.*;
+import com.google.gson.*;
+
+public class WireFormatTests {
+
+  public static class DataMsg extends Message {
+    private static final long serialVersionUID = 1L;
+    float[] signal;
+    int[] counts;
+    double x;
+    long big;
+    String text;
+    boolean flag;
+  }
+
+  private DataMsg dataMsg() {
+    DataMsg msg = new DataMsg();
+    msg.setRecipient(new AgentID("abc"));
+    msg.signal = new float[] { 1.5f, -2.0f };
+    msg.counts = new int[] { 1, 2, 3 };
+    msg.x = 0.25;
+    msg.big = -(1L << 40);
+    msg.text = "hello";
+    msg.flag = true;
+    return msg;
+  }
+
+  @Test
+  public void testMsgPackRoundTrip() throws IOException {
+    DataMsg msg = dataMsg();
+    JsonMessage rq = new JsonMessage();
+    rq.action = Action.SEND;
+    rq.message = msg;
+    rq.relay = false;
+    JsonElement tree = MsgPack.decode(rq.toMsgPack());
+    // decodes to the same tree as the JSON encoding, with arrays back in base 64
+    assertEquals(new JsonParser().parse(rq.toJson()), tree);
+    JsonMessage rq1 = JsonMessage.fromJson(tree);
+    assertEquals(Action.SEND, rq1.action);
+    assertEquals(false, rq1.relay);
+    DataMsg msg1 = (DataMsg)rq1.message;
+    assertEquals(msg.getMessageID(), msg1.getMessageID());
+    assertEquals(msg.getRecipient(), msg1.getRecipient());
+    assertNull(msg1.getInReplyTo());
+    assertArrayEquals(msg.signal, msg1.signal, 0.0f);
+    assertArrayEquals(msg.counts, msg1.counts);
+    assertEquals(msg.x, msg1.x, 0.0);
+    assertEquals(msg.big, msg1.big);
+    assertEquals(msg.text, msg1.text);
+    assertTrue(msg1.flag);
+  }
+
+  @Test
+  public void testMsgPackRawArrays() throws IOException {
+    JsonMessage rq = new JsonMessage();
+    rq.action = Action.SEND;
+    rq.message = dataMsg();
+    byte[] payload = rq.toMsgPack();
+    // the float array is sent as 8 bytes of MessagePack binary data, not as base 64
+    ByteBuffer buf = ByteBuffer.allocate(10).order(ByteOrder.LITTLE_ENDIAN);
+    buf.put((byte)0xc4).put((byte)8).putFloat(1.5f).putFloat(-2.0f);
+    assertTrue(indexOf(payload, buf.array()) >= 0);
+    assertTrue(payload.length < rq.toJson().length());
+  }
+
+  @Test
+  public void testMsgPackResponse() throws IOException {
+    JsonMessage rsp = new JsonMessage();
+    rsp.inResponseTo = Action.AGENTS_FOR_SERVICE;
+    rsp.id = UUID.randomUUID().toString();
+    rsp.agentIDs = new AgentID[] { new AgentID("a"), new AgentID("b") };
+    JsonMessage rsp1 = JsonMessage.fromJson(MsgPack.decode(rsp.toMsgPack()));
+    assertEquals(rsp.inResponseTo, rsp1.inResponseTo);
+    assertEquals(rsp.id, rsp1.id);
+    assertNull(rsp1.action);
+    assertArrayEquals(rsp.agentIDs, rsp1.agentIDs);
+  }
+
+  @Test
+  public void testCompressor() throws IOException {
+    FrameCompressor compressor = new FrameCompressor(512);
+    assertNull(compressor.compress(new byte[100]));
+    byte[] payload = new byte[4096];
+    for (int i = 0; i < payload.length; i++)
+      payload[i] = (byte)(i % 7);
+    byte[] compressed = compressor.compress(payload);
+    assertNotNull(compressed);
+    assertTrue(compressed.length < payload.length/2);
+    assertArrayEquals(payload, FrameCompressor.decompress(compressed));
+    // incompressible frames are sent as they are
+    byte[] noise = new byte[4096];
+    new Random(1).nextBytes(noise);
+    assertNull(compressor.compress(noise));
+  }
+
+  @Test(expected = IOException.class)
+  public void testDecompressTruncated() throws IOException {
+    byte[] payload = new byte[4096];
+    byte[] compressed = new FrameCompressor(512).compress(payload);
+    FrameCompressor.decompress(Arrays.copyOf(compressed, compressed.length/2));
+  }
+
+  private static int indexOf(byte[] data, byte[] sub) {
+    for (int i = 0; i + sub.length <= data.length; i++) {
+      int j = 0;
+      while (j < sub.length && data[i+j] == sub[j])
+        j++;
+      if (j == sub.length) return i;
+    }
+    return -1;
+  }
+
+}